@@ -0,0 +1,149 @@
+"""
+Memory allocated by the preprocessing of each frame, measured with tracemalloc (numpy reports its buffers to it).
+Compares the path of the cameras before local_utils.preprocessing (a resize on every frame even at 100%, a plotted
+copy for the view, an annotated full size copy for the JPEG encoding) with the FramePyramid one, on the same frames
+and with the same steps as VideoProcessor.process_video_frames: the motion proxy, the inference frame, the view
+with --view and the payload of the message, JPEG encoded with --encode-jpeg as in production, else the frame itself
+(copied out of the reused buffers on the pyramid side).
+Every frame is treated as moving and with a person, the worst case.
+
+usage: python -m benchmarks.allocations [--video synthetic] [--scale-sizes 100 50] [--motion-detector optical_flow]
+                                        [--view] [--encode-jpeg]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+import cv2 as cv
+
+from benchmarks.baseline import write_results
+from benchmarks.pipeline import read_frames
+from camera.compositor import ThumbnailSlot
+from local_utils.image_encoding import JpegProfile
+from local_utils.preprocessing import FramePreprocessor, draw_boxes, scaled_size
+
+
+def person_box(frame) -> list[int]:
+    height, width = frame.shape[:2]
+    return [width // 3, height // 4, 2 * width // 3, 3 * height // 4]
+
+
+class LegacyPreprocessing:
+    """The copies made for a frame before FramePreprocessor"""
+
+    def __init__(self, scale_size: int, motion_detector: str, jpeg_profile: JpegProfile = None, view: bool = False):
+        """jpeg_profile: encode the payload, None to ship the frame"""
+        self.scale_size = scale_size
+        self.gray = motion_detector == "optical_flow"
+        self.jpeg_profile = jpeg_profile
+        self.view = view
+
+    def close(self):
+        pass
+
+    def __call__(self, frame):
+        if self.gray:
+            cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+        # rescale_frame resized even at 100%, the message shipped this new frame
+        inference = cv.resize(frame, scaled_size(frame.shape, self.scale_size), interpolation=cv.INTER_AREA)
+        box = person_box(inference)
+        if self.view:
+            # result.plot() then view()
+            plotted = draw_boxes(inference.copy(), [box])
+            cv.resize(plotted, None, fx=0.5, fy=0.5, interpolation=cv.INTER_LINEAR)
+        if self.jpeg_profile is not None:
+            # JpegProfile drew the boxes on a full size copy before downscaling it
+            alert = draw_boxes(inference.copy(), [box], thickness=max(2, max(inference.shape[:2]) // 400))
+            scale = self.jpeg_profile.max_dimension / max(alert.shape[:2])
+            if scale < 1:
+                alert = cv.resize(alert, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+            cv.imencode('.jpg', alert, [cv.IMWRITE_JPEG_QUALITY, self.jpeg_profile.quality])
+
+
+class PyramidPreprocessing:
+    """
+    The same work on the levels of a FramePyramid, as VideoProcessor.process_video_frames does it: the view writes
+    the annotated thumbnail of the inference frame in the shared memory of a ThumbnailSlot, with no rate cap
+    """
+
+    def __init__(self, scale_size: int, motion_detector: str, jpeg_profile: JpegProfile = None, view: bool = False,
+                 motion_scale: int = 100):
+        """jpeg_profile: encode the payload, None to ship the frame"""
+        self.preprocessor = FramePreprocessor(scale_size, proxy_scale=motion_scale,
+                                              proxy_gray=motion_detector == "optical_flow")
+        self.jpeg_profile = jpeg_profile
+        self.thumbnails = ThumbnailSlot(0, "allocations", fps=0) if view else None
+
+    def __call__(self, frame):
+        pyramid = self.preprocessor(frame)
+        pyramid.proxy  # read by the motion detector
+        box = person_box(pyramid.inference)
+        if self.thumbnails is not None:
+            self.thumbnails.write(pyramid.inference, [box])
+        if self.jpeg_profile is not None:
+            self.jpeg_profile.encode(pyramid.inference, [box])
+        elif pyramid.pooled:
+            # the buffers are reused by the next batches, the queue pickles the frame later
+            pyramid.inference.copy()
+
+    def close(self):
+        if self.thumbnails is not None:
+            self.thumbnails.unlink()
+
+
+def measure(step, frames: list) -> tuple[float, float]:
+    """
+    Run step on every frame, after a first frame to allocate the buffers.
+    returns the KiB allocated at the peak of a frame, on average, and the frames/sec
+    """
+    step(frames[0])
+    tracemalloc.start()
+    try:
+        allocated = 0
+        start = time.perf_counter()
+        for frame in frames:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            step(frame)
+            allocated += tracemalloc.get_traced_memory()[1] - current
+        elapsed = time.perf_counter() - start
+    finally:
+        tracemalloc.stop()
+    return allocated / len(frames) / 1024, len(frames) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", default="synthetic:1280x720",
+                        help="a video file or synthetic[:<width>x<height>]")
+    parser.add_argument("--max-frames", type=int, default=200)
+    parser.add_argument("--scale-sizes", type=int, nargs="+", default=[100, 50])
+    parser.add_argument("--motion-detector", choices=["mog2", "optical_flow"], default="mog2")
+    parser.add_argument("--motion-scale", type=int, default=100)
+    parser.add_argument("--view", action="store_true", help="include the view of the frame")
+    parser.add_argument("--encode-jpeg", action="store_true", help="ship the frame JPEG encoded")
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "allocations.csv"))
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.max_frames)
+    jpeg_profile = JpegProfile() if args.encode_jpeg else None
+    rows = []
+    print(f"{'Scale size':>10} {'Method':>10} {'KiB/frame':>10} {'FPS':>8}")
+    for scale_size in args.scale_sizes:
+        methods = {
+            "Legacy": LegacyPreprocessing(scale_size, args.motion_detector, jpeg_profile, args.view),
+            "Pyramid": PyramidPreprocessing(scale_size, args.motion_detector, jpeg_profile, args.view,
+                                            args.motion_scale),
+        }
+        for method, step in methods.items():
+            allocated, fps = measure(step, frames)
+            rows.append([os.path.basename(args.video), scale_size, method, allocated, fps])
+            print(f"{scale_size:>10} {method:>10} {allocated:>10.1f} {fps:>8.1f}")
+            step.close()
+    write_results(args.output, ["Video", "Scale size", "Method", "KiB/frame", "FPS"], rows)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Calibration of the cameras for this host: short runs of VideoProcessor.process_video_frames over a small grid of
+YOLO sizes, scale sizes, batch sizes and torch thread counts. The fields a camera sets in config.yaml are not
+tuned: they keep their value in every run of its grid. For each camera the most accurate configuration
+(largest YOLO, then largest scale) which still sustains its fps is written to config/tuned_profile.<hostname>.yaml.
+When no configuration is fast enough the fastest one is chosen.
+
+usage: python -m benchmarks.autotune [--video synthetic] [--yolo-sizes n s] [--max-frames 60]
+"""
+import argparse
+import os
+import socket
+import time
+
+import torch
+import yaml
+
+from benchmarks.baseline import write_results
+from benchmarks.pipeline import measure_fps
+from local_utils.config import Config, load_config, tuned_profile_path
+from local_utils.logger import get_logger, init_logger
+
+logger = get_logger(__name__)
+
+YOLO_SIZES = ("n", "s", "m", "l", "x")
+
+
+def default_thread_counts(n_cameras: int) -> list[int]:
+    """The cores of the host shared by the camera processes, and fewer"""
+    share = max(1, (os.cpu_count() or 1) // n_cameras)
+    return sorted({1, max(1, share // 2), share})
+
+
+def yolo_model(size: str) -> str:
+    return f"yolo11{size}.pt"
+
+
+def yolo_rank(model: str) -> int:
+    """Position of the model in YOLO_SIZES, the larger the more accurate; 0 for a model not in it"""
+    size = os.path.basename(model)[len("yolo11"):-len(".pt")]
+    return YOLO_SIZES.index(size) if model.startswith("yolo11") and size in YOLO_SIZES else 0
+
+
+def calibrate(video: str, *, yolo_models: list[str], scale_sizes: list[int], batch_sizes: list[int],
+              thread_counts: list[int], max_frames: int = 60, device: str = None, measured: dict = None) -> list[list]:
+    """
+    Measure every configuration of the grid.
+    measured: the fps of the runs already measured, by (video, yolo, scale size, batch size, threads), updated
+    returns the runs: (yolo model, scale size, batch size, threads, fps)
+    """
+    measured = measured if measured is not None else {}
+    rows = []
+    default_threads = torch.get_num_threads()
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for yolo in yolo_models:
+                for scale_size in scale_sizes:
+                    for batch_size in batch_sizes:
+                        key = (video, yolo, scale_size, batch_size, threads)
+                        if key not in measured:
+                            measured[key] = measure_fps(video, max_frames=max_frames, batch_size=batch_size,
+                                                        yolo=yolo, scale_size=scale_size, device=device,
+                                                        warmup_batches=1)
+                            logger.info("%s: %s scale %s%% batch %s threads %s: %.1f fps",
+                                        video, yolo, scale_size, batch_size, threads, measured[key])
+                        rows.append([yolo, scale_size, batch_size, threads, measured[key]])
+    finally:
+        torch.set_num_threads(default_threads)
+    return rows
+
+
+def choose(rows: list[list], target_fps: float) -> list:
+    """
+    The most accurate run (largest YOLO, then largest scale) which sustains target_fps, the fastest one if none does.
+    target_fps: the frames/sec the camera process must sustain
+    """
+    def quality(row):
+        return yolo_rank(row[0]), row[1]
+
+    sustained = [row for row in rows if row[-1] >= target_fps]
+    if sustained:
+        return max(sustained, key=lambda row: (quality(row), row[-1]))
+    logger.warning("no configuration sustains %s fps, choosing the fastest", target_fps)
+    return max(rows, key=lambda row: row[-1])
+
+
+def write_profile(path: str, sources: dict, calibration: dict):
+    profile = {
+        "host": socket.gethostname(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "sources": sources,
+        "calibration": calibration,
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# written by python -m benchmarks.autotune, delete it to go back to config.yaml\n")
+        yaml.safe_dump(profile, f, sort_keys=False)
+
+
+def calibration_video(source, default: str) -> str:
+    """A camera reading a video file is calibrated on it, the live cameras on the default video"""
+    if isinstance(source.source, str) and os.path.isfile(source.source):
+        return source.source
+    return default
+
+
+def source_grid(source, *, yolo_sizes: list[str], scale_sizes: list[int], batch_sizes: list[int],
+                thread_counts: list[int]) -> dict[str, tuple]:
+    """
+    The values of each tuned field to measure for the source: only its own value for the fields set in config.yaml,
+    which the profile doesn't override, so that the other fields are chosen for the configuration it runs
+    """
+    grid = {"yolo": tuple(yolo_model(size) for size in yolo_sizes), "scale_size": tuple(scale_sizes),
+            "batch_size": tuple(batch_sizes), "torch_threads": tuple(thread_counts)}
+    for key in grid:
+        if key in source.configured_keys:
+            grid[key] = (getattr(source, key),)
+    return grid
+
+
+def tune(config: Config, *, video: str = None, max_frames: int = None, yolo_sizes: list[str] = None,
+         scale_sizes: list[int] = None, batch_sizes: list[int] = None, thread_counts: list[int] = None,
+         path: str = None, results: str = None) -> dict:
+    """
+    Calibrate each camera of config, write the tuned profile and apply it to config.
+    Every camera is measured on its calibration video (see calibration_video, the default is video or the tuning
+    section of config.yaml) over the grid of the fields it doesn't set in config.yaml (see source_grid), a run
+    shared by several cameras is measured once. Each camera gets the most accurate configuration which sustains
+    its own fps. The default YOLO sizes are n and s.
+    returns the profile
+    """
+    sources = config.video_frame_controller.sources
+    default_video = video or config.tuning_config["video"]
+    thread_counts = thread_counts or default_thread_counts(len(sources))
+
+    chosen, calibration, measured = {}, {}, {}
+    for source in sources:
+        source_video = calibration_video(source, default_video)
+        grid = source_grid(source, yolo_sizes=yolo_sizes or ["n", "s"], scale_sizes=scale_sizes or [100, 75, 50],
+                           batch_sizes=batch_sizes or [1, 2, 4], thread_counts=thread_counts)
+        rows = calibrate(source_video, yolo_models=grid["yolo"], scale_sizes=grid["scale_size"],
+                         batch_sizes=grid["batch_size"], thread_counts=grid["torch_threads"],
+                         max_frames=max_frames or config.tuning_config["max_frames"], device=source.device,
+                         measured=measured)
+        yolo, scale_size, batch_size, threads, fps = choose(rows, source.fps)
+        chosen[source.id] = {key: value for key, value in (("yolo", yolo), ("scale_size", scale_size),
+                                                           ("batch_size", batch_size), ("torch_threads", threads))
+                             if key not in source.configured_keys}
+        calibration[source.id] = {"video": source_video, "target_fps": source.fps, "measured_fps": round(fps, 1)}
+        logger.info("camera %s: %s, %.1f fps for %s", source.id, chosen[source.id], fps, source.fps)
+    if results is not None:
+        write_results(results, ["Video", "Yolo", "Scale size", "Batch size", "Threads", "FPS"],
+                      [[os.path.basename(key[0]), *key[1:], fps] for key, fps in measured.items()])
+    path = path or tuned_profile_path()
+    write_profile(path, chosen, calibration)
+    logger.info("tuned profile written to %s", path)
+    with open(path, encoding="utf-8") as f:
+        profile = yaml.safe_load(f)
+    config.apply_tuned_profile(profile)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=os.path.join("config", "config.yaml"))
+    parser.add_argument("--video", default=None, help="a video file or synthetic[:<width>x<height>] for the live "
+                                                      "cameras, default: tuning.video of the config")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--yolo-sizes", nargs="+", choices=YOLO_SIZES, default=None,
+                        help="default: n and s, for the sources without a yolo in the config")
+    parser.add_argument("--scale-sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=None)
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--output", default=None, help="default: config/tuned_profile.<hostname>.yaml")
+    parser.add_argument("--results", default=os.path.join("benchmark_results", "autotune.csv"))
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    init_logger(config)
+    profile = tune(config, video=args.video, max_frames=args.max_frames, yolo_sizes=args.yolo_sizes,
+                   scale_sizes=args.scale_sizes, batch_sizes=args.batch_sizes, thread_counts=args.threads,
+                   path=args.output or tuned_profile_path(os.path.dirname(args.config)), results=args.results)
+    print(yaml.safe_dump(profile, sort_keys=False))
+
+
+if __name__ == "__main__":
+    main()
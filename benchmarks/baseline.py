@@ -0,0 +1,46 @@
+"""
+Results of the benchmarks as CSV files, in the schema of "results and plots/*.csv":
+the first columns identify the run (e.g. Video, Method), the last one is the measure, higher is better.
+"""
+import csv
+import os
+
+
+def write_results(path: str, header: list[str], rows: list[list]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([f"{value:.2f}" if isinstance(value, float) else value for value in row])
+
+
+def read_results(path: str) -> tuple[list[str], dict[tuple, float]]:
+    """returns the header and the measure of each run"""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        results = {}
+        for row in reader:
+            if row:
+                results[tuple(row[:-1])] = float(row[-1])
+    return header, results
+
+
+def compare(results_path: str, baseline_path: str, tolerance: float) -> list[str]:
+    """
+    Compare the results with the baseline, the runs missing in either file are ignored.
+    tolerance: accepted relative slowdown, 0.2 fails the runs more than 20% below the baseline
+    returns the description of each regression
+    """
+    header, results = read_results(results_path)
+    baseline_header, baseline = read_results(baseline_path)
+    if header != baseline_header:
+        raise ValueError(f"{results_path} has columns {header}, the baseline {baseline_path} has {baseline_header}")
+    regressions = []
+    for run, value in results.items():
+        expected = baseline.get(run)
+        if expected is not None and value < expected * (1 - tolerance):
+            regressions.append(f"{', '.join(run)}: {value:.2f} {header[-1]}, baseline {expected:.2f} "
+                               f"({(value / expected - 1) * 100:+.0f}%)")
+    return regressions
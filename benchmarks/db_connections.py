@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the database access pattern of the bot and of the notifications:
+many short `with DB() as db:` blocks, each one running a few small queries.
+Compares a new connection for every block (the old behaviour) with the per-thread pool.
+
+usage: python -m benchmarks.db_connections [--ops 5000] [--threads 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db.db_lite import TBDatabase
+
+def populate(db: TBDatabase, n_cameras=10, n_people=50, n_users=5):
+    with db() as conn:
+        for camera_id in range(n_cameras):
+            conn.add_camera(camera_id, f'camera {camera_id}')
+        for person in range(n_people):
+            conn.add_enrolled_person(f'person {person}')
+        for user_id in range(n_users):
+            conn.add_authed_user(user_id)
+
+
+def read_operation(db: TBDatabase, i: int):
+    """What the bot does on every command and send_detection_img on every notification"""
+    with db() as conn:
+        conn.user_is_authed(i % 5)
+        conn.get_users()
+
+
+def write_operation(db: TBDatabase, i: int):
+    """An access list change from the bot"""
+    with db() as conn:
+        conn.update_person_access_list(f'person {i % 50}', i % 10, 'w' if i % 2 else 'b')
+
+
+def run(db: TBDatabase, operation, n_ops: int, n_threads: int) -> float:
+    """Returns the operations per second"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(lambda i: operation(db, i), range(n_ops)))
+    return n_ops / (time.perf_counter() - start)
+
+
+def benchmark(n_ops: int, n_threads: int) -> list[tuple[str, str, float]]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scenarios = {
+            'connection per block': dict(pooled=False, wal=False),
+            'pooled WAL': dict(pooled=True, wal=True),
+        }
+        for i, (name, kwargs) in enumerate(scenarios.items()):
+            db = TBDatabase(os.path.join(tmp_dir, f'bench_{i}.db'), **kwargs)
+            populate(db)
+            for operation in (read_operation, write_operation):
+                ops = run(db, operation, n_ops, n_threads)
+                results.append((name, operation.__name__, ops))
+            db.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ops', type=int, default=5000, help='operations for each scenario')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent threads, like the bot workers')
+    args = parser.parse_args()
+
+    print(f"{'Scenario':<22} {'Operation':<16} {'ops/sec':>10}")
+    for scenario, operation, ops in benchmark(args.ops, args.threads):
+        print(f"{scenario:<22} {operation:<16} {ops:>10.1f}")
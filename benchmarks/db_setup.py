@@ -0,0 +1,84 @@
+"""
+Benchmark of the database setup done at every startup, with many cameras and people.
+Compares the row by row setup (add_camera / update_camera_name / delete_camera and
+add_enrolled_person for each row) with the set-based sync_cameras and enroll_people.
+Each scenario enrolls the people, syncs the cameras, then syncs again after changing
+10% of the cameras, like a restart with an edited config.yaml.
+
+usage: python -m benchmarks.db_setup [--cameras 100 500] [--people 1000 5000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from db.db_lite import TBDatabase, TDBAtomicConnection
+
+
+def row_by_row_setup(conn: TDBAtomicConnection, cameras: list[tuple[int, str]]):
+    """The setup_database loop before the set-based sync"""
+    db_camera_ids = {camera_id for camera_id, _ in conn.get_cameras()}
+    cameras_ids = {camera_id for camera_id, _ in cameras}
+    for camera_id, camera_name in cameras:
+        if camera_id not in db_camera_ids:
+            conn.add_camera(camera_id, camera_name)
+            db_camera_ids.add(camera_id)
+        conn.update_camera_name(camera_id, camera_name)
+    for camera_id in db_camera_ids - cameras_ids:
+        conn.delete_camera(camera_id)
+
+
+def row_by_row_enroll(conn: TDBAtomicConnection, people: list[str]):
+    for person in people:
+        conn.add_enrolled_person(person)
+
+
+def set_based_setup(conn: TDBAtomicConnection, cameras: list[tuple[int, str]]):
+    conn.sync_cameras(cameras)
+
+
+def set_based_enroll(conn: TDBAtomicConnection, people: list[str]):
+    conn.enroll_people(people)
+
+
+def run(db: TBDatabase, setup, enroll, n_cameras: int, n_people: int) -> tuple[float, float]:
+    """Returns the seconds of the first startup and of the restart"""
+    cameras = [(camera_id, f'camera {camera_id}') for camera_id in range(n_cameras)]
+    people = [f'person {person}' for person in range(n_people)]
+
+    start = time.perf_counter()
+    with db() as conn:
+        setup(conn, cameras[:1])
+        enroll(conn, people)
+        setup(conn, cameras)
+    first_startup = time.perf_counter() - start
+
+    # restart: 10% of the cameras removed and replaced by new ones
+    changed = max(1, n_cameras // 10)
+    cameras = cameras[changed:] + [(camera_id, f'camera {camera_id}') for camera_id in range(n_cameras, n_cameras + changed)]
+    start = time.perf_counter()
+    with db() as conn:
+        setup(conn, cameras)
+    restart = time.perf_counter() - start
+    return first_startup, restart
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cameras', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--people', type=int, nargs='+', default=[1000, 5000])
+    args = parser.parse_args()
+
+    scenarios = {
+        'row by row': (row_by_row_setup, row_by_row_enroll),
+        'set based': (set_based_setup, set_based_enroll),
+    }
+    print(f"{'Scenario':<12} {'Cameras':>8} {'People':>8} {'Startup (s)':>12} {'Restart (s)':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_cameras in args.cameras:
+            for n_people in args.people:
+                for name, (setup, enroll) in scenarios.items():
+                    db = TBDatabase(os.path.join(tmp_dir, f'{name}_{n_cameras}_{n_people}.db'))
+                    first_startup, restart = run(db, setup, enroll, n_cameras, n_people)
+                    db.close()
+                    print(f"{name:<12} {n_cameras:>8} {n_people:>8} {first_startup:>12.3f} {restart:>12.3f}")
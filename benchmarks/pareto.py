@@ -0,0 +1,239 @@
+"""
+Accuracy against throughput of the camera configurations, on labelled clips.
+Every configuration of the grid (motion detector, min area, YOLO size, scale size, batch size, tracker) runs
+VideoProcessor.process_video_frames on every clip, in a pool of processes; the detections are compared with the
+annotations of the clip and the frames/sec are measured. Writes the results as a CSV file and plots the Pareto
+front of FPS against detection F1 and identification accuracy.
+
+The annotations of <clip>.avi are in <clip>.csv, one row per person: frame,label,x1,y1,x2,y2
+(frame counted from 0, label empty when the person is unknown, box in the pixels of the original frame).
+Frames without rows have no persons; the clip is evaluated up to its last annotated frame.
+
+usage: python -m benchmarks.pareto datasets/labelled/*.avi [--yolo-sizes n s] [--trackers off bytetrack.yaml]
+                                   [--workers 2] [--no-plots]
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from benchmarks.baseline import write_results
+from benchmarks.pipeline import read_frames
+from camera.video_processor import VideoProcessor
+
+HEADER = ["Motion detector", "Min area", "Yolo size", "Scale size", "Batch size", "Tracker",
+          "Precision", "Recall", "F1", "Identification", "FPS"]
+
+
+def read_annotations(path: str) -> dict[int, list[tuple[str | None, list[int]]]]:
+    """returns the persons of each annotated frame: (label or None, [x1, y1, x2, y2])"""
+    annotations = defaultdict(list)
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            box = [int(float(row[key])) for key in ("x1", "y1", "x2", "y2")]
+            annotations[int(row["frame"])].append((row["label"] or None, box))
+    return annotations
+
+
+def iou(a: list, b: list) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+def match(predicted: list[tuple], truth: list[tuple], threshold: float = 0.5) -> list[tuple[int, int]]:
+    """Greedy matching of the boxes by decreasing IoU, returns the matched (predicted, truth) indexes"""
+    pairs = sorted(((iou(p[1], t[1]), i, j) for i, p in enumerate(predicted) for j, t in enumerate(truth)),
+                   reverse=True)
+    matched, used_predicted, used_truth = [], set(), set()
+    for overlap, i, j in pairs:
+        if overlap < threshold:
+            break
+        if i not in used_predicted and j not in used_truth:
+            used_predicted.add(i)
+            used_truth.add(j)
+            matched.append((i, j))
+    return matched
+
+
+class Counts:
+    """Detection and identification counts, summed over the frames and the clips"""
+
+    def __init__(self):
+        self.tp = self.fp = self.fn = 0
+        self.identified = self.labelled = 0
+
+    def add(self, predicted: list[tuple], truth: list[tuple]):
+        matched = match(predicted, truth)
+        self.tp += len(matched)
+        self.fp += len(predicted) - len(matched)
+        self.fn += len(truth) - len(matched)
+        for i, j in matched:
+            if truth[j][0] is not None:
+                self.labelled += 1
+                self.identified += predicted[i][0] == truth[j][0]
+
+    def merge(self, other: "Counts"):
+        self.tp += other.tp
+        self.fp += other.fp
+        self.fn += other.fn
+        self.identified += other.identified
+        self.labelled += other.labelled
+
+    def scores(self) -> tuple[float, float, float, float]:
+        """returns precision, recall, F1 and identification accuracy of the labelled persons found"""
+        precision = self.tp / (self.tp + self.fp) if self.tp + self.fp else 0.0
+        recall = self.tp / (self.tp + self.fn) if self.tp + self.fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        identification = self.identified / self.labelled if self.labelled else 0.0
+        return precision, recall, f1, identification
+
+
+def evaluate(clip: str, *, motion_detector: str, min_area: int, yolo_size: str, scale_size: int, batch_size: int,
+             tracker: str | None, device: str = None) -> tuple[Counts, int, float]:
+    """
+    Run one configuration on one clip.
+    returns the counts, the frames processed and the seconds spent in process_video_frames
+    """
+    annotations = read_annotations(os.path.splitext(clip)[0] + ".csv")
+    frames = read_frames(clip, max(annotations, default=0) + 1)
+    torch.manual_seed(0)
+    processor = VideoProcessor(0, source=clip, fifo_queue=None, fps=0, yolo=f"yolo11{yolo_size}.pt",
+                               batch_size=batch_size, motion_detector=motion_detector if motion_detector != "none"
+                               else "mog2", motion_detector_min_area=min_area, scale_size=scale_size,
+                               device=device, view=False, tracker=tracker)
+    processor.setup()
+    if motion_detector == "none":
+        processor.is_moving = lambda frame: True
+    predictions = {}
+    elapsed = 0.0
+    try:
+        for i in range(0, len(frames), batch_size):
+            batch = [(seq, 0.0, frame) for seq, frame in enumerate(frames[i:i + batch_size], i)]
+            start = time.perf_counter()
+            detections = processor.process_video_frames(batch)
+            elapsed += time.perf_counter() - start
+            for detection in detections:
+                predictions[detection.seq] = detection
+    finally:
+        processor.teardown()
+
+    # the boxes are found in the rescaled frames
+    factor = scale_size / 100
+    counts = Counts()
+    for seq in range(len(frames)):
+        detection = predictions.get(seq)
+        predicted = [] if detection is None else [
+            (label, [int(value / factor) for value in box]) for box, label in zip(detection.boxes, detection.labels)
+        ]
+        counts.add(predicted, annotations.get(seq, []))
+    return counts, len(frames), elapsed
+
+
+def _evaluate(task: dict) -> tuple[Counts, int, float]:
+    torch.set_num_threads(task.pop("torch_threads"))
+    return evaluate(**task)
+
+
+def explore(clips: list[str], grid: list[tuple], *, workers: int = 1, device: str = None) -> list[list]:
+    """
+    Evaluate every configuration of the grid on all the clips.
+    grid: (motion detector, min area, yolo size, scale size, batch size, tracker or None)
+    returns a row of HEADER for each configuration
+    """
+    keys = ("motion_detector", "min_area", "yolo_size", "scale_size", "batch_size", "tracker")
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    tasks = [dict(zip(keys, configuration), clip=clip, device=device, torch_threads=torch_threads)
+             for configuration in grid for clip in clips]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_evaluate, tasks))
+
+    rows = []
+    for n, configuration in enumerate(grid):
+        counts, frames, elapsed = Counts(), 0, 0.0
+        for clip_counts, clip_frames, clip_elapsed in results[n * len(clips):(n + 1) * len(clips)]:
+            counts.merge(clip_counts)
+            frames += clip_frames
+            elapsed += clip_elapsed
+        motion_detector, min_area, yolo_size, scale_size, batch_size, tracker = configuration
+        rows.append([motion_detector, min_area, yolo_size, scale_size, batch_size, tracker or "off",
+                     *counts.scores(), frames / elapsed if elapsed else 0.0])
+        print("  " + ", ".join(f"{value:.2f}" if isinstance(value, float) else str(value) for value in rows[-1]))
+    return rows
+
+
+def pareto_front(rows: list[list], accuracy: int, fps: int = -1) -> list[list]:
+    """The rows not dominated by another one in both the accuracy and the fps columns, by increasing fps"""
+    front = [row for row in rows
+             if not any(other[accuracy] >= row[accuracy] and other[fps] >= row[fps]
+                        and (other[accuracy] > row[accuracy] or other[fps] > row[fps]) for other in rows)]
+    return sorted(front, key=lambda row: row[fps])
+
+
+def plot_front(rows: list[list], accuracy: int, path: str):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    front = pareto_front(rows, accuracy)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.scatter([row[-1] for row in rows], [row[accuracy] for row in rows], color="lightgray", label="configuration")
+    ax.plot([row[-1] for row in front], [row[accuracy] for row in front], "o-", color="tab:red", label="Pareto front")
+    for row in front:
+        ax.annotate(" ".join(str(value) for value in row[:6]), (row[-1], row[accuracy]), fontsize=7,
+                    xytext=(4, 4), textcoords="offset points")
+    ax.set_xlabel("FPS")
+    ax.set_ylabel(HEADER[accuracy])
+    ax.grid(alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("clips", nargs="+", help="video files, each with the annotations in a csv of the same name")
+    parser.add_argument("--motion-detectors", nargs="+", choices=["mog2", "optical_flow", "none"], default=["mog2"])
+    parser.add_argument("--min-areas", type=int, nargs="+", default=[500])
+    parser.add_argument("--yolo-sizes", nargs="+", default=["n", "s"])
+    parser.add_argument("--scale-sizes", type=int, nargs="+", default=[100, 50])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--trackers", nargs="+", default=["off"],
+                        help="off or an ultralytics tracker, e.g. bytetrack.yaml botsort.yaml")
+    parser.add_argument("--workers", type=int, default=1, help="configurations evaluated in parallel")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--output-dir", default="benchmark_results")
+    parser.add_argument("--no-plots", action="store_true")
+    args = parser.parse_args()
+
+    trackers = [None if tracker == "off" else tracker for tracker in args.trackers]
+    grid = list(itertools.product(args.motion_detectors, args.min_areas, args.yolo_sizes, args.scale_sizes,
+                                  args.batch_sizes, trackers))
+    print(f"{len(grid)} configurations on {len(args.clips)} clips")
+    rows = explore(args.clips, grid, workers=args.workers, device=args.device)
+    path = os.path.join(args.output_dir, "pareto.csv")
+    write_results(path, HEADER, rows)
+    print(f"results written to {path}")
+
+    for column in ("F1", "Identification"):
+        accuracy = HEADER.index(column)
+        print(f"Pareto front of FPS and {column}:")
+        for row in pareto_front(rows, accuracy):
+            print(f"  {row[-1]:.1f} fps, {column} {row[accuracy]:.2f}: {' '.join(str(value) for value in row[:6])}")
+        if not args.no_plots:
+            plot_path = os.path.join(args.output_dir, f"pareto_{column.lower()}.png")
+            plot_front(rows, accuracy, plot_path)
+            print(f"plot written to {plot_path}")
+
+
+if __name__ == "__main__":
+    main()
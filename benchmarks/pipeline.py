@@ -0,0 +1,228 @@
+"""
+Throughput of the detection pipeline, measured on the classes the cameras actually run:
+VideoProcessor.process_video_frames (with its MotionDetector, YOLO and FaceRecognizer) and the db_lite access checks.
+Each scenario writes <output-dir>/<scenario>.csv in the schema of "results and plots/*.csv" and, with --baseline,
+fails if a run is slower than the baseline file of the same name by more than --tolerance.
+
+usage: python -m benchmarks.pipeline motion_detector crop --videos datasets/WiseNET/set_1/video1_1.avi
+                                     --baseline "results and plots" --tolerance 0.2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+import torch
+
+from benchmarks.baseline import write_results, compare
+from camera.synthetic_source import SyntheticStream
+from camera.video_processor import VideoProcessor
+from db.db_lite import TBDatabase, AccessDecisionMatrix
+
+
+class UncroppedVideoProcessor(VideoProcessor):
+    """Searches the faces in the whole frame instead of the person box, once for all the persons of the frame"""
+
+    _faces = (None, [])  # (frame, faces recognized in it)
+
+    def person_image(self, frame, box):
+        return frame
+
+    def process_video_frames(self, frames):
+        # the inference buffers are reused by the next batches, the faces are valid for this batch only
+        self._faces = (None, [])
+        return super().process_video_frames(frames)
+
+    def recognize_person(self, frame, box) -> list[dict]:
+        if self._faces[0] is not frame:
+            self._faces = (frame, super().recognize_person(frame, box))
+        return self._faces[1]
+
+
+def read_frames(video_path: str, max_frames: int) -> list:
+    """
+    The frames are decoded before measuring, the benchmarks measure the processing only.
+    video_path: a video file, or synthetic[:<width>x<height>] for a SyntheticStream scene with two persons
+    """
+    if video_path.startswith("synthetic"):
+        width, height = map(int, video_path.partition(":")[2].split("x")) if ":" in video_path else (640, 480)
+        cap = SyntheticStream(width=width, height=height, sprites=2, frames=max_frames)
+    else:
+        cap = cv.VideoCapture(video_path)
+    frames = []
+    try:
+        while len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        raise ValueError(f"cannot read frames from {video_path}")
+    return frames
+
+
+def measure_fps(video_path: str, *, max_frames: int = 300, batch_size: int = 1, motion_detector: str = "mog2",
+                yolo: str = "yolo11n.pt", crop: bool = True, device: str = None, warmup_batches: int = 2,
+                scale_size: int = 100) -> float:
+    """
+    Frames per second of VideoProcessor.process_video_frames on the first max_frames of the video.
+    motion_detector: "mog2", "optical_flow" or None to process every frame
+    warmup_batches: batches processed before starting the clock, the first model calls are slower
+    """
+    torch.manual_seed(0)
+    frames = read_frames(video_path, max_frames)
+    processor_class = VideoProcessor if crop else UncroppedVideoProcessor
+    processor = processor_class(0, source=video_path, fifo_queue=None, fps=0, yolo=yolo, batch_size=batch_size,
+                                motion_detector=motion_detector or "mog2", device=device, view=False,
+                                scale_size=scale_size)
+    processor.setup()
+    if motion_detector is None:
+        processor.is_moving = lambda frame: True
+    batches = [[(seq, 0.0, frame) for seq, frame in enumerate(frames[i:i + batch_size], i)]
+               for i in range(0, len(frames), batch_size)]
+    try:
+        for batch in batches[:warmup_batches]:
+            processor.process_video_frames(batch)
+        start = time.perf_counter()
+        for batch in batches:
+            processor.process_video_frames(batch)
+        elapsed = time.perf_counter() - start
+    finally:
+        processor.teardown()
+    return len(frames) / elapsed
+
+
+def _measure_fps(kwargs: dict) -> float:
+    torch.set_num_threads(kwargs.pop("torch_threads"))
+    return measure_fps(**kwargs)
+
+
+def motion_detector_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    methods = {"No Motion Detector": None, "Optical Flow": "optical_flow", "MOG2": "mog2"}
+    rows = [[os.path.basename(video), method, measure_fps(video, max_frames=args.max_frames, motion_detector=detector,
+                                                          device=args.device)]
+            for video in videos for method, detector in methods.items()]
+    return ["Video", "Method", "FPS"], rows
+
+
+def crop_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    methods = {"Crop": True, "No Crop": False}
+    rows = [[os.path.basename(video), method, measure_fps(video, max_frames=args.max_frames, crop=crop, device=args.device)]
+            for video in videos for method, crop in methods.items()]
+    return ["Video", "Method", "FPS"], rows
+
+
+def yolo_size_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    rows = [[os.path.basename(video), size, measure_fps(video, max_frames=args.max_frames, yolo=f"yolo11{size}.pt",
+                                                        device=args.device)]
+            for video in videos for size in args.yolo_sizes]
+    return ["Video", "Yolo size", "FPS"], rows
+
+
+def batch_size_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    rows = [[os.path.basename(video), batch_size, measure_fps(video, max_frames=args.max_frames, batch_size=batch_size,
+                                                              device=args.device)]
+            for video in videos for batch_size in args.batch_sizes]
+    return ["Video", "Batch size", "FPS"], rows
+
+
+def cameras_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    """Total FPS of n cameras processing the same video in parallel processes, as the VideoProcessors do"""
+    rows = []
+    for video in videos:
+        for n_cameras in args.cameras:
+            torch_threads = max(1, (os.cpu_count() or 1) // n_cameras)
+            tasks = [dict(video_path=video, max_frames=args.max_frames, device=args.device, torch_threads=torch_threads)
+                     for _ in range(n_cameras)]
+            with ProcessPoolExecutor(max_workers=n_cameras) as executor:
+                rows.append([os.path.basename(video), n_cameras, sum(executor.map(_measure_fps, tasks))])
+    return ["Video", "Cameras", "FPS"], rows
+
+
+def access_scenario(videos: list[str], args) -> tuple[list[str], list[list]]:
+    """Access checks per second, one query for each check or the in-memory AccessDecisionMatrix"""
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_cameras, n_people in [(10, 100), (100, 1000)]:
+            db = TBDatabase(os.path.join(tmp_dir, f"access_{n_cameras}_{n_people}.db"))
+            people = [f"person {person}" for person in range(n_people)]
+            with db() as conn:
+                conn.sync_cameras([(camera_id, f"camera {camera_id}") for camera_id in range(n_cameras)])
+                conn.enroll_people(people, listed='w')
+            checks = [(people[i % n_people], i % n_cameras) for i in range(args.max_frames * 10)]
+            workload = f"{n_cameras} cameras {n_people} people"
+
+            start = time.perf_counter()
+            with db() as conn:
+                for person, camera_id in checks:
+                    conn.has_access_to_room(person, camera_id)
+            rows.append([workload, "Query", len(checks) / (time.perf_counter() - start)])
+
+            matrix = AccessDecisionMatrix(db.db_path)
+            start = time.perf_counter()
+            matrix.refresh()
+            for person, camera_id in checks:
+                matrix.has_access(person, camera_id)
+            rows.append([workload, "Decision matrix", len(checks) / (time.perf_counter() - start)])
+            matrix.close()
+            db.close()
+    return ["Workload", "Method", "Checks/s"], rows
+
+
+SCENARIOS = {
+    "motion_detector": motion_detector_scenario,
+    "crop": crop_scenario,
+    "yolo_size": yolo_size_scenario,
+    "batch_size": batch_size_scenario,
+    "cameras": cameras_scenario,
+    "access": access_scenario,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)}, default: all of them")
+    parser.add_argument("--videos", nargs="+", default=["datasets/WiseNET/set_1/video1_1.avi"],
+                        help="video files, or synthetic[:<width>x<height>] for generated scenes")
+    parser.add_argument("--max-frames", type=int, default=300, help="frames of each video processed by each run")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--yolo-sizes", nargs="+", default=["n", "s", "m", "l"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--output-dir", default="benchmark_results")
+    parser.add_argument("--baseline", default=None, help="directory of the baseline csv files")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="accepted relative slowdown against the baseline")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    regressions = []
+    for name in args.scenarios or list(SCENARIOS):
+        header, rows = SCENARIOS[name](args.videos, args)
+        path = os.path.join(args.output_dir, f"{name}.csv")
+        write_results(path, header, rows)
+        print(f"{name}: results written to {path}")
+        for row in rows:
+            print("  " + ", ".join(f"{value:.2f}" if isinstance(value, float) else str(value) for value in row))
+
+        baseline_path = os.path.join(args.baseline, f"{name}.csv") if args.baseline is not None else None
+        if baseline_path is not None and os.path.exists(baseline_path):
+            regressions += [f"{name}: {regression}" for regression in compare(path, baseline_path, args.tolerance)]
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Scaling of the frame sources, the queue and the VideoFrameController with many cameras, no footage needed:
+every camera is a SyntheticCameraSource sending the raw frames of a generated scene at the given fps,
+the main process consumes them as main.py does. Reports the frames/sec delivered against the offered ones.
+
+usage: python -m benchmarks.synthetic_load [--cameras 1 8 32] [--fps 15] [--width 640 --height 480] [--seconds 10]
+"""
+import argparse
+import os
+import time
+from multiprocessing import Queue
+
+from benchmarks.baseline import write_results
+from camera.frame_controller import VideoFrameController
+from camera.synthetic_source import SyntheticCameraSource
+
+
+def run(n_cameras: int, *, fps: int, width: int, height: int, seconds: float,
+        max_queue_size: int) -> tuple[float, int]:
+    """returns the frames/sec delivered to the consumer and the frames dropped on the way, from the sequence gaps"""
+    fifo_queue = Queue(maxsize=max_queue_size)
+    sources = [SyntheticCameraSource(camera_id, fifo_queue, fps=fps, width=width, height=height, sprites=1)
+               for camera_id in range(n_cameras)]
+    controller = VideoFrameController(sources, fifo_queue=fifo_queue)
+    controller.start_frame_sources()
+    frames, lost, start = 0, 0, None
+    last_seq = {}
+    try:
+        while start is None or time.perf_counter() - start < seconds:
+            batch = controller.fetch_and_get_frames(timeout=0.1)
+            if start is None:
+                # the sources start in parallel, the clock starts with the first frame
+                if batch:
+                    start = time.perf_counter()
+                continue
+            frames += len(batch)
+            for camera_id, seq, _, _ in batch:
+                lost += seq - last_seq.get(camera_id, seq - 1) - 1
+                last_seq[camera_id] = seq
+    finally:
+        controller.stop_sources()
+    return frames / seconds, lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--fps", type=int, default=15, help="frames/sec offered by each camera")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "synthetic_load.csv"))
+    args = parser.parse_args()
+
+    rows = []
+    resolution = f"{args.width}x{args.height}"
+    print(f"{'Cameras':>8} {'Offered fps':>12} {'Delivered fps':>14} {'Dropped':>8}")
+    for n_cameras in args.cameras:
+        delivered, lost = run(n_cameras, fps=args.fps, width=args.width, height=args.height, seconds=args.seconds,
+                        max_queue_size=args.max_queue_size)
+        rows.append([n_cameras, resolution, delivered])
+        print(f"{n_cameras:>8} {n_cameras * args.fps:>12} {delivered:>14.1f} {lost:>8}")
+    write_results(args.output, ["Cameras", "Resolution", "FPS"], rows)
+
+
+if __name__ == "__main__":
+    main()
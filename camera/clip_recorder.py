@@ -0,0 +1,221 @@
+import os
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event, Lock
+
+import cv2 as cv
+import numpy as np
+
+from local_utils.logger import Logger
+
+
+class ClipMessage:
+    """A clip written by a camera process, sent to the main process together with the detections"""
+
+    __slots__ = ('camera_id', 'path', 'start_ts', 'trigger_ts', 'end_ts', 'buffer_bytes')
+
+    def __init__(self, camera_id: int, path: str, start_ts: float, trigger_ts: float, end_ts: float, buffer_bytes: int):
+        """
+        path: the MP4 file
+        start_ts, end_ts: capture time of the first and the last frame of the clip
+        trigger_ts: capture time of the detection which started the clip
+        buffer_bytes: memory used by the ring buffer of the camera when the clip has been written
+        """
+        self.camera_id = camera_id
+        self.path = path
+        self.start_ts = start_ts
+        self.trigger_ts = trigger_ts
+        self.end_ts = end_ts
+        self.buffer_bytes = buffer_bytes
+
+    def __getstate__(self):
+        return self.camera_id, self.path, self.start_ts, self.trigger_ts, self.end_ts, self.buffer_bytes
+
+    def __setstate__(self, state):
+        self.camera_id, self.path, self.start_ts, self.trigger_ts, self.end_ts, self.buffer_bytes = state
+
+    def __repr__(self):
+        return f"ClipMessage(camera_id={self.camera_id}, path={self.path}, duration={self.end_ts - self.start_ts:.1f}s)"
+
+
+class FrameRingBuffer:
+    """
+    The last 'seconds' of frames as JPEG bytes, never more than max_bytes:
+    the oldest frames are evicted first when either limit is exceeded.
+    Not thread safe, it is owned by the ClipRecorder thread.
+    """
+
+    def __init__(self, seconds: float, max_bytes: int):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.frames: deque[tuple[float, bytes]] = deque()  # (capture timestamp, jpeg)
+        self.nbytes = 0
+        self.evicted_for_memory = 0
+
+    def append(self, timestamp: float, jpeg: bytes):
+        self.frames.append((timestamp, jpeg))
+        self.nbytes += len(jpeg)
+        while self.frames and timestamp - self.frames[0][0] > self.seconds:
+            self._pop()
+        while self.nbytes > self.max_bytes and len(self.frames) > 1:
+            self._pop()
+            self.evicted_for_memory += 1
+
+    def _pop(self):
+        _, jpeg = self.frames.popleft()
+        self.nbytes -= len(jpeg)
+
+    def since(self, timestamp: float) -> list[tuple[float, bytes]]:
+        return [(ts, jpeg) for ts, jpeg in self.frames if ts >= timestamp]
+
+    def __len__(self):
+        return len(self.frames)
+
+
+class ClipRecorder(Thread, Logger):
+    """
+    Keeps the recent frames of a camera in a FrameRingBuffer and, when triggered,
+    writes a MP4 clip with the pre_roll seconds before the trigger and the post_roll seconds after it.
+    add_frame() and trigger() never block the caller: the frames are downscaled and JPEG encoded by this thread
+    (a frame is dropped if the thread is behind), the clips are written with cv.VideoWriter by another thread.
+    The raw frames waiting to be encoded count against max_memory_mb too: they get a quarter of it.
+    on_clip is called with a ClipMessage, from the writer thread, for every clip written.
+    usage:
+    ```
+        recorder = ClipRecorder(camera_id, on_clip=queue.put, clips_dir='clips', pre_roll=5, post_roll=5)
+        recorder.start()
+        recorder.add_frame(capture_ts, frame)  # for every frame read
+        recorder.trigger(capture_ts)  # when a person is detected
+        recorder.stop()
+    ```
+    """
+
+    def __init__(self, camera_id: int, *, on_clip, clips_dir: str = "clips", pre_roll: float = 5.0,
+                 post_roll: float = 5.0, width: int = 640, quality: int = 70, max_memory_mb: float = 32,
+                 min_interval: float = 30.0, fourcc: str = "mp4v"):
+        """
+        on_clip: called with the ClipMessage of each clip written
+        clips_dir: where the clips are written
+        pre_roll, post_roll: seconds of video before and after the trigger
+        width: frames are downscaled to this width before being buffered
+        quality: JPEG quality of the buffered frames
+        max_memory_mb: memory cap of the queued raw frames and of the ring buffer, the pre roll gets shorter if it is reached
+        min_interval: triggers closer than this to the last clip are ignored
+        fourcc: codec of the clips
+        """
+        Thread.__init__(self, name=f"{self.__class__.__name__}-{camera_id}", daemon=True)
+        Logger.__init__(self, name=f"{self.__class__.__name__}-{camera_id}")
+        self.camera_id = camera_id
+        self.on_clip = on_clip
+        self.clips_dir = clips_dir
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.width = width
+        self.quality = quality
+        self.min_interval = min_interval
+        self.fourcc = fourcc
+        max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_queued_bytes = max_bytes // 4
+        self.buffer = FrameRingBuffer(pre_roll + post_roll, max_bytes - self.max_queued_bytes)
+        self.frames = queue.Queue()
+        self.queued_bytes = 0
+        self._queued_lock = Lock()
+        self.triggers = queue.Queue()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ClipWriter-{camera_id}")
+        self.dropped = 0
+        self.clips = 0
+        self._pending_trigger = None
+        self._last_trigger = float('-inf')
+        self._stop_event = Event()
+
+    def add_frame(self, timestamp: float, frame: np.ndarray):
+        with self._queued_lock:
+            # a single frame is always accepted, even if larger than the budget
+            if self.queued_bytes > 0 and self.queued_bytes + frame.nbytes > self.max_queued_bytes:
+                self.dropped += 1
+                return
+            self.queued_bytes += frame.nbytes
+        self.frames.put_nowait((timestamp, frame))
+
+    def trigger(self, timestamp: float):
+        self.triggers.put_nowait(timestamp)
+
+    def stats(self) -> dict:
+        return {
+            "buffered_frames": len(self.buffer),
+            "buffer_bytes": self.buffer.nbytes,
+            "max_bytes": self.buffer.max_bytes,
+            "queued_bytes": self.queued_bytes,
+            "evicted_for_memory": self.buffer.evicted_for_memory,
+            "dropped": self.dropped,
+            "clips": self.clips,
+        }
+
+    def _encode(self, frame: np.ndarray) -> bytes:
+        scale = self.width / frame.shape[1]
+        if scale < 1:
+            frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+        ok, jpeg = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+        return jpeg.tobytes() if ok else None
+
+    def _handle_triggers(self):
+        try:
+            while True:
+                timestamp = self.triggers.get_nowait()
+                if self._pending_trigger is None and timestamp - self._last_trigger >= self.min_interval:
+                    self._pending_trigger = self._last_trigger = timestamp
+        except queue.Empty:
+            pass
+
+    def run(self):
+        os.makedirs(self.clips_dir, exist_ok=True)
+        self.logger.info("[%s] buffering %s seconds of frames, at most %s MB", self.camera_id,
+                         self.buffer.seconds, (self.buffer.max_bytes + self.max_queued_bytes) // (1024 * 1024))
+        while not self._stop_event.is_set():
+            try:
+                timestamp, frame = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._queued_lock:
+                self.queued_bytes -= frame.nbytes
+            jpeg = self._encode(frame)
+            if jpeg is not None:
+                self.buffer.append(timestamp, jpeg)
+            self._handle_triggers()
+            if self._pending_trigger is not None and timestamp >= self._pending_trigger + self.post_roll:
+                frames = self.buffer.since(self._pending_trigger - self.pre_roll)
+                self.writer.submit(self._write, self._pending_trigger, frames, self.buffer.nbytes)
+                self._pending_trigger = None
+        self.writer.shutdown(wait=True)
+        self.logger.info("[%s] exiting: %s", self.camera_id, self.stats())
+
+    def _write(self, trigger_ts: float, frames: list[tuple[float, bytes]], buffer_bytes: int):
+        if len(frames) < 2:
+            return
+        start_ts, end_ts = frames[0][0], frames[-1][0]
+        fps = (len(frames) - 1) / (end_ts - start_ts) if end_ts > start_ts else 1.0
+        first = cv.imdecode(np.frombuffer(frames[0][1], np.uint8), cv.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        path = os.path.join(self.clips_dir, f"camera_{self.camera_id}_{int(trigger_ts * 1000)}.mp4")
+        writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*self.fourcc), fps, (width, height))
+        try:
+            if not writer.isOpened():
+                self.logger.error("[%s] cannot write clip %s", self.camera_id, path)
+                return
+            for _, jpeg in frames:
+                writer.write(cv.imdecode(np.frombuffer(jpeg, np.uint8), cv.IMREAD_COLOR))
+        finally:
+            writer.release()
+        self.clips += 1
+        self.logger.debug("[%s] clip written: %s (%s frames, %.1f fps, buffer %s KB)",
+                          self.camera_id, path, len(frames), fps, buffer_bytes // 1024)
+        try:
+            self.on_clip(ClipMessage(self.camera_id, path, start_ts, trigger_ts, end_ts, buffer_bytes))
+        except Exception as e:
+            self.logger.error("[%s] cannot send clip %s: %s", self.camera_id, path, e)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
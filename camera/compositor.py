@@ -0,0 +1,163 @@
+import math
+import time
+from multiprocessing import Process, Event, Lock, Value
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2 as cv
+import numpy as np
+
+from local_utils.logger import Logger
+from local_utils.preprocessing import draw_boxes
+
+
+class ThumbnailSlot:
+    """
+    The latest thumbnail of a camera, in shared memory: written by the camera process, read by the Compositor.
+    Latest wins: a write replaces the previous thumbnail, and is skipped if the compositor is copying it,
+    the camera never waits. At most fps thumbnails per second are written.
+    """
+
+    def __init__(self, camera_id, name: str, *, width: int = 320, height: int = 240, fps: float = 5.0):
+        """
+        width, height: the thumbnails are downscaled to fit in them
+        fps: maximum thumbnails written per second
+        """
+        self.camera_id = camera_id
+        self.name = name
+        self.width = width
+        self.height = height
+        self.interval = 1 / fps if fps else 0.0
+        self.shm = SharedMemory(create=True, size=width * height * 3)
+        self.lock = Lock()
+        self.version = Value('L', 0, lock=False)
+        self.shape = (Value('i', 0, lock=False), Value('i', 0, lock=False))
+        self._next_write = 0.0
+
+    def size(self, shape: tuple) -> tuple[int, int]:
+        """(width, height) of the thumbnail of an image of shape, downscaled to fit in the slot"""
+        fit = min(1.0, self.width / shape[1], self.height / shape[0])
+        return max(1, int(shape[1] * fit)), max(1, int(shape[0] * fit))
+
+    def due(self) -> bool:
+        """True if a thumbnail written now would not exceed the fps"""
+        return time.monotonic() >= self._next_write
+
+    def write(self, frame: np.ndarray, boxes=()) -> bool:
+        """
+        Downscale the frame into the slot and draw the boxes, given in frame coordinates.
+        returns False if the thumbnail was skipped
+        """
+        if not self.due() or not self.lock.acquire(block=False):
+            return False
+        try:
+            width, height = self.size(frame.shape)
+            fit = width / frame.shape[1]
+            image = np.ndarray((height, width, 3), np.uint8, buffer=self.shm.buf)
+            if frame.ndim == 2:
+                frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+            cv.resize(frame, (width, height), dst=image, interpolation=cv.INTER_AREA)
+            draw_boxes(image, boxes, fit)
+            self.shape[0].value, self.shape[1].value = height, width
+            self.version.value += 1
+        finally:
+            self.lock.release()
+        self._next_write = time.monotonic() + self.interval
+        return True
+
+    def read_into(self, cell: np.ndarray, version: int) -> int:
+        """
+        Copy the thumbnail in the top left corner of cell, if it is newer than version.
+        returns the version of the thumbnail in cell
+        """
+        if self.version.value == version:
+            return version
+        with self.lock:
+            height, width = self.shape[0].value, self.shape[1].value
+            cell[:] = 0
+            cell[:height, :width] = np.ndarray((height, width, 3), np.uint8, buffer=self.shm.buf)
+            return self.version.value
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        """Free the shared memory, called once by the process which created the slot"""
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Compositor(Process, Logger):
+    """
+    Shows the cameras with view enabled in a single mosaic window, from its own process: the camera processes
+    only write a small annotated thumbnail in their ThumbnailSlot, at a capped rate, and never touch the GUI.
+    The slots must be added before starting the process. Closing the window (Esc or q) stops the view only.
+    usage:
+    ```
+        compositor = Compositor(fps=10)
+        slot = compositor.add_camera(0, "entrance")  # passed to the VideoProcessor of camera 0
+        compositor.start()
+        compositor.stop()
+    ```
+    """
+
+    def __init__(self, *, fps: float = 10.0, cell_width: int = 320, cell_height: int = 240, columns: int = None,
+                 thumbnail_fps: float = 5.0, winname: str = "LittleBrother"):
+        """
+        fps: refresh rate of the window
+        cell_width, cell_height: size of the cell of each camera, the thumbnails are downscaled to fit in it
+        columns: cells per row, None for a square mosaic
+        thumbnail_fps: maximum thumbnails per second written by each camera
+        """
+        Process.__init__(self, name=self.__class__.__name__, daemon=True)
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.fps = fps
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.columns = columns
+        self.thumbnail_fps = thumbnail_fps
+        self.winname = winname
+        self.slots: dict[int, ThumbnailSlot] = {}
+        self._stop_event = Event()
+
+    def add_camera(self, camera_id, name: str) -> ThumbnailSlot:
+        slot = ThumbnailSlot(camera_id, name, width=self.cell_width, height=self.cell_height, fps=self.thumbnail_fps)
+        self.slots[camera_id] = slot
+        return slot
+
+    def run(self):
+        columns = self.columns or math.ceil(math.sqrt(len(self.slots)))
+        rows = math.ceil(len(self.slots) / columns)
+        canvas = np.zeros((rows * self.cell_height, columns * self.cell_width, 3), np.uint8)
+        versions = {camera_id: 0 for camera_id in self.slots}
+        delay = max(1, int(1000 / self.fps))
+        self.logger.info("Showing %s cameras in a %sx%s mosaic", len(self.slots), columns, rows)
+        try:
+            while not self._stop_event.is_set():
+                for i, (camera_id, slot) in enumerate(self.slots.items()):
+                    row, column = divmod(i, columns)
+                    cell = canvas[row * self.cell_height:(row + 1) * self.cell_height,
+                                  column * self.cell_width:(column + 1) * self.cell_width]
+                    version = slot.read_into(cell, versions[camera_id])
+                    if version != versions[camera_id]:
+                        versions[camera_id] = version
+                        label = f"{camera_id}: {slot.name}" if slot.name else str(camera_id)
+                        cv.putText(cell, label, (6, 20), cv.FONT_HERSHEY_SIMPLEX, 0.5,
+                                   (0, 255, 0), 1, cv.LINE_AA)
+                cv.imshow(self.winname, canvas)
+                if cv.waitKey(delay) in [27, ord('q'), ord('Q')]:
+                    self.logger.info("View closed")
+                    break
+        finally:
+            cv.destroyAllWindows()
+            for slot in self.slots.values():
+                slot.close()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=2)
+        for slot in self.slots.values():
+            slot.unlink()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+from camera.detection_message import DetectionMessage
+from face_recognizer.face_recognizer import FaceRecognizer
+from local_utils.logger import Logger
+
+MIN_BOX_SIZE = 20  # smaller person boxes are ignored, as in VideoProcessor.process_video_frames
+
+
+class SegmentOutputs:
+    """
+    The model outputs of the frames of a segment, one array per column:
+    frames (n_frames,) frame indices and motion (n_frames,) MotionDetector.score of every frame,
+    box_frames (n_boxes,) frame index and boxes (n_boxes, 4) of every person box, in rescaled frame coordinates,
+    face_boxes (n_faces,) box index and embeddings (n_faces, 512) of every face found in the boxes.
+    Loaded arrays are memory mapped, only the pages actually used are read.
+    """
+
+    COLUMNS = ("frames", "motion", "box_frames", "boxes", "face_boxes", "embeddings")
+
+    def __init__(self, frames, motion, box_frames, boxes, face_boxes, embeddings):
+        self.frames = frames
+        self.motion = motion
+        self.box_frames = box_frames
+        self.boxes = boxes
+        self.face_boxes = face_boxes
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, frames: list[int], motion: list[float], box_frames: list[int], boxes: list,
+              face_boxes: list[int], embeddings: list[np.ndarray]) -> "SegmentOutputs":
+        return cls(
+            np.asarray(frames, dtype=np.int32),
+            np.asarray(motion, dtype=np.float32),
+            np.asarray(box_frames, dtype=np.int32),
+            np.asarray(boxes, dtype=np.int32).reshape(-1, 4),
+            np.asarray(face_boxes, dtype=np.int32),
+            np.concatenate(embeddings).astype(np.float32) if embeddings else np.empty((0, 512), dtype=np.float32),
+        )
+
+    def save(self, path: str):
+        for column in self.COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), getattr(self, column))
+
+    @classmethod
+    def load(cls, path: str) -> "SegmentOutputs":
+        return cls(*(np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r") for column in cls.COLUMNS))
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DetectionCache(Logger):
+    """
+    On-disk cache of the outputs of the models (motion scores, YOLO boxes, face embeddings) on recorded videos,
+    keyed by the video content hash, the models and the preprocessing parameters. The thresholds are not part
+    of the key: decide() re-applies them to the cached outputs, so sweeping them doesn't run any model.
+    Layout: <cache_dir>/<key hash>/key.json and <cache_dir>/<key hash>/<start>-<end>/<column>.npy for each segment.
+    usage:
+    ```
+        cache = DetectionCache("cache", video_path, yolo="yolo11n.pt", scale_size=100, motion_detector="mog2")
+        outputs = cache.load(start_frame, end_frame)
+        if outputs is None:
+            cache.save(start_frame, end_frame, compute_outputs())
+        messages = decide(cache.load(start_frame, end_frame), ...)
+    ```
+    """
+
+    def __init__(self, cache_dir: str, video_path: str, *, yolo: str, scale_size: int, motion_detector: str,
+                 motion_scale: int = 100, warmup_frames: int = 30, min_face_size: int = 20, video_hash: str = None):
+        """
+        warmup_frames: frames fed to the motion detector before each segment, they change its motion scores
+        video_hash: hash of the video file, computed if not given
+        """
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.key = {
+            "video": video_hash if video_hash is not None else file_hash(video_path),
+            "yolo": os.path.basename(yolo),
+            "face_model": "vggface2",
+            "min_face_size": min_face_size,
+            "scale_size": scale_size,
+            "motion_detector": motion_detector,
+            "motion_scale": motion_scale,
+            "warmup_frames": warmup_frames,
+        }
+        key_hash = hashlib.sha1(json.dumps(self.key, sort_keys=True).encode()).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, key_hash)
+        os.makedirs(self.path, exist_ok=True)
+        key_path = os.path.join(self.path, "key.json")
+        if not os.path.exists(key_path):
+            with open(key_path, "w") as f:
+                json.dump(self.key, f, indent=2)
+
+    def _segment_path(self, start_frame: int, end_frame: int) -> str:
+        return os.path.join(self.path, f"{start_frame}-{end_frame}")
+
+    def has(self, start_frame: int, end_frame: int) -> bool:
+        return os.path.isdir(self._segment_path(start_frame, end_frame))
+
+    def load(self, start_frame: int, end_frame: int) -> SegmentOutputs | None:
+        if not self.has(start_frame, end_frame):
+            return None
+        return SegmentOutputs.load(self._segment_path(start_frame, end_frame))
+
+    def save(self, start_frame: int, end_frame: int, outputs: SegmentOutputs):
+        # written aside and renamed, so that a segment is either complete or missing
+        tmp = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        try:
+            outputs.save(tmp)
+            os.rename(tmp, self._segment_path(start_frame, end_frame))
+        except OSError:
+            if not self.has(start_frame, end_frame):
+                raise
+            self.logger.debug("segment %s-%s already cached by another process", start_frame, end_frame)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def decide(outputs: SegmentOutputs, camera_id: int, fps: float, *, motion_detector: str, motion_detector_threshold: float,
+           motion_detector_min_area: float, face_recognizer: FaceRecognizer,
+           motion_scale: int = 100) -> list[DetectionMessage]:
+    """
+    The decisions of VideoProcessor.process_video_frames on the cached outputs: motion gating, person boxes
+    and, for each box, the first face matched by the face recognizer (with its current threshold and galleries).
+    motion_scale: the scale of the frames the motion was scored on, the min area is rescaled as in VideoProcessor
+    returns one DetectionMessage, without frame, for each frame with persons
+    """
+    min_area = motion_detector_min_area * (motion_scale / 100) ** 2
+    threshold = min_area if motion_detector == "mog2" else motion_detector_threshold
+    moving_frames = np.asarray(outputs.frames)[np.asarray(outputs.motion) > threshold]
+
+    boxes = np.asarray(outputs.boxes)
+    box_frames = np.asarray(outputs.box_frames)
+    selected = np.isin(box_frames, moving_frames)
+    selected &= (boxes[:, 2] - boxes[:, 0] >= MIN_BOX_SIZE) & (boxes[:, 3] - boxes[:, 1] >= MIN_BOX_SIZE)
+    box_indices = np.flatnonzero(selected)
+    if len(box_indices) == 0:
+        return []
+
+    face_boxes = np.asarray(outputs.face_boxes)
+    faces = np.flatnonzero(np.isin(face_boxes, box_indices))
+    labels, confidences = {}, {}
+    if len(faces) > 0:
+        matches = face_recognizer.match_embeddings(torch.from_numpy(np.array(outputs.embeddings[faces])))
+        for face, match in zip(faces, matches):
+            box = int(face_boxes[face])
+            if match["label"] is not None and box not in labels:
+                labels[box], confidences[box] = match["label"], match["confidence"]
+
+    messages = []
+    frame_of_box = box_frames[box_indices]
+    for frame_index in np.unique(frame_of_box):
+        in_frame = box_indices[frame_of_box == frame_index]
+        messages.append(DetectionMessage(
+            camera_id, int(frame_index), float(frame_index) / fps, None, boxes[in_frame],
+            [labels.get(int(box)) for box in in_frame],
+            [confidences.get(int(box), float("nan")) for box in in_frame],
+        ))
+    return messages
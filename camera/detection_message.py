@@ -0,0 +1,103 @@
+import struct
+from collections import defaultdict
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+
+class DetectionMessage:
+    """
+    What a camera process sends to the main process for a frame with persons in it:
+    the frame once (BGR array or JPEG bytes), the person boxes and, for each box,
+    the recognized label (None if unknown) and its confidence (NaN if unknown).
+    The numeric fields are packed in a fixed struct header and raw numpy buffers when pickled,
+    so a message costs little more than its frame through the multiprocessing queue.
+    usage:
+    ```
+        message = DetectionMessage(camera_id, seq, capture_ts, frame, boxes, labels, confidences)
+        for label, confidence, box in message.persons():
+            pass
+    ```
+    """
+
+    __slots__ = ('camera_id', 'seq', 'capture_ts', 'frame', 'boxes', 'labels', 'confidences', 'skipped')
+
+    # camera id, sequence number, capture timestamp, skipped frames, number of boxes
+    _HEADER = struct.Struct('<qqdqI')
+
+    def __init__(self, camera_id: int, seq: int, capture_ts: float, frame: Union[np.ndarray, bytes],
+                 boxes=None, labels: list[Optional[str]] = None, confidences=None, skipped: int = 0):
+        """
+        camera_id: id of the camera which captured the frame
+        seq: frame number in the camera, counting also the frames without persons
+        capture_ts: time.time() when the frame has been read from the camera
+        frame: the (rescaled) BGR frame or its JPEG encoding
+        boxes: (n, 4) x1, y1, x2, y2 person boxes in frame coordinates
+        labels: n recognized persons, None when the face is unknown or not recognized
+        confidences: n confidences of the labels, NaN when unknown
+        skipped: frames read by the camera before this one and not sent on purpose (no motion, no persons),
+        counted since the camera started: a dropped message doesn't take its skipped frames with it, see SequenceTracker
+        """
+        self.camera_id = camera_id
+        self.seq = seq
+        self.capture_ts = capture_ts
+        self.skipped = skipped
+        self.frame = frame
+        self.boxes = np.asarray(boxes if boxes is not None else [], dtype=np.int32).reshape(-1, 4)
+        n = len(self.boxes)
+        self.labels = list(labels) if labels is not None else [None] * n
+        self.confidences = (np.asarray(confidences, dtype=np.float32) if confidences is not None
+                            else np.full(n, np.nan, dtype=np.float32))
+        if len(self.labels) != n or len(self.confidences) != n:
+            raise ValueError(f"{n} boxes but {len(self.labels)} labels and {len(self.confidences)} confidences")
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def persons(self) -> Iterator[tuple[Optional[str], Optional[float], tuple[int, int, int, int]]]:
+        """(label, confidence, box) of every person in the frame"""
+        for label, confidence, box in zip(self.labels, self.confidences, self.boxes):
+            yield label, None if np.isnan(confidence) else float(confidence), tuple(int(c) for c in box)
+
+    def __getstate__(self):
+        header = self._HEADER.pack(self.camera_id, self.seq, self.capture_ts, self.skipped, len(self.boxes))
+        return header, self.boxes.tobytes(), self.confidences.tobytes(), self.labels, self.frame
+
+    def __setstate__(self, state):
+        header, boxes, confidences, self.labels, self.frame = state
+        self.camera_id, self.seq, self.capture_ts, self.skipped, n = self._HEADER.unpack(header)
+        self.boxes = np.frombuffer(boxes, dtype=np.int32).reshape(n, 4)
+        self.confidences = np.frombuffer(confidences, dtype=np.float32)
+
+    def __repr__(self):
+        return (f"DetectionMessage(camera_id={self.camera_id}, seq={self.seq}, capture_ts={self.capture_ts:.3f}, "
+                f"labels={self.labels})")
+
+
+class SequenceTracker:
+    """
+    Counts the frames of each camera whose outcome never reached the consumer, e.g. the detections
+    dropped on a full queue. Between two messages the camera read seq - last seq frames, one is the message
+    and skipped - last skipped were skipped on purpose, any other one is a loss.
+    usage:
+    ```
+        tracker = SequenceTracker()
+        lost = tracker.update(message)
+    ```
+    """
+
+    def __init__(self):
+        self.last_seq: dict[int, int] = {}
+        self.last_skipped: dict[int, int] = {}
+        self.lost: dict[int, int] = defaultdict(int)
+
+    def update(self, message: DetectionMessage) -> int:
+        """returns the frames lost between the previous message of the camera and this one"""
+        last_seq = self.last_seq.get(message.camera_id, -1)
+        last_skipped = self.last_skipped.get(message.camera_id, 0)
+        # a sequence going backwards means the camera process restarted, nothing to count
+        lost = max(0, message.seq - last_seq - (message.skipped - last_skipped) - 1) if message.seq > last_seq else 0
+        self.last_seq[message.camera_id] = message.seq
+        self.last_skipped[message.camera_id] = message.skipped
+        self.lost[message.camera_id] += lost
+        return lost
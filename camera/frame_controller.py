@@ -1,10 +1,12 @@
 import queue
+import time
 from multiprocessing import Queue
 from queue import Empty
 from threading import Thread, Lock
 from numpy import ndarray
 
 from local_utils.logger import Logger
+from local_utils.metrics import MetricsRegistry
 from .frame_source import FrameSource
 
 
@@ -57,7 +59,12 @@ class VideoFrameController(Thread, Logger):
                     self._buffer = []
                 return buffer
 
-    def __init__(self, sources: list[FrameSource], fifo_queue: Queue):
+    def __init__(self, sources: list[FrameSource], fifo_queue: Queue, max_queue_size: int = None,
+                 depth_interval: float = 1.0):
+        """
+        max_queue_size: maxsize of fifo_queue, reported with its sampled depth
+        depth_interval: seconds between two samples of the queue depth
+        """
         Logger.__init__(self, name=f"{self.__class__.__name__}")
         Thread.__init__(self)
 
@@ -65,6 +72,12 @@ class VideoFrameController(Thread, Logger):
         self.buffer = VideoFrameController.Buffer()
         self.fifo_queue = fifo_queue
         self.start = VideoFrameController.Buffer()
+        # messages fetched, empty polls and the depth of the shared queue
+        self.metrics = MetricsRegistry("controller")
+        if max_queue_size is not None:
+            self.metrics.set("queue_max_size", max_queue_size)
+        self.depth_interval = depth_interval
+        self._last_depth_sample = 0.0
 
     def _alive_counter(self):
         dead_counter = 0
@@ -80,9 +93,28 @@ class VideoFrameController(Thread, Logger):
         return self.buffer.is_empty()
 
     def fetch_frames(self, timeout):
-        remote_frames = self.fifo_queue.get(timeout=timeout)
+        self.sample_queue_depth()
+        try:
+            remote_frames = self.fifo_queue.get(timeout=timeout)
+        except Empty:
+            self.metrics.inc("empty_polls")
+            raise
+        self.metrics.inc("fetched")
         self.buffer.append(remote_frames)
 
+    def sample_queue_depth(self):
+        now = time.monotonic()
+        if now - self._last_depth_sample < self.depth_interval:
+            return
+        self._last_depth_sample = now
+        try:
+            depth = self.fifo_queue.qsize()
+        except NotImplementedError:
+            # macOS has no sem_getvalue()
+            return
+        self.metrics.set("queue_depth", depth)
+        self.metrics.set("queue_depth_peak", max(depth, self.metrics.gauges.get("queue_depth_peak", 0)))
+
     def get_frames(self) -> list[tuple[str, ndarray]]:
         """returns a list of: the frame source id (See VideoSource) and the frame np.array"""
         return [
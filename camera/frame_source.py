@@ -1,6 +1,8 @@
 import queue
+import time
 from camera.utils import rate_limit
 from local_utils.logger import Logger
+from local_utils.metrics import MetricsRegistry
 from abc import ABC, abstractmethod
 from multiprocessing import Process, Queue
 import cv2 as cv
@@ -46,6 +48,9 @@ class QueuedFrameSource(FrameSource, ABC):
         self.queue = fifo_queue
         self.timeout = timeout
         self.fps = fps
+        self.frame_seq = 0  # number of the next frame read, the consumers find the dropped frames from the gaps
+        # frames produced, gated out by the motion detector, dropped on a full queue and delivered
+        self.metrics = MetricsRegistry(id)
 
     @rate_limit
     def read(self):
@@ -56,16 +61,35 @@ class QueuedFrameSource(FrameSource, ABC):
 
     @abstractmethod
     def queue_video_frame(self, frame):
-        self.queue.put([(self.id, frame)], timeout=self.timeout)
+        """frame: the (seq, capture timestamp, frame) returned by next()"""
+        self.put([(self.id, *frame)], frames=1)
+
+    def put(self, message: list, frames: int):
+        """Put the message in the queue, counting the frames it carries as delivered or dropped"""
+        try:
+            self.queue.put(message, timeout=self.timeout)
+        except queue.Full:
+            self.metrics.inc("dropped_full", frames)
+            raise
+        self.metrics.inc("delivered", frames)
 
     def create_stream(self):
-        self.stream = cv.VideoCapture(self.source)
+        if isinstance(self.source, dict):
+            # procedural scene configured in config.yaml, see SyntheticStream
+            from camera.synthetic_source import SyntheticStream
+            self.stream = SyntheticStream(**self.source)
+        else:
+            self.stream = cv.VideoCapture(self.source)
 
     def next(self):
+        """returns the sequence number of the frame, its capture timestamp (time.time()) and the frame"""
         ret, frame = self.read()
         if not ret:
             raise StopIteration()
-        return frame
+        seq = self.frame_seq
+        self.frame_seq += 1
+        self.metrics.inc("produced")
+        return seq, time.time(), frame
 
     def run(self):
         try:
@@ -0,0 +1,105 @@
+import time
+from multiprocessing.sharedctypes import Synchronized
+from typing import Callable
+
+from local_utils.logger import Logger
+from local_utils.metrics import MetricsRegistry
+
+
+class LoadGovernor(Logger):
+    """
+    Keeps the alerts within a latency SLO by degrading the quality of the overloaded cameras, one step of the
+    degradation ladder at a time, and restoring it when the load drops.
+    A camera is overloaded when its capture to decision p95 is above the SLO; when the shared queue fills up
+    the camera doing the most work is degraded too. The levels are shared with the camera processes
+    (multiprocessing.Value), which apply them at their next batch.
+    Hysteresis: a camera changes level at most once every cooldown seconds, and is restored only when its p95 is
+    below recover * slo and the queue is below half of queue_high.
+    usage:
+    ```
+        governor = LoadGovernor({source.id: source.degradation_level for source in sources}, len(ladder), slo=2.0)
+        aggregator.refresh_stats()
+        governor.update(aggregator.stats)
+    ```
+    """
+
+    def __init__(self, levels: dict[int, Synchronized], max_level: int, *, slo: float = 2.0,
+                 queue_high: float = 0.8, recover: float = 0.5, cooldown: float = 10.0,
+                 metrics_for: Callable[[int], MetricsRegistry] = None):
+        """
+        levels: the degradation level of each camera, 0 is the configured quality
+        max_level: the number of steps of the ladder
+        slo: target p95 of the capture to decision latency, in seconds
+        queue_high: fill ratio of the shared queue considered an overload
+        recover: a camera is restored when its p95 is below recover * slo
+        cooldown: minimum seconds between two level changes of the same camera
+        metrics_for: registry of a camera, where its level and level changes are recorded
+        """
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.levels = levels
+        self.max_level = max_level
+        self.slo = slo
+        self.queue_high = queue_high
+        self.recover = recover
+        self.cooldown = cooldown
+        self.metrics_for = metrics_for
+        self._last_change = {camera_id: float("-inf") for camera_id in levels}
+
+    def update(self, stats: dict) -> list[tuple[int, int, int, str]]:
+        """
+        Apply the level changes justified by the stats of MetricsAggregator.refresh_stats.
+        returns the decisions: (camera id, old level, new level, reason)
+        """
+        if stats is None:
+            return []
+        queue = stats["queue"]
+        depth, max_size = queue.get("queue_depth"), queue.get("queue_max_size")
+        queue_fill = depth / max_size if depth is not None and max_size else 0.0
+
+        overloaded = {camera_id: f"decision p95 {stats['cameras'][str(camera_id)]['decision_p95']:.2f}s"
+                      for camera_id in self.levels if self._p95(stats, camera_id) > self.slo}
+        if queue_fill >= self.queue_high and not overloaded:
+            busiest = self._busiest(stats)
+            if busiest is not None:
+                overloaded[busiest] = f"queue {queue_fill:.0%} full"
+
+        now = time.monotonic()
+        decisions = []
+        for camera_id, level in self.levels.items():
+            if now - self._last_change[camera_id] < self.cooldown:
+                continue
+            old = level.value
+            if camera_id in overloaded and old < self.max_level:
+                new, reason = old + 1, overloaded[camera_id]
+            elif (camera_id not in overloaded and old > 0 and self._p95(stats, camera_id) < self.recover * self.slo
+                  and queue_fill < self.queue_high / 2):
+                new, reason = old - 1, f"load below {self.recover * self.slo:.2f}s"
+            else:
+                continue
+            level.value = new
+            self._last_change[camera_id] = now
+            decisions.append((camera_id, old, new, reason))
+            log = self.logger.warning if new > old else self.logger.info
+            log("camera %s: quality level %s -> %s (%s)", camera_id, old, new, reason)
+            if self.metrics_for is not None:
+                metrics = self.metrics_for(camera_id)
+                metrics.set("degradation_level", new)
+                metrics.inc("degradation_changes")
+        return decisions
+
+    @staticmethod
+    def _p95(stats: dict, camera_id: int) -> float:
+        """decision p95 of the camera, 0 if it had no detections in the last interval"""
+        camera = stats["cameras"].get(str(camera_id))
+        p95 = camera["decision_p95"] if camera is not None else None
+        return p95 if p95 is not None else 0.0
+
+    def _busiest(self, stats: dict) -> int | None:
+        """The camera sending the most frames past the motion gate, among the ones that can still be degraded"""
+        candidates = []
+        for camera_id, level in self.levels.items():
+            camera = stats["cameras"].get(str(camera_id))
+            if level.value >= self.max_level or camera is None or camera["fps"] is None:
+                continue
+            candidates.append((camera["fps"] * (camera["motion_rate"] or 0), camera_id))
+        return max(candidates)[1] if candidates else None
@@ -0,0 +1,303 @@
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+
+import cv2 as cv
+import torch
+
+from camera.detection_cache import DetectionCache, SegmentOutputs, decide, file_hash, MIN_BOX_SIZE
+from camera.detection_message import DetectionMessage
+from camera.video_processor import VideoProcessor
+from face_recognizer.face_recognizer import FaceRecognizer
+from local_utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Segment:
+    """Frames [start_frame, end_frame) of a video file"""
+
+    def __init__(self, video_id: int, video_path: str, start_frame: int, end_frame: int, fps: float):
+        self.video_id = video_id
+        self.video_path = video_path
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.fps = fps
+
+    def __len__(self):
+        return self.end_frame - self.start_frame
+
+    def __repr__(self):
+        return f"Segment({self.video_path}, frames {self.start_frame}-{self.end_frame})"
+
+
+class ReplayResult:
+    def __init__(self, messages: list[DetectionMessage], frames: int, elapsed: float):
+        """
+        messages: the detections of all the videos, sorted by video id and frame number
+        frames: frames read, warmup frames excluded
+        elapsed: seconds of wall clock time
+        """
+        self.messages = messages
+        self.frames = frames
+        self.elapsed = elapsed
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def split_video(video_id: int, video_path: str, segment_seconds: float) -> list[Segment]:
+    cap = cv.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"cannot open video {video_path}")
+        n_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv.CAP_PROP_FPS) or 30.0
+    finally:
+        cap.release()
+    segment_frames = max(1, int(segment_seconds * fps))
+    return [
+        Segment(video_id, video_path, start, min(start + segment_frames, n_frames), fps)
+        for start in range(0, n_frames, segment_frames)
+    ]
+
+
+def seek(cap: cv.VideoCapture, frame_index: int):
+    """Seek to frame_index, reading the frames in between if the backend can only seek to the keyframes"""
+    if frame_index > 0:
+        cap.set(cv.CAP_PROP_POS_FRAMES, frame_index)
+    position = int(cap.get(cv.CAP_PROP_POS_FRAMES))
+    if position > frame_index:  # landed after the frame, start from the beginning
+        cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+        position = 0
+    for _ in range(frame_index - position):
+        if not cap.grab():
+            break
+
+
+# VideoProcessor of the worker process, its models are loaded once and used for all the segments of the worker
+_processor: VideoProcessor | None = None
+
+
+def _init_worker(torch_threads: int, processor_kwargs: dict):
+    # the workers share the cores, torch would use all of them in every worker
+    torch.set_num_threads(torch_threads)
+    global _processor
+    _processor = VideoProcessor(0, source=None, fifo_queue=None, fps=0, view=False, **processor_kwargs)
+    _processor.setup()
+    # the workers exit through multiprocessing, which runs the finalizers and not atexit
+    Finalize(_processor, _processor.teardown, exitpriority=10)
+
+
+def segment_processor(segment: Segment, processor_kwargs: dict,
+                      processor: VideoProcessor = None) -> tuple[VideoProcessor, bool]:
+    """
+    The processor of the segment: the given one, reset, or a new one with its models loaded.
+    returns the processor and True if it was created, then the caller tears it down
+    """
+    if processor is not None:
+        processor.reset(segment.video_id)
+        return processor, False
+    processor = VideoProcessor(segment.video_id, source=segment.video_path, fifo_queue=None, fps=0,
+                               view=False, **processor_kwargs)
+    processor.setup()
+    return processor, True
+
+
+def process_segment(segment: Segment, processor_kwargs: dict, *, batch_size: int = 4, warmup_frames: int = 30,
+                    keep_frames: bool = False, processor: VideoProcessor = None) -> tuple[list[DetectionMessage], int]:
+    """
+    Run the VideoProcessor pipeline on the frames of the segment, as fast as possible.
+    The motion detector is first fed with the warmup_frames before the segment, so that its background model
+    is the same as if the video was processed from the beginning.
+    The capture timestamps of the messages are the video time in seconds.
+    processor: a processor built with processor_kwargs to reuse, None to load the models for this segment
+    returns the detection messages, without the frames unless keep_frames, and the number of frames processed
+    """
+    processor, owned = segment_processor(segment, processor_kwargs, processor)
+    cap = cv.VideoCapture(segment.video_path)
+    messages, processed = [], 0
+    try:
+        warmup_start = max(0, segment.start_frame - warmup_frames)
+        seek(cap, warmup_start)
+        for _ in range(segment.start_frame - warmup_start):
+            ret, frame = cap.read()
+            if not ret:
+                return messages, processed
+            processor.is_moving(processor.preprocessor(frame).proxy)
+
+        frame_index = segment.start_frame
+        while frame_index < segment.end_frame:
+            frames = []
+            while len(frames) < batch_size and frame_index < segment.end_frame:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append((frame_index, frame_index / segment.fps, frame))
+                frame_index += 1
+            if not frames:
+                break
+            processed += len(frames)
+            for message in processor.process_video_frames(frames):
+                if not keep_frames:
+                    message.frame = None
+                messages.append(message)
+    finally:
+        cap.release()
+        if owned:
+            processor.teardown()
+    return messages, processed
+
+
+def _process_segment(args):
+    return process_segment(*args[:2], **args[2], processor=_processor)
+
+
+def compute_segment(segment: Segment, processor_kwargs: dict, cache: DetectionCache, *, batch_size: int = 4,
+                    warmup_frames: int = 30, processor: VideoProcessor = None) -> int:
+    """
+    Run the models on every frame of the segment, without motion gating, and store their outputs in the cache.
+    processor: a processor built with processor_kwargs to reuse, None to load the models for this segment
+    returns the number of frames processed
+    """
+    processor, owned = segment_processor(segment, processor_kwargs, processor)
+    motion_detector = processor.motion_detector
+    preprocessor = processor.preprocessor
+    preprocessor.batch_size = batch_size
+    optical_flow = processor.motion_detector_name == "optical_flow"
+    cap = cv.VideoCapture(segment.video_path)
+    frames, motion, box_frames, boxes, face_boxes, embeddings = [], [], [], [], [], []
+    try:
+        warmup_start = max(0, segment.start_frame - warmup_frames)
+        seek(cap, warmup_start)
+        previous = None
+        for _ in range(segment.start_frame - warmup_start):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            # the motion detector sees the proxy of the frames, as in VideoProcessor.process_video_frames
+            previous = preprocessor(frame).proxy
+            if not optical_flow:
+                motion_detector.score(previous)
+
+        frame_index = segment.start_frame
+        while frame_index < segment.end_frame:
+            batch = []
+            while len(batch) < batch_size and frame_index < segment.end_frame:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                pyramid = preprocessor(frame)
+                if optical_flow:
+                    # the first frame of the video has no previous one: counted as moving
+                    score = motion_detector.score(previous, pyramid.proxy) if previous is not None else float("inf")
+                    previous = pyramid.proxy
+                else:
+                    score = motion_detector.score(pyramid.proxy)
+                frames.append(frame_index)
+                motion.append(score)
+                batch.append((frame_index, pyramid.inference))
+                frame_index += 1
+            if not batch:
+                break
+
+            results = processor.yolo_model([frame for _, frame in batch], classes=[0], device=processor.device, verbose=False)
+            for result, (index, frame) in zip(results, batch):
+                for x1, y1, x2, y2 in result.boxes.xyxy.type(torch.int32).tolist():
+                    box_frames.append(index)
+                    boxes.append((x1, y1, x2, y2))
+                    if x2 - x1 < MIN_BOX_SIZE or y2 - y1 < MIN_BOX_SIZE:
+                        continue
+                    face_embeddings = processor.face_recognizer.get_embeddings(frame[y1:y2, x1:x2])
+                    face_boxes.extend([len(boxes) - 1] * len(face_embeddings))
+                    embeddings.append(face_embeddings.numpy())
+    finally:
+        cap.release()
+        if owned:
+            processor.teardown()
+    cache.save(segment.start_frame, segment.end_frame,
+               SegmentOutputs.build(frames, motion, box_frames, boxes, face_boxes, embeddings))
+    return len(frames)
+
+
+def _compute_segment(args):
+    segment, processor_kwargs, cache_args, kwargs = args
+    return compute_segment(segment, processor_kwargs, DetectionCache(**cache_args), **kwargs, processor=_processor)
+
+
+def _cache_args(cache_dir: str, video_path: str, video_hash: str, processor_kwargs: dict, warmup_frames: int) -> dict:
+    return dict(cache_dir=cache_dir, video_path=video_path, video_hash=video_hash, warmup_frames=warmup_frames,
+                yolo=processor_kwargs["yolo"], scale_size=processor_kwargs.get("scale_size", 100),
+                motion_detector=processor_kwargs.get("motion_detector", "mog2"),
+                motion_scale=processor_kwargs.get("motion_scale", 100))
+
+
+def replay_cached(video_paths: list[str], processor_kwargs: dict, cache_dir: str, *, segment_seconds: float = 60,
+                  workers: int = None, batch_size: int = 4, warmup_frames: int = 30) -> ReplayResult:
+    """
+    Same results as replay(), without the frames, through a DetectionCache: the segments missing from the cache
+    are computed by the pool of workers, then the decisions are taken on the cached outputs in this process.
+    When everything is cached no model is run, only the face recognizer galleries are matched.
+    """
+    workers = workers if workers is not None else os.cpu_count()
+    start = time.perf_counter()
+    segments = [segment for video_id, path in enumerate(video_paths) for segment in split_video(video_id, path, segment_seconds)]
+    hashes = {path: file_hash(path) for path in video_paths}
+    caches = {path: DetectionCache(**_cache_args(cache_dir, path, hashes[path], processor_kwargs, warmup_frames)) for path in video_paths}
+
+    missing = [segment for segment in segments if not caches[segment.video_path].has(segment.start_frame, segment.end_frame)]
+    logger.info("%s of %s segments cached", len(segments) - len(missing), len(segments))
+    if missing:
+        tasks = [(segment, processor_kwargs,
+                  _cache_args(cache_dir, segment.video_path, hashes[segment.video_path], processor_kwargs, warmup_frames),
+                  dict(batch_size=batch_size, warmup_frames=warmup_frames))
+                 for segment in sorted(missing, key=len, reverse=True)]
+        torch_threads = max(1, math.floor((os.cpu_count() or 1) / workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(torch_threads, processor_kwargs)) as executor:
+            list(executor.map(_compute_segment, tasks))
+
+    face_recognizer = FaceRecognizer(threshold=processor_kwargs.get("face_recogniser_threshold", 0.5))
+    messages = []
+    for segment in segments:
+        outputs = caches[segment.video_path].load(segment.start_frame, segment.end_frame)
+        messages.extend(decide(
+            outputs, segment.video_id, segment.fps,
+            motion_detector=processor_kwargs.get("motion_detector", "mog2"),
+            motion_detector_threshold=processor_kwargs.get("motion_detector_threshold", 0.5),
+            motion_detector_min_area=processor_kwargs.get("motion_detector_min_area", 500),
+            motion_scale=processor_kwargs.get("motion_scale", 100),
+            face_recognizer=face_recognizer,
+        ))
+    return ReplayResult(messages, sum(len(segment) for segment in segments), time.perf_counter() - start)
+
+
+def replay(video_paths: list[str], processor_kwargs: dict, *, segment_seconds: float = 60, workers: int = None,
+           batch_size: int = 4, warmup_frames: int = 30, keep_frames: bool = False) -> ReplayResult:
+    """
+    Process the video files with the VideoProcessor pipeline, with no rate limit.
+    The videos are split in segments of segment_seconds, processed in parallel by a pool of workers,
+    the results are merged in frame order. The video ids are the positions in video_paths.
+    processor_kwargs: VideoProcessor arguments (yolo, scale_size, face_recogniser_threshold, ...)
+    """
+    workers = workers if workers is not None else os.cpu_count()
+    segments = [segment for video_id, path in enumerate(video_paths) for segment in split_video(video_id, path, segment_seconds)]
+    # the longest segments first, so that the pool is not left waiting for a long one at the end
+    order = sorted(range(len(segments)), key=lambda i: len(segments[i]), reverse=True)
+    tasks = [(segments[i], processor_kwargs, dict(batch_size=batch_size, warmup_frames=warmup_frames, keep_frames=keep_frames))
+             for i in order]
+    logger.info("replaying %s videos in %s segments with %s workers", len(video_paths), len(segments), workers)
+
+    start = time.perf_counter()
+    torch_threads = max(1, math.floor((os.cpu_count() or 1) / workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(torch_threads, processor_kwargs)) as executor:
+        results = list(executor.map(_process_segment, tasks))
+    elapsed = time.perf_counter() - start
+
+    messages = [message for segment_messages, _ in results for message in segment_messages]
+    messages.sort(key=lambda message: (message.camera_id, message.seq))
+    return ReplayResult(messages, sum(frames for _, frames in results), elapsed)
@@ -0,0 +1,149 @@
+from multiprocessing import Queue
+
+import cv2 as cv
+import numpy as np
+
+from camera.frame_source import QueuedFrameSource
+
+
+def person_sprite(height: int, variant: int = 0) -> np.ndarray:
+    """
+    A person silhouette as a BGRA image, drawn procedurally so that no image has to be shipped.
+    The variants change the pose and the colors of the clothes.
+    """
+    width = height // 2
+    sprite = np.zeros((height, width, 4), dtype=np.uint8)
+    shirt = [(40, 40, 160, 255), (160, 80, 40, 255), (40, 140, 40, 255), (120, 120, 120, 255)][variant % 4]
+    trousers = [(60, 40, 30, 255), (30, 30, 30, 255), (90, 70, 50, 255)][variant % 3]
+    skin = (140, 170, 210, 255)
+    head, cx = height // 8, width // 2
+    stride = [0, 1, -1][variant % 3] * width // 8
+    hips = height // 2 + head
+
+    cv.circle(sprite, (cx, head), head, skin, -1)
+    cv.rectangle(sprite, (cx - width // 4, 2 * head), (cx + width // 4, hips), shirt, -1)
+    cv.line(sprite, (cx - width // 4, 2 * head + 5), (cx - width // 2 + 3, height // 2), shirt, max(1, width // 8))
+    cv.line(sprite, (cx + width // 4, 2 * head + 5), (cx + width // 2 - 3, height // 2), shirt, max(1, width // 8))
+    cv.line(sprite, (cx - width // 8, hips), (cx - width // 8 - stride, height - 3), trousers, max(1, width // 6))
+    cv.line(sprite, (cx + width // 8, hips), (cx + width // 8 + stride, height - 3), trousers, max(1, width // 6))
+    return sprite
+
+
+class SyntheticStream:
+    """
+    A procedural scene with the interface of cv.VideoCapture used by the frame sources (read, isOpened, release):
+    a static background, moving blobs bouncing on the borders, optional person sprites walking across the
+    scene and sensor noise. Every frame depends only on the seed and its index, so runs are reproducible.
+    usage, in config.yaml:
+    ```
+        - id: 10
+          name: 'synthetic_10'
+          source: {type: synthetic, width: 640, height: 480, blobs: 3, sprites: 1, noise: 8, seed: 10}
+    ```
+    """
+
+    def __init__(self, width: int = 640, height: int = 480, blobs: int = 3, blob_radius: tuple[int, int] = (15, 50),
+                 speed: float = 4.0, sprites: int = 0, sprite_height: int = None, noise: float = 5.0,
+                 frames: int = None, seed: int = 0, type: str = "synthetic"):
+        """
+        width, height: resolution of the frames
+        blobs: number of moving circles, blob_radius their min and max radius
+        speed: max pixels per frame of the blobs and the sprites
+        sprites: number of person silhouettes walking across the scene, sprite_height their height (default height / 3)
+        noise: standard deviation of the gaussian noise, 0 for none
+        frames: the stream ends after this many frames, None for an endless stream
+        seed: seed of the scene, different cameras should use different seeds
+        type: always 'synthetic', the key used in config.yaml to select this stream
+        """
+        self.width, self.height = width, height
+        self.frames = frames
+        self.index = 0
+        self.opened = True
+        rng = np.random.default_rng(seed)
+
+        # background: a gradient with some static rectangles as furniture
+        gradient = np.linspace(60, 160, width, dtype=np.float32)
+        self.background = np.repeat(np.repeat(gradient[None, :, None], height, axis=0), 3, axis=2).astype(np.uint8)
+        for _ in range(4):
+            x, y = int(rng.integers(0, width - width // 5)), int(rng.integers(0, height - height // 5))
+            color = tuple(int(c) for c in rng.integers(30, 220, 3))
+            cv.rectangle(self.background, (x, y), (x + width // 5, y + height // 5), color, -1)
+
+        self.blob_radius = rng.integers(blob_radius[0], blob_radius[1] + 1, blobs)
+        self.blob_position = rng.uniform((0, 0), (width, height), (blobs, 2))
+        self.blob_velocity = rng.uniform(-speed, speed, (blobs, 2))
+        self.blob_color = rng.integers(0, 256, (blobs, 3))
+
+        sprite_height = sprite_height if sprite_height is not None else height // 3
+        self.sprites = [person_sprite(sprite_height, int(rng.integers(0, 12))) for _ in range(sprites)]
+        self.sprite_position = rng.uniform((0, 0), (width, max(1, height - sprite_height)), (sprites, 2))
+        self.sprite_velocity = np.column_stack([rng.uniform(-speed, speed, sprites), np.zeros(sprites)])
+
+        # a bank of noise frames, generating new noise for every frame would cost more than the rest
+        self.noise = [
+            (np.clip(rng.normal(0, noise, (height, width, 3)), 0, 255).astype(np.uint8),
+             np.clip(-rng.normal(0, noise, (height, width, 3)), 0, 255).astype(np.uint8))
+            for _ in range(8)
+        ] if noise > 0 else []
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def release(self):
+        self.opened = False
+
+    def _move(self, position: np.ndarray, velocity: np.ndarray, size: np.ndarray):
+        position += velocity
+        low, high = position < 0, position > np.array([self.width, self.height]) - size
+        velocity[low | high] *= -1
+        np.clip(position, 0, np.maximum(np.array([self.width, self.height]) - size, 0), out=position)
+
+    def _paste(self, frame: np.ndarray, sprite: np.ndarray, x: int, y: int):
+        h, w = sprite.shape[:2]
+        h, w = min(h, self.height - y), min(w, self.width - x)
+        if h <= 0 or w <= 0:
+            return
+        alpha = sprite[:h, :w, 3:] > 0
+        np.copyto(frame[y:y + h, x:x + w], sprite[:h, :w, :3], where=alpha)
+
+    def read(self) -> tuple[bool, np.ndarray]:
+        if not self.opened or (self.frames is not None and self.index >= self.frames):
+            return False, None
+        frame = self.background.copy()
+
+        self._move(self.blob_position, self.blob_velocity, self.blob_radius[:, None])
+        for (x, y), radius, color in zip(self.blob_position, self.blob_radius, self.blob_color):
+            cv.circle(frame, (int(x), int(y)), int(radius), tuple(int(c) for c in color), -1)
+
+        if self.sprites:
+            sizes = np.array([(sprite.shape[1], sprite.shape[0]) for sprite in self.sprites])
+            self._move(self.sprite_position, self.sprite_velocity, sizes)
+            for (x, y), sprite in zip(self.sprite_position, self.sprites):
+                self._paste(frame, sprite, int(x), int(y))
+
+        if self.noise:
+            plus, minus = self.noise[self.index % len(self.noise)]
+            cv.add(frame, plus, dst=frame)
+            cv.subtract(frame, minus, dst=frame)
+        self.index += 1
+        return True, frame
+
+
+def is_synthetic(source) -> bool:
+    return isinstance(source, dict) and source.get("type") == "synthetic"
+
+
+class SyntheticCameraSource(QueuedFrameSource):
+    """
+    Sends the raw frames of a SyntheticStream to the queue, without processing them:
+    a load generator for the controller, the queue and the consumers.
+    """
+
+    def __init__(self, id, fifo_queue: Queue, timeout=0.1, fps=30, **stream_kwargs):
+        """stream_kwargs: SyntheticStream arguments, the seed defaults to the id"""
+        stream_kwargs.setdefault("seed", id)
+        stream_kwargs["type"] = "synthetic"
+        super().__init__(id, stream_kwargs, fifo_queue=fifo_queue, timeout=timeout, fps=fps, daemon=False)
+
+    def queue_video_frame(self, frame):
+        super().queue_video_frame(frame)
@@ -38,7 +38,7 @@ class QueuedFrameControllerFactory(AbstractFrameControllerFactory):
 
         frame_sources = self._instantiate_source(config.sources, fifo_queue=fifo_queue)
 
-        frame_controller = VideoFrameController(frame_sources, fifo_queue=fifo_queue)
+        frame_controller = VideoFrameController(frame_sources, fifo_queue=fifo_queue, max_queue_size=max_queue_size)
         return frame_controller
 
 
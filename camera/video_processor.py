@@ -1,15 +1,26 @@
-from multiprocessing import Queue
+import queue
+import time
+from multiprocessing import Queue, Value
 from typing import Union
 
+import numpy as np
 import torch
 from ultralytics import YOLO
+from camera.clip_recorder import ClipRecorder
+from camera.compositor import Compositor, ThumbnailSlot
+from camera.utils import rate_limit
+from camera.detection_message import DetectionMessage
 from camera.frame_controller import VideoFrameController
 from camera.frame_source import QueuedFrameSource, FrameSource
+from camera.synthetic_source import is_synthetic
 from camera.video_frame_initializer import QueuedFrameControllerFactory
+from db.db_lite import CameraAccessPolicyWatcher
 from face_recognizer.face_recognizer import FaceRecognizer
 from local_utils.config import VideoFrameControllerConfig, VideoFrameSourceConfig
-from local_utils.frames import rescale_frame
-from local_utils.view import view
+from local_utils.image_encoding import JpegProfile
+from local_utils.metrics import process_usage
+from local_utils.preprocessing import FramePreprocessor, FramePyramid
+from local_utils.profiling import Profiler
 from motion_detector.motion_detector import MotionDetector
 
 
@@ -23,13 +34,27 @@ class VideoProcessor(QueuedFrameSource):
                  motion_detector_threshold= 0.5,
                  motion_detector_min_area=500,
                  motion_detector= "mog2",
+                 motion_scale=100,
                  scale_size=100,
                  batch_size: int = 1,
                  fifo_queue: Queue,
                  timeout=0.1,
                  fps=30,
                  device=None,
-                 view: bool=False
+                 view: bool=False,
+                 db_path: str = None,
+                 policy_refresh_interval: float = 1.0,
+                 encode_jpeg: bool = False,
+                 jpeg_profile: JpegProfile = None,
+                 clips: dict = None,
+                 metrics_interval: float = None,
+                 profiling: dict = None,
+                 degradation_ladder: list[dict] = None,
+                 allow_skip_face_recognition: bool = False,
+                 torch_threads: int = None,
+                 tracker: str = None,
+                 track_label_frames: int = 15,
+                 thumbnails: ThumbnailSlot = None,
                  ):
         super().__init__(id, source, fifo_queue, timeout, fps, daemon=False)
         self.name = name if name is not None else f"VideoProcessor-{id}"
@@ -49,19 +74,119 @@ class VideoProcessor(QueuedFrameSource):
         self.motion_detector_threshold = motion_detector_threshold
         self.motion_detector_min_area = motion_detector_min_area
         self.motion_detector_name = motion_detector
+        # the motion detector sees the frames rescaled to motion_scale, the min area is rescaled with them
+        self.motion_scale = motion_scale
+        self.preprocessor = None
+        # access policy of this camera, used to skip the work that can't change the access decision
+        self.db_path = db_path
+        self.policy_refresh_interval = policy_refresh_interval
+        self.access_policy = None
+        # frames with persons are sent as JPEG, annotated with all their boxes: much smaller to pickle through the queue
+        self.jpeg_profile = (jpeg_profile if jpeg_profile is not None else JpegProfile()) if encode_jpeg else None
+        self._previous_frame = None  # optical flow compares each frame with the previous one
+        # frame of the last message queued or dropped, and frames skipped on purpose so far, see DetectionMessage.skipped
+        self._last_queued_seq = -1
+        self._skipped_total = 0
+        # ClipRecorder kwargs, None to not record the clips of the detections
+        self.clips_config = clips
+        self.clip_recorder = None
+        # self.metrics also times each stage, sent to the main process every metrics_interval seconds (never if None)
+        self.metrics_interval = metrics_interval
+        self._last_metrics = time.monotonic()
+        # Profiler kwargs, None to not accept profiling requests (see local_utils.profiling)
+        self.profiling_config = profiling
+        self.profiler = None
+        # quality steps applied when the LoadGovernor of the main process raises degradation_level (see apply_degradation)
+        self.degradation_ladder = degradation_ladder
+        self.degradation_level = Value('i', 0)
+        self.allow_skip_face_recognition = allow_skip_face_recognition
+        self._applied_level = 0
+        self.configured_quality = (scale_size, yolo)
+        self.stride = 1
+        self.degraded_skip_face_recognition = False
+        self._yolo_models = {}
+        self.torch_threads = torch_threads  # None to leave the torch default, all the cores
+        # ultralytics tracker config (e.g. "bytetrack.yaml"), None to not track. The label of a track is reused for
+        # track_label_frames frames at most, and only while the track is seen in every frame: the ids can be swapped
+        # across a gap (motion gate, stride) or when two persons cross
+        self.tracker = tracker
+        self.track_label_frames = track_label_frames
+        self._track_labels: dict[int, tuple[str, float, int]] = {}  # track id -> label, confidence, seq recognized
+        self._track_seen: dict[int, int] = {}  # track id -> seq of the last frame with the track
+        # with view, the annotated thumbnails are shown by the Compositor process, None to not show them
+        self.thumbnails = thumbnails
 
-    def run(self):
-        self.motion_detector = MotionDetector(detector=self.motion_detector_name, threshold=self.motion_detector_threshold, min_area=self.motion_detector_min_area)
+    def setup(self):
+        """
+        Load the models and start the helpers, in the process which uses them.
+        Called by run(), or directly to use process_video_frames() without starting the process (see camera.replay).
+        """
+        self.reset()
+        self.preprocessor = FramePreprocessor(self.scale_size, proxy_scale=self.motion_scale,
+                                              proxy_gray=self.motion_detector_name == "optical_flow",
+                                              batch_size=self.batch_size)
         self.yolo_model = YOLO(self.yolo_model_name)
-        self.face_recognizer = FaceRecognizer(threshold=self.face_recogniser_threshold)
-        super().run()
+        self._yolo_models = {self.yolo_model_name: self.yolo_model}
+        self.face_recognizer = FaceRecognizer(threshold=self.face_recogniser_threshold, metrics=self.metrics)
+        if self.db_path is not None:
+            self.access_policy = CameraAccessPolicyWatcher(self.db_path, self.id, self.policy_refresh_interval)
+        if self.clips_config is not None:
+            self.clip_recorder = ClipRecorder(self.id, on_clip=self.queue_clip, **self.clips_config)
+            self.clip_recorder.start()
+
+    def reset(self, id=None):
+        """
+        Forget the frames seen, keeping the models: the next frames are processed as the start of a new video.
+        id: camera id of the next messages, unchanged if None (camera.replay reuses a processor for many segments)
+        """
+        if id is not None:
+            self.id = id
+        min_area = self.motion_detector_min_area * (self.motion_scale / 100) ** 2
+        self.motion_detector = MotionDetector(detector=self.motion_detector_name, threshold=self.motion_detector_threshold, min_area=min_area)
+        self._previous_frame = None
+        self._last_queued_seq = -1
+        self._skipped_total = 0
+        self.forget_tracks()
+        predictor = getattr(self.yolo_model, "predictor", None)
+        for tracker in getattr(predictor, "trackers", None) or []:
+            tracker.reset()
+
+    def teardown(self):
+        if self.access_policy is not None:
+            self.access_policy.close()
+        if self.clip_recorder is not None:
+            self.clip_recorder.stop()
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+
+    def run(self):
+        if self.torch_threads is not None:
+            torch.set_num_threads(self.torch_threads)
+        self.setup()
+        if self.profiling_config is not None:
+            self.profiler = Profiler(f"camera-{self.id}", **self.profiling_config)
+            self.profiler.install()
+        try:
+            super().run()
+        finally:
+            self.teardown()
+            if self.profiler is not None:
+                self.profiler.uninstall()
+
+    @rate_limit
+    def read(self):
+        with self.metrics.timer("decode"):
+            return self.stream.read()
 
     def next(self):
+        """returns up to batch_size (seq, capture timestamp, frame)"""
         frames = []
         try:
             for _ in range(self.batch_size):
-                frame = super().next()
-                frames.append(frame)
+                seq, capture_ts, frame = super().next()
+                frames.append((seq, capture_ts, frame))
+                if self.clip_recorder is not None:
+                    self.clip_recorder.add_frame(capture_ts, frame)
         except StopIteration:
             if len(frames) == 0:
                 # do not discard the last frames
@@ -70,82 +195,276 @@ class VideoProcessor(QueuedFrameSource):
         return frames
 
     def queue_video_frame(self, frames):
+        if self.profiler is not None:
+            self.profiler.poll()
+        if self.degradation_ladder is not None:
+            self.apply_degradation()
+            if self.stride > 1:
+                strided = [frame for frame in frames if frame[0] % self.stride == 0]
+                self.metrics.inc("strided", len(frames) - len(strided))
+                frames = strided
         # put the frames in the queue
         detection = self.process_video_frames(frames)
-        # detection: list[Union[int, str], list[str, tuple[str, str]]]
+        # detection: list[DetectionMessage], one for each frame with persons
         if len(detection) > 0:
-            self.queue.put([detection], timeout=self.timeout)
+            for message in detection:
+                self._skipped_total += message.seq - self._last_queued_seq - 1
+                message.skipped = self._skipped_total
+                self._last_queued_seq = message.seq
+            if self.clip_recorder is not None:
+                # a clip of allowed people would hold back, by min_interval, the clip of a violation starting soon after
+                violation = next((message for message in detection if self.may_be_violation(message)), None)
+                if violation is not None:
+                    self.clip_recorder.trigger(violation.capture_ts)
+            with self.metrics.timer("ipc"):
+                self.put([detection], frames=len(detection))
+        self.ship_metrics()
 
-    def process_video_frames(self, frames) -> list[list[int, str, str]]:
+    def may_be_violation(self, message: DetectionMessage) -> bool:
+        """
+        True if a person of the message may have no access to this camera: an unlabelled person, a person unknown
+        to the access policy or denied by it. Always True without an access policy.
+        """
+        policy = self.access_policy.policy() if self.access_policy is not None else None
+        if policy is None:
+            return True
+        return any(label is None or label not in policy.decisions or not policy.has_access(label)
+                   for label in message.labels)
+
+    def apply_degradation(self):
+        """Switch to the step of the degradation ladder set by the LoadGovernor, level 0 is the configured quality"""
+        level = self.degradation_level.value
+        if level == self._applied_level:
+            return
+        scale_size, yolo = self.configured_quality
+        step = self.degradation_ladder[level - 1] if level > 0 else {}
+        self.scale_size = min(scale_size, step.get("scale_size", scale_size))
+        if self.preprocessor is not None:
+            self.preprocessor.scale_size = self.scale_size
+        self.stride = step.get("stride", 1)
+        # without face recognition everybody is unknown, only for the cameras where that is acceptable
+        self.degraded_skip_face_recognition = step.get("skip_face_recognition", False) and self.allow_skip_face_recognition
+        yolo = step.get("yolo", yolo)
+        if yolo not in self._yolo_models:
+            self._yolo_models[yolo] = YOLO(yolo)
+        if self._yolo_models[yolo] is not self.yolo_model:
+            # each model has its own tracker, the track ids start again
+            self.forget_tracks()
+        self.yolo_model = self._yolo_models[yolo]
+        self.logger.info("[%s] quality level %s -> %s: scale %s%%, stride %s, face recognition %s, %s", self.id,
+                         self._applied_level, level, self.scale_size, self.stride,
+                         "off" if self.degraded_skip_face_recognition else "on", yolo)
+        self._applied_level = level
+
+    def ship_metrics(self):
+        if self.metrics_interval is None or time.monotonic() - self._last_metrics < self.metrics_interval:
+            return
+        self._last_metrics = time.monotonic()
+        process_usage(self.metrics)
+        try:
+            self.queue.put_nowait([[self.metrics.snapshot()]])
+        except queue.Full:
+            pass  # the next one will carry the same counts
+
+    def queue_clip(self, clip):
+        """Called from the clip writer thread, the clip is sent as a detection batch of its own"""
+        self.queue.put([[clip]], timeout=self.timeout)
+
+    def process_video_frames(self, frames) -> list[DetectionMessage]:
         # Each process gets its own model and face recognizer
-        batch_frames = [rescale_frame(frame, self.scale_size) for frame in
-                        frames if self.motion_detector(frame)]  # Resize the frame to 50% of its original size
+        # the inference frames of the whole batch must stay valid until YOLO runs
+        self.preprocessor.batch_size = max(self.preprocessor.batch_size, len(frames))
+        captures = []
+        for seq, capture_ts, frame in frames:
+            pyramid = self.preprocessor(frame)
+            with self.metrics.timer("motion"):
+                moving = self.is_moving(pyramid.proxy)
+            if not moving:
+                self.metrics.inc("gated")
+                continue
+            captures.append((seq, capture_ts, pyramid))
+
+        if len(captures) == 0:
+            self.publish_thumbnail(self.view_frame(pyramid) if frames else None)
+            return []
 
-        if len(batch_frames) == 0:
+        policy = self.access_policy.policy() if self.access_policy is not None else None
+        if policy is not None and policy.skip_person_detection:
+            # everybody can access this camera, no detection can cause a violation
+            self.metrics.inc("empty", len(captures))
+            self.publish_thumbnail(self.view_frame(pyramid))
             return []
+        # if everybody is denied the identity doesn't matter, detections are sent unlabelled
+        skip_face_recognition = (policy is not None and policy.skip_face_recognition) or self.degraded_skip_face_recognition
+
+        with self.metrics.timer("rescale"):
+            batch_frames = [pyramid.inference for _, _, pyramid in captures]
 
         # When the batch is full or end-of-video is reached, process the batch.
-        results = self.yolo_model(
-            batch_frames, classes=[0], device=self.device, verbose=False
-        )
-
-        if self.view:
-            self.view_frames([result.plot() for result in results], winname=str(self.id) + ': yolo')
-
-        label_index, detections = 1, []
-        for result, frame in zip(results, batch_frames):
-            detect = [self.id, None, frame] # id, label, frame
-            boxes = result.boxes.xyxy.type(torch.int32)
-            for box in boxes:
-                x1, y1, x2, y2 = box
-                if x2 - x1 < 20 or y2 - y1 < 20: continue
-
-                detected_person_image = frame[y1:y2, x1:x2]
-
-                faces = self.face_recognizer.recognize_faces(detected_person_image)
-                if len(faces) == 0:
-                    detections.append(detect)
-                    continue
-
-                for detected_face in faces:
-                    face_detected = detected_face["label"]
-                    if face_detected is not None:
-                        detect[label_index] = face_detected
-                        detections.append(detect)
-                        self.logger.debug(
-                            "[%s] Detected face: %s with confidence %s", self.id, face_detected, detected_face['confidence']
-                        )
-                    else:
-                        detections.append(detect)
+        with self.metrics.timer("yolo"):
+            if self.tracker is not None:
+                # a list is tracked as many streams, the frames of the batch are consecutive frames of one stream
+                results = [self.yolo_model.track(frame, classes=[0], device=self.device, verbose=False, persist=True,
+                                                 tracker=self.tracker)[0] for frame in batch_frames]
+            else:
+                results = self.yolo_model(
+                    batch_frames, classes=[0], device=self.device, verbose=False
+                )
+
+        self.publish_thumbnail(batch_frames[-1], results[-1].boxes.xyxy.tolist())
+
+        detections = []
+        for result, (seq, capture_ts, pyramid) in zip(results, captures):
+            frame = pyramid.inference
+            track_ids = result.boxes.id.int().tolist() if result.boxes.id is not None else [None] * len(result.boxes)
+            kept = [(box, track_id) for box, track_id in zip(result.boxes.xyxy.type(torch.int32).tolist(), track_ids)
+                    if box[2] - box[0] >= 20 and box[3] - box[1] >= 20]
+            if len(kept) == 0:
+                continue
+            boxes, track_ids = [box for box, _ in kept], [track_id for _, track_id in kept]
+
+            labels, confidences = [None] * len(boxes), [float('nan')] * len(boxes)
+            if not skip_face_recognition:
+                for i, box in enumerate(boxes):
+                    cached = self.track_label(track_ids[i], seq)
+                    if cached is not None:
+                        # recognized in a recent frame of the track
+                        labels[i], confidences[i] = cached
+                        continue
+                    # the first recognized face in the box labels the person
+                    for detected_face in self.recognize_person(frame, box):
+                        if detected_face["label"] is not None:
+                            labels[i], confidences[i] = detected_face["label"], detected_face["confidence"]
+                            if track_ids[i] is not None:
+                                self._track_labels[track_ids[i]] = labels[i], confidences[i], seq
+                            self.logger.debug(
+                                "[%s] Detected face: %s with confidence %s", self.id, labels[i], confidences[i]
+                            )
+                            break
+
+            # the frame is sent once, whatever the number of persons in it
+            if self.jpeg_profile is not None:
+                with self.metrics.timer("encode"):
+                    payload = self.jpeg_profile.encode(frame, boxes)
+            else:
+                # the buffers of the preprocessor are reused by the next batches, the queue pickles the frame later
+                payload = frame.copy() if pyramid.pooled else frame
+            detections.append(DetectionMessage(self.id, seq, capture_ts, payload, boxes, labels, confidences))
+        # the frames which passed the motion gate without a message: no persons, the produced frames add up
+        self.metrics.inc("empty", len(captures) - len(detections))
         return detections
 
-    def view_frames(self, batch_frames, winname):
-        for frame in batch_frames:
-            view(frame, winname=winname)
+    def track_label(self, track_id, seq) -> tuple[str, float] | None:
+        """
+        The label and confidence of the track to reuse in frame seq, None to recognize the person again.
+        Marks the track as seen in seq: a label is dropped as soon as the track misses a frame.
+        """
+        if track_id is None:
+            return None
+        previous, self._track_seen[track_id] = self._track_seen.get(track_id), seq
+        if len(self._track_seen) > 1024:
+            # the ids only grow, forget the oldest tracks
+            oldest = next(iter(self._track_seen))
+            del self._track_seen[oldest]
+            self._track_labels.pop(oldest, None)
+        cached = self._track_labels.pop(track_id, None)
+        if cached is None or previous != seq - 1 or seq - cached[2] >= self.track_label_frames:
+            return None
+        self._track_labels[track_id] = cached
+        return cached[:2]
+
+    def forget_tracks(self):
+        self._track_labels.clear()
+        self._track_seen.clear()
+
+    def is_moving(self, frame) -> bool:
+        if self.motion_detector_name != "optical_flow":
+            return self.motion_detector(frame)
+        previous, self._previous_frame = self._previous_frame, frame
+        # nothing to compare the first frame with, it is processed
+        return previous is None or self.motion_detector(previous, frame)
+
+    def person_image(self, frame, box):
+        """The image where the faces of the person in box are searched"""
+        x1, y1, x2, y2 = box
+        return frame[y1:y2, x1:x2]
+
+    def recognize_person(self, frame, box) -> list[dict]:
+        """The faces recognized in the image of the person in box, see FaceRecognizer.recognize_faces"""
+        return self.face_recognizer.recognize_faces(self.person_image(frame, box))
+
+    def view_frame(self, pyramid: FramePyramid) -> np.ndarray:
+        """
+        The image to make the thumbnail of the frame from, without boxes: the motion proxy, already computed,
+        when it is in color and not smaller than the thumbnail, otherwise the frame
+        """
+        proxy = pyramid.proxy
+        if self.thumbnails is not None and proxy.ndim == 3 \
+                and proxy.shape[1] >= self.thumbnails.size(pyramid.frame.shape)[0]:
+            return proxy
+        return pyramid.frame
+
+    def publish_thumbnail(self, frame, boxes=()):
+        """Show the last frame of the batch, the thumbnails are written at the capped rate of the slot"""
+        if self.thumbnails is None or frame is None or not self.thumbnails.due():
+            return
+        with self.metrics.timer("view"):
+            self.thumbnails.write(frame, boxes)
 
 
 class VideoProcessorFrameControllerFactory(QueuedFrameControllerFactory):
     """
     A factory for creating `VideoProcessor` sources. Inherits from
     `QueuedFrameControllerFactory` and overrides `build_source` to produce
-    instances of `VideoProcessor` for either a camera device (int) or a video file (str).
+    instances of `VideoProcessor` for either a camera device (int), a video file (str)
+    or a synthetic scene (dict with type: synthetic, see `SyntheticStream`).
     """
 
+    def __init__(self, db_path: str = None, jpeg_profile: JpegProfile = None, clips: dict = None,
+                 metrics_interval: float = None, profiling: dict = None, degradation_ladder: list[dict] = None,
+                 compositor: Compositor = None):
+        """
+        db_path: database with the access list, used by the processors to skip the useless work
+        (see CameraAccessPolicy). None to always run the whole pipeline.
+        jpeg_profile: used by the sources with encode_jpeg enabled
+        clips: ClipRecorder kwargs of all the sources, None to not record clips
+        metrics_interval: seconds between two metrics snapshots sent by the sources, None to not send them
+        profiling: Profiler kwargs of all the sources, None to not accept profiling requests
+        degradation_ladder: quality steps applied under load (see LoadGovernor), None to always keep the configured one
+        compositor: shows the sources with view enabled, must not be started yet. None to show nothing
+        """
+        self.db_path = db_path
+        self.jpeg_profile = jpeg_profile
+        self.clips = clips
+        self.metrics_interval = metrics_interval
+        self.profiling = profiling
+        self.degradation_ladder = degradation_ladder
+        self.compositor = compositor
+
     def initializer(self, config: VideoFrameControllerConfig) -> VideoFrameController:
         return super().initializer(config)
 
     def build_source(self, source:VideoFrameSourceConfig, **kwargs) -> FrameSource:
-        if not isinstance(source.source, int) and not isinstance(source.source, str):
+        if not isinstance(source.source, (int, str)) and not is_synthetic(source.source):
             raise ValueError(f"Invalid source type: {type(source)}")
         args = source.to_dict()
-        return VideoProcessor(**args, **kwargs)
+        thumbnails = self.compositor.add_camera(source.id, source.name) \
+            if self.compositor is not None and source.view else None
+        return VideoProcessor(**args, db_path=self.db_path, jpeg_profile=self.jpeg_profile, clips=self.clips,
+                              metrics_interval=self.metrics_interval, profiling=self.profiling,
+                              degradation_ladder=self.degradation_ladder, thumbnails=thumbnails, **kwargs)
 
 
-def initialize_frame_controller(config: VideoFrameControllerConfig) -> VideoFrameController:
+def initialize_frame_controller(config: VideoFrameControllerConfig, db_path: str = None,
+                                jpeg_profile: JpegProfile = None, clips: dict = None,
+                                metrics_interval: float = None, profiling: dict = None,
+                                degradation_ladder: list[dict] = None,
+                                compositor: Compositor = None) -> VideoFrameController:
     """
     Initialize the frame controller with the given configuration.
     """
-    vpfcf = VideoProcessorFrameControllerFactory()
+    vpfcf = VideoProcessorFrameControllerFactory(db_path, jpeg_profile, clips, metrics_interval, profiling,
+                                                 degradation_ladder, compositor)
 
     controller = vpfcf.initializer(config)
     return controller
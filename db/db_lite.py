@@ -1,4 +1,7 @@
+import os
 import sqlite3
+import threading
+import time
 import local_utils.logger as l
 
 def get_database(db_path, *, dropdb = False):
@@ -6,10 +9,26 @@ def get_database(db_path, *, dropdb = False):
 
 UNKNOWN_SPECIAL_USER = u'Unknown\U00002753'
 
+BUSY_TIMEOUT = 5.0  # seconds a connection waits for a lock held by another connection
+STATEMENTS_CACHE_SIZE = 256  # prepared statements kept by each connection
+
 def raise_error(e:Exception, context: str):
     e.add_note(context)
     raise e
 
+def connect(db_path: str, *, wal: bool = True) -> sqlite3.Connection:
+    """
+    Open a connection tuned for many small transactions from several threads and processes:
+    WAL journal (readers don't block the writer), synchronous NORMAL (no fsync on every commit,
+    still safe in WAL mode), a busy timeout instead of failing on locks and a bigger prepared
+    statement cache.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENTS_CACHE_SIZE)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
 class TBDatabase(l.Logger):
     """
     Classe per la gestione di un database SQLite3 per il bot Telegram.
@@ -27,17 +46,210 @@ class TBDatabase(l.Logger):
         to identify the user in the system
     """
 
-    def __init__(self, db_path: str, drop_db: bool = False):
+    def __init__(self, db_path: str, drop_db: bool = False, *, pooled: bool = True, wal: bool = True):
+        """
+        db_path: path of the sqlite3 database file
+        drop_db: drop the tables before creating them
+        pooled: keep a long-lived connection for each thread and reuse it on every `with db() as conn`,
+            instead of opening and closing a connection every time
+        wal: use the tuned connections (see connect())
+        """
         super().__init__(self.__class__.__name__)
         self.db_path = db_path
+        self.pooled = pooled
+        self.wal = wal
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
 
-        with TDBAtomicConnection(self.db_path) as transaction:
+        with self() as transaction:
             if drop_db:
                 transaction.drop_db()
             transaction.create_database()
 
     def __call__(self, *args, **kwargs):
-        return TDBAtomicConnection(self.db_path)
+        if not self.pooled:
+            return TDBAtomicConnection(self.db_path, wal=self.wal)
+        return TDBAtomicConnection(self.db_path, connection=self._thread_connection())
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        # the pid check discards the connections inherited by a forked process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect(self.db_path, wal=self.wal)
+            self._local.conn, self._local.pid = conn, os.getpid()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """Close the connections of every thread"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # created in another thread, it will be closed when garbage collected
+        self._local = threading.local()
+
+
+class CameraAccessPolicy:
+    """
+    Compiled snapshot of the access list of a single camera.
+    It tells the camera process whether the identity of the detected people can change the
+    access decision: if it can't, face recognition (or even person detection) can be skipped.
+    """
+    ALLOW_ALL = 'allow-all'  # nobody can cause a violation, no need to look for people
+    DENY_ALL = 'deny-all'  # everybody causes a violation, no need to know who they are
+    BY_IDENTITY = 'by-identity'  # the decision depends on who has been detected
+
+    def __init__(self, camera_id: int, decisions: dict[str, bool]):
+        """
+        camera_id: the camera the policy belongs to
+        decisions: person name -> has access to the camera
+        """
+        self.camera_id = camera_id
+        self.decisions = dict(decisions)
+        # people never seen before are handled as the unknown special user, without a row they have no access
+        self.decisions.setdefault(UNKNOWN_SPECIAL_USER, False)
+
+        allowed = set(self.decisions.values())
+        if allowed == {True}:
+            self.mode = CameraAccessPolicy.ALLOW_ALL
+        elif allowed == {False}:
+            self.mode = CameraAccessPolicy.DENY_ALL
+        else:
+            self.mode = CameraAccessPolicy.BY_IDENTITY
+
+    def has_access(self, user_name: str) -> bool:
+        return self.decisions.get(user_name, self.decisions[UNKNOWN_SPECIAL_USER])
+
+    @property
+    def skip_person_detection(self) -> bool:
+        return self.mode == CameraAccessPolicy.ALLOW_ALL
+
+    @property
+    def skip_face_recognition(self) -> bool:
+        return self.mode != CameraAccessPolicy.BY_IDENTITY
+
+    def __eq__(self, other):
+        return isinstance(other, CameraAccessPolicy) and (self.camera_id, self.decisions) == (other.camera_id, other.decisions)
+
+    def __repr__(self):
+        return f"CameraAccessPolicy(camera_id={self.camera_id}, mode={self.mode}, people={len(self.decisions)})"
+
+
+class AccessDecisionMatrix(l.Logger):
+    """
+    In-memory copy of the access list, to check accesses without querying the database.
+    Every person has a bitset with a bit for each camera (1 = has access), cameras are mapped
+    to their bit and to their name. Everything is loaded with a single query and reloaded only
+    when the database has been changed by another connection (PRAGMA data_version), checked
+    at most every refresh_interval seconds by refresh().
+    """
+
+    def __init__(self, db_path: str, refresh_interval: float = 1.0):
+        super().__init__(self.__class__.__name__)
+        self.refresh_interval = refresh_interval
+        self.connection = TDBAtomicConnection(db_path)
+        self.version = 0  # bumped on every reload
+        self._data_version = None
+        self._last_check = 0.0
+        self._camera_bits: dict[int, int] = {}
+        self._camera_names: dict[int, str] = {}
+        self._person_bits: dict[str, int] = {}
+        self._policies: dict[int, CameraAccessPolicy] = {}
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reload the matrix if the database changed since the last load.
+        Returns True if the matrix has been reloaded.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.refresh_interval:
+            return False
+        self._last_check = now
+        data_version = self.connection.data_version()
+        if not force and data_version == self._data_version:
+            return False
+        self._load()
+        self._data_version = data_version
+        return True
+
+    def _load(self):
+        camera_bits, camera_names, person_bits = {}, {}, {}
+        for camera_id, camera_name, user_name, allowed in self.connection.get_access_matrix_rows():
+            if camera_id not in camera_bits:
+                camera_bits[camera_id] = len(camera_bits)
+                camera_names[camera_id] = camera_name
+            if user_name is None:
+                continue  # camera without access rows
+            bits = person_bits.get(user_name, 0)
+            if allowed:
+                bits |= 1 << camera_bits[camera_id]
+            person_bits[user_name] = bits
+        self._camera_bits, self._camera_names, self._person_bits = camera_bits, camera_names, person_bits
+        self._policies = {}
+        self.version += 1
+        self.logger.debug("access matrix loaded: %s cameras, %s people", len(camera_bits), len(person_bits))
+
+    def has_access(self, user_name: str, camera_id: int) -> bool:
+        bit = self._camera_bits.get(camera_id)
+        if bit is None:
+            return False
+        # people without rows are handled as the unknown special user, as by CameraAccessPolicy
+        bits = self._person_bits.get(user_name)
+        if bits is None:
+            bits = self._person_bits.get(UNKNOWN_SPECIAL_USER, 0)
+        return bool(bits >> bit & 1)
+
+    def camera_name(self, camera_id: int) -> str | None:
+        return self._camera_names.get(camera_id)
+
+    def camera_policy(self, camera_id: int) -> CameraAccessPolicy:
+        policy = self._policies.get(camera_id)
+        if policy is None:
+            bit = self._camera_bits.get(camera_id)
+            decisions = {} if bit is None else {
+                user_name: bool(bits >> bit & 1) for user_name, bits in self._person_bits.items()
+            }
+            policy = self._policies[camera_id] = CameraAccessPolicy(camera_id, decisions)
+        return policy
+
+    def close(self):
+        self.connection.conn.close()
+
+
+class CameraAccessPolicyWatcher(l.Logger):
+    """
+    Keeps the CameraAccessPolicy of a camera up to date, to be used by the camera processes.
+    The policy is compiled from an AccessDecisionMatrix owned by the watcher, so it is
+    reloaded only when the access list changes.
+    """
+
+    def __init__(self, db_path: str, camera_id: int, refresh_interval: float = 1.0):
+        super().__init__(f"{self.__class__.__name__}-{camera_id}")
+        self.camera_id = camera_id
+        self.matrix = AccessDecisionMatrix(db_path, refresh_interval)
+        self._policy: CameraAccessPolicy = self.matrix.camera_policy(camera_id)
+        self.logger.info("access policy loaded: %s", self._policy)
+
+    def policy(self) -> CameraAccessPolicy:
+        try:
+            if self.matrix.refresh():
+                policy = self.matrix.camera_policy(self.camera_id)
+                if policy != self._policy:
+                    self.logger.info("access policy updated: %s", policy)
+                self._policy = policy
+        except Exception as e:
+            # keep the last known policy
+            self.logger.error("Cannot refresh the access policy: %s", e)
+        return self._policy
+
+    def close(self):
+        self.matrix.close()
 
 
 class TDBAtomicConnection(l.Logger):
@@ -45,44 +257,99 @@ class TDBAtomicConnection(l.Logger):
     This class is necessary to handle the fact that the telegram bot spawn multiple threads and
      sqlite3 doesn't really like that.
     """
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, *, connection: sqlite3.Connection = None, wal: bool = True):
+        """
+        db_path: path of the database, used to open a new connection
+        connection: a pooled connection to use instead, it is committed but not closed on exit
+        """
         super().__init__(self.__class__.__name__)
-        self.conn = sqlite3.connect(db_path)
+        self.pooled = connection is not None
+        self.conn = connection if self.pooled else connect(db_path, wal=wal)
 
     def __enter__(self):
         self.cursor = self.get_cursor()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cursor.close()
         self.conn.commit()
-        self.conn.close()
+        if not self.pooled:
+            self.conn.close()
 
     def get_cursor(self):
         return self.conn.cursor()
 
     def setup_database(self, cameras_ids: list[int], cameras_names: list[str]):
         assert len(cameras_names) == len(cameras_ids)
+        self.sync_cameras(list(zip(cameras_ids, cameras_names)))
         # setup special users
-        cameras_ids_names = self.get_cameras()
-
-        db_camera_ids = {c_id_n[0] for c_id_n in cameras_ids_names}
-        # db_camera_names = {c_id_n[1] for c_id_n in cameras_ids_names}
-        cameras_ids = {c_id for c_id in cameras_ids}
-        for camera_id, camera_name in zip(cameras_ids, cameras_names):
-            if camera_id not in db_camera_ids:
-                self.add_camera(camera_id, camera_name)
-                db_camera_ids.add(camera_id)
-            self.update_camera_name(camera_id, camera_name)
-
-        remove_cameras = db_camera_ids - cameras_ids
-        for camera_id in remove_cameras:
-            self.delete_camera(camera_id)
-        try:
-            self.add_enrolled_person(UNKNOWN_SPECIAL_USER)
-        except Exception as e:
-            pass
+        self.enroll_people([UNKNOWN_SPECIAL_USER])
         return
 
+    def sync_cameras(self, cameras: list[tuple[int, str]]):
+        """
+        Make the Cameras table match the given (camera_id, camera_name) list with a few set-based statements:
+        missing cameras are added (with a blacklisted access row for everybody enrolled), the cameras not
+        in the list are deleted with their access rows, the others are renamed if needed.
+        """
+        cursor = self.get_cursor()
+        try:
+            # no executescript: it would commit the transaction, everything must stay in the caller's one
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS SyncCameras (camera_id INTEGER PRIMARY KEY, camera_name TEXT, new INTEGER)")
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS SyncPeople (user_name TEXT PRIMARY KEY)")
+            cursor.execute("DELETE FROM SyncCameras")
+            cursor.execute("DELETE FROM SyncPeople")
+            cursor.executemany("INSERT INTO SyncCameras (camera_id, camera_name) VALUES (?, ?)", cameras)
+            cursor.execute("UPDATE SyncCameras SET new = camera_id NOT IN (SELECT camera_id FROM Cameras)")
+            # the people to give access rows to the new cameras, before deleting the old cameras
+            cursor.execute("INSERT INTO SyncPeople SELECT DISTINCT user_name FROM AccessList")
+            cursor.execute("DELETE FROM AccessList WHERE camera_id NOT IN (SELECT camera_id FROM SyncCameras)")
+            cursor.execute("DELETE FROM Cameras WHERE camera_id NOT IN (SELECT camera_id FROM SyncCameras)")
+            # rename in two steps, so that cameras can swap names without violating the UNIQUE constraint
+            cursor.execute("""
+                UPDATE Cameras SET camera_name=NULL WHERE EXISTS (
+                    SELECT 1 FROM SyncCameras AS SC
+                    WHERE SC.camera_id=Cameras.camera_id AND SC.camera_name IS NOT Cameras.camera_name)
+            """)
+            cursor.execute("""
+                UPDATE Cameras SET camera_name=(SELECT camera_name FROM SyncCameras AS SC WHERE SC.camera_id=Cameras.camera_id)
+                WHERE camera_name IS NULL
+            """)
+            cursor.execute("INSERT INTO Cameras (camera_id, camera_name) SELECT camera_id, camera_name FROM SyncCameras WHERE new")
+            cursor.execute("""
+                INSERT INTO AccessList (user_name, camera_id)
+                SELECT user_name, camera_id FROM SyncPeople CROSS JOIN SyncCameras WHERE new
+            """)
+        except Exception as e:
+            self.logger.error("Error during cameras synchronization: %s", e)
+            raise_error(e, "Error during synchronization of {} cameras".format(len(cameras)))
+        finally:
+            cursor.close()
+
+    def enroll_people(self, user_names: list[str], listed: str = 'b', cameras_listed: dict[int, str] = None):
+        """
+        Enroll many people at once, with an access row for every camera: 'listed' by default, or the value
+        in cameras_listed for the cameras in it. The existing access rows are left untouched.
+        """
+        cursor = self.get_cursor()
+        try:
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS EnrollPeople (user_name TEXT PRIMARY KEY)")
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS EnrollListed (camera_id INTEGER PRIMARY KEY, listed VARCHAR(1))")
+            cursor.execute("DELETE FROM EnrollPeople")
+            cursor.execute("DELETE FROM EnrollListed")
+            cursor.executemany("INSERT OR IGNORE INTO EnrollPeople (user_name) VALUES (?)", [(name,) for name in user_names])
+            cursor.executemany("INSERT INTO EnrollListed (camera_id, listed) VALUES (?, ?)", (cameras_listed or {}).items())
+            cursor.execute("""
+                INSERT OR IGNORE INTO AccessList (user_name, camera_id, listed)
+                SELECT user_name, CM.camera_id, COALESCE(EL.listed, ?)
+                FROM EnrollPeople CROSS JOIN Cameras AS CM LEFT JOIN EnrollListed AS EL ON EL.camera_id=CM.camera_id
+            """, (listed,))
+        except Exception as e:
+            self.logger.error("Cannot enroll people: %s", e)
+            raise_error(e, "Cannot enroll {} people".format(len(user_names)))
+        finally:
+            cursor.close()
+
     def drop_db(self):
         cursor = self.get_cursor()
         try:
@@ -90,6 +357,8 @@ class TDBAtomicConnection(l.Logger):
                 DROP TABLE IF EXISTS AccessList;
                 DROP TABLE IF EXISTS Users;
                 DROP TABLE IF EXISTS Cameras;
+                DROP TABLE IF EXISTS DetectionEvents;
+                DROP TABLE IF EXISTS Incidents;
                 -- DROP TABLE IF EXISTS EnrolledPeople;
             """)
             self.conn.commit()
@@ -136,6 +405,34 @@ class TDBAtomicConnection(l.Logger):
             -- FOREIGN KEY (user_name) REFERENCES EnrolledPeople(user_name) ON DELETE CASCADE,
             PRIMARY KEY (user_name, camera_id)
             );
+        CREATE TABLE IF NOT EXISTS DetectionEvents (
+        -- every person detected by the cameras, written in batches by DetectionEventWriter
+        -- no foreign keys: the history must survive the deletion of cameras and people
+            event_id INTEGER PRIMARY KEY,
+            time REAL NOT NULL, -- unix timestamp of the detection
+            camera_id INTEGER NOT NULL,
+            person TEXT NOT NULL,
+            confidence REAL, -- face recognition confidence, NULL if not recognized
+            x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER, -- person bounding box
+            snapshot TEXT -- reference to the stored image/clip of the detection, if any
+            );
+        CREATE INDEX IF NOT EXISTS DetectionEventsCameraTime ON DetectionEvents (camera_id, time);
+        CREATE INDEX IF NOT EXISTS DetectionEventsPersonTime ON DetectionEvents (person, time);
+        CREATE INDEX IF NOT EXISTS DetectionEventsTime ON DetectionEvents (time); -- retention pruning
+        CREATE TABLE IF NOT EXISTS Incidents (
+        -- consecutive detections of the same person on the same camera, merged by the IncidentEngine
+            incident_id INTEGER PRIMARY KEY,
+            camera_id INTEGER NOT NULL,
+            person TEXT NOT NULL,
+            start_time REAL NOT NULL,
+            end_time REAL NOT NULL,
+            violation INTEGER NOT NULL, -- 1 if the person had no access to the camera
+            detections INTEGER NOT NULL, -- number of merged per-frame detections
+            best_confidence REAL
+            );
+        CREATE INDEX IF NOT EXISTS IncidentsCameraTime ON Incidents (camera_id, start_time);
+        CREATE INDEX IF NOT EXISTS IncidentsPersonTime ON Incidents (person, start_time);
+        CREATE INDEX IF NOT EXISTS IncidentsTime ON Incidents (start_time); -- retention pruning
         """
         cursor = self.get_cursor()
         try:
@@ -150,11 +447,20 @@ class TDBAtomicConnection(l.Logger):
         # Esegui le istruzioni SQL (può contenerne più di una)
         return self.conn
 
+    def data_version(self) -> int:
+        """Changes every time another connection commits a change to the database"""
+        cursor = self.get_cursor()
+        try:
+            cursor.execute("PRAGMA data_version")
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
     # Get from db
     def has_access_to_room(self, user_name: str, camera_id: int) -> bool:
         cursor = self.get_cursor()
         try:
-            cursor.execute("SELECT COUNT(camera_id) FROM AccessList WHERE listed = 'w' AND camera_id=? AND user_name=? LIMIT 1", (camera_id, user_name))
+            cursor.execute("SELECT COUNT(camera_id) FROM AccessList WHERE listed IN ('w', 'f') AND camera_id=? AND user_name=? LIMIT 1", (camera_id, user_name))
             listed = cursor.fetchone()[0]
             return bool(listed)
         except Exception as e:
@@ -163,6 +469,21 @@ class TDBAtomicConnection(l.Logger):
         finally:
             cursor.close()
 
+    def get_access_matrix_rows(self) -> list[tuple[int, str, str, int]]:
+        """Every (camera_id, camera_name, user_name, has access) row, cameras without rows have a NULL user_name"""
+        cursor = self.get_cursor()
+        try:
+            cursor.execute("""
+                       SELECT CM.camera_id, camera_name, user_name, listed IN ('w', 'f')
+                       FROM Cameras AS CM LEFT JOIN AccessList AS AL ON AL.camera_id=CM.camera_id
+                        """)
+            return cursor.fetchall()
+        except Exception as e:
+            self.logger.error("Error during access matrix selection: %s", e)
+            raise_error(e, "Error during access matrix selection")
+        finally:
+            cursor.close()
+
     def get_camera_name(self, camera_id: int) -> str:
         cursor = self.get_cursor()
         try:
@@ -265,7 +586,85 @@ class TDBAtomicConnection(l.Logger):
             raise_error(e, "Error fetching all user names from access list")
         finally:
             cursor.close()
+    def get_incidents(self, *, camera_id: int = None, person: str = None,
+                      since: float = None, until: float = None, limit: int = 100) -> list[tuple]:
+        """
+        Incidents started in the [since, until) time range, most recent first, optionally filtered by camera and/or person.
+        Each row is (camera_id, person, start_time, end_time, violation, detections, best_confidence).
+        """
+        conditions, params = [], []
+        for condition, param in (("camera_id=?", camera_id), ("person=?", person), ("start_time>=?", since), ("start_time<?", until)):
+            if param is not None:
+                conditions.append(condition)
+                params.append(param)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.get_cursor()
+        try:
+            cursor.execute(f"""
+                       SELECT camera_id, person, start_time, end_time, violation, detections, best_confidence
+                       FROM Incidents {where} ORDER BY start_time DESC LIMIT ?
+                        """, (*params, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            self.logger.error("Error during incidents selection: %s", e)
+            raise_error(e, "Error during incidents selection")
+        finally:
+            cursor.close()
+
+    def get_detection_events(self, *, camera_id: int = None, person: str = None,
+                             since: float = None, until: float = None, limit: int = 100) -> list[tuple]:
+        """
+        Detections in the [since, until) time range, most recent first, optionally filtered
+        by camera and/or person. Each row is (time, camera_id, person, confidence, x1, y1, x2, y2, snapshot).
+        """
+        conditions, params = [], []
+        for condition, param in (("camera_id=?", camera_id), ("person=?", person), ("time>=?", since), ("time<?", until)):
+            if param is not None:
+                conditions.append(condition)
+                params.append(param)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.get_cursor()
+        try:
+            cursor.execute(f"""
+                       SELECT time, camera_id, person, confidence, x1, y1, x2, y2, snapshot
+                       FROM DetectionEvents {where} ORDER BY time DESC LIMIT ?
+                        """, (*params, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            self.logger.error("Error during detection events selection: %s", e)
+            raise_error(e, "Error during detection events selection")
+        finally:
+            cursor.close()
+
     # Add to db
+    def add_detection_events(self, events: list[tuple]):
+        """events: (time, camera_id, person, confidence, x1, y1, x2, y2, snapshot) tuples"""
+        cursor = self.get_cursor()
+        try:
+            cursor.executemany("""
+                       INSERT INTO DetectionEvents (time, camera_id, person, confidence, x1, y1, x2, y2, snapshot)
+                       VALUES (?,?,?,?,?,?,?,?,?)
+                        """, events)
+        except Exception as e:
+            self.logger.error("Error during detection events insertion: %s", e)
+            raise_error(e, "Error during insertion of {} detection events".format(len(events)))
+        finally:
+            cursor.close()
+
+    def add_incidents(self, incidents: list[tuple]):
+        """incidents: (camera_id, person, start_time, end_time, violation, detections, best_confidence) tuples"""
+        cursor = self.get_cursor()
+        try:
+            cursor.executemany("""
+                       INSERT INTO Incidents (camera_id, person, start_time, end_time, violation, detections, best_confidence)
+                       VALUES (?,?,?,?,?,?,?)
+                        """, incidents)
+        except Exception as e:
+            self.logger.error("Error during incidents insertion: %s", e)
+            raise_error(e, "Error during insertion of {} incidents".format(len(incidents)))
+        finally:
+            cursor.close()
+
     def add_authed_user(self, user_id: int):
         cursor = self.get_cursor()
         try:
@@ -372,6 +771,31 @@ class TDBAtomicConnection(l.Logger):
         finally:
             cursor.close()
 
+    def prune_detection_events(self, older_than: float, chunk_size: int = 10000) -> int:
+        """
+        Delete the detections and the incidents older than the given timestamp, chunk_size rows at a time
+        and committing after each chunk, so that the writers are never locked out for long. Returns the deleted rows.
+        """
+        cursor = self.get_cursor()
+        deleted = 0
+        try:
+            for delete in ("""DELETE FROM DetectionEvents WHERE event_id IN
+                              (SELECT event_id FROM DetectionEvents WHERE time<? LIMIT ?)""",
+                           """DELETE FROM Incidents WHERE incident_id IN
+                              (SELECT incident_id FROM Incidents WHERE start_time<? LIMIT ?)"""):
+                while True:
+                    cursor.execute(delete, (older_than, chunk_size))
+                    self.conn.commit()
+                    deleted += cursor.rowcount
+                    if cursor.rowcount < chunk_size:
+                        break
+            return deleted
+        except Exception as e:
+            self.logger.error("Error during detection events pruning: %s", e)
+            raise_error(e, "Error during detection events pruning")
+        finally:
+            cursor.close()
+
     def delete_user(self, user_id: int):
         """Do not confuse users with people"""
         cursor = self.get_cursor()
@@ -0,0 +1,121 @@
+import queue
+import time
+from threading import Thread, Event
+
+from db.db_lite import TBDatabase
+from local_utils.logger import Logger
+
+
+EVENTS, INCIDENTS = 'events', 'incidents'
+
+
+class DetectionEventWriter(Thread, Logger):
+    """
+    Records the detections and the incidents into the DetectionEvents and Incidents tables from a background thread.
+    record() never blocks: events are queued and written every flush_interval seconds,
+    all the queued ones with a single executemany in one transaction. If the database
+    can't keep up and the queue fills, new events are dropped and counted.
+    usage:
+    ```
+        writer = DetectionEventWriter(db, flush_interval=0.5, retention_days=30)
+        writer.start()
+        writer.record(camera_id, person, confidence, (x1, y1, x2, y2))
+        writer.record_incident(camera_id, person, start_time, end_time, violation, detections)
+        writer.stop()
+    ```
+    """
+
+    def __init__(self, db: TBDatabase, *, flush_interval: float = 0.5, max_queue_size: int = 100_000,
+                 retention_days: float = 30, prune_interval: float = 3600):
+        """
+        db: the database to write to, the thread uses its own pooled connection
+        flush_interval: seconds between two batched writes
+        max_queue_size: events waiting to be written, after that new events are dropped
+        retention_days: events older than this are deleted, None to keep them forever
+        prune_interval: seconds between two retention prunings
+        """
+        Thread.__init__(self, name=self.__class__.__name__, daemon=True)
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.db = db
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.events = queue.Queue(maxsize=max_queue_size)
+        self.written = 0
+        self.dropped = 0
+        self._stop_event = Event()
+        self._last_prune = 0.0
+
+    def record(self, camera_id: int, person: str, confidence: float = None,
+               bbox: tuple[int, int, int, int] = None, snapshot: str = None, timestamp: float = None) -> bool:
+        """Queue a detection, returns False if it has been dropped"""
+        x1, y1, x2, y2 = (int(c) for c in bbox) if bbox is not None else (None, None, None, None)
+        event = (time.time() if timestamp is None else timestamp, camera_id, person, confidence, x1, y1, x2, y2, snapshot)
+        return self._put(EVENTS, event)
+
+    def record_incident(self, camera_id: int, person: str, start_time: float, end_time: float,
+                        violation: bool, detections: int, best_confidence: float = None) -> bool:
+        """Queue a closed incident, returns False if it has been dropped"""
+        incident = (camera_id, person, start_time, end_time, int(violation), detections, best_confidence)
+        return self._put(INCIDENTS, incident)
+
+    def _put(self, table: str, row: tuple) -> bool:
+        try:
+            self.events.put_nowait((table, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                self.logger.warning("events queue full, %s events dropped so far", self.dropped)
+            return False
+
+    def _drain(self) -> list[tuple]:
+        batch = []
+        try:
+            while True:
+                batch.append(self.events.get_nowait())
+        except queue.Empty:
+            return batch
+
+    def flush(self):
+        batch = self._drain()
+        if not batch:
+            return
+        events = [row for table, row in batch if table == EVENTS]
+        incidents = [row for table, row in batch if table == INCIDENTS]
+        try:
+            with self.db() as conn:
+                if events:
+                    conn.add_detection_events(events)
+                if incidents:
+                    conn.add_incidents(incidents)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            self.logger.error("cannot write %s detection events and incidents: %s", len(batch), e)
+
+    def prune(self):
+        if self.retention_days is None:
+            return
+        self._last_prune = time.monotonic()
+        try:
+            with self.db() as conn:
+                deleted = conn.prune_detection_events(time.time() - self.retention_days * 24 * 3600)
+            if deleted:
+                self.logger.info("pruned %s detection events older than %s days", deleted, self.retention_days)
+        except Exception as e:
+            self.logger.error("cannot prune detection events: %s", e)
+
+    def run(self):
+        self.logger.info("starting, flushing every %s seconds", self.flush_interval)
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - self._last_prune >= self.prune_interval:
+                self.prune()
+        self.flush()  # the events queued before stop()
+        self.logger.info("exiting, %s events written, %s dropped", self.written, self.dropped)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
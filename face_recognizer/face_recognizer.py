@@ -1,5 +1,6 @@
 import os
 
+import cv2
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -7,6 +8,7 @@ from PIL import Image
 from facenet_pytorch import MTCNN, InceptionResnetV1
 
 from local_utils.logger import Logger
+from local_utils.metrics import MetricsRegistry, timed
 
 
 class FaceRecognizer(Logger):
@@ -15,12 +17,18 @@ class FaceRecognizer(Logger):
             threshold: float = 0.8,
             min_face_size: int = 20,
             device=torch.device("cpu"),
+            top_k: int = 5,
+            max_samples: int = 10,
+            metrics: MetricsRegistry = None,
     ):
         """
         Initialize the face recognizer.
         Args:
             threshold: The cosine similarity threshold for face recognition.
             min_face_size: Minimum face size for detection
+            top_k: Number of nearest gallery samples that vote for the identity of a face.
+            max_samples: Maximum number of embeddings kept in the gallery of each identity.
+            metrics: where the latency of the mtcnn, embedding and similarity stages is recorded, if given
         """
         Logger.__init__(self, name=f"{self.__class__.__name__}")
 
@@ -36,15 +44,22 @@ class FaceRecognizer(Logger):
         ).eval()
         self.threshold = threshold
         self.min_face_size = min_face_size
-
-        self.enrolled_embeddings = None
+        self.top_k = top_k
+        self.max_samples = max_samples
+        self.metrics = metrics
+
+        # label -> (n_samples, 512) raw embeddings, as stored on disk
+        self.galleries: dict[str, torch.Tensor] = {}
+        # matching index, rebuilt on every gallery change (see _rebuild_index)
+        self.enrolled_embeddings = None  # (total_samples, 512) L2-normalized, every gallery stacked
+        self.enrolled_sample_labels = None  # (total_samples,) index of the owner label of each sample
+        self.enrolled_centroids = None  # (n_labels, 512) L2-normalized mean embedding of each gallery
         self.enrolled_labels = None
         self.load_enrolled_faces()
 
     def load_enrolled_faces(self):
-        """Load all enrolled face embeddings from files"""
-        self.enrolled_embeddings = torch.empty((0, 512))
-        self.enrolled_labels = []
+        """Load all enrolled face galleries from files"""
+        self.galleries = {}
 
         for filename in os.listdir(self.faces_dir):
             if filename.endswith(".npy"):
@@ -60,20 +75,56 @@ class FaceRecognizer(Logger):
                     if embedding.shape[1] != 512:
                         raise ValueError(f"Invalid embedding shape: {embedding.shape}")
 
-                    self.enrolled_embeddings = torch.cat(
-                        [self.enrolled_embeddings, embedding]
-                    )
-                    self.enrolled_labels.append(label)
+                    self.galleries[label] = embedding
                 except Exception as e:
                     self.logger.error(f"Error loading embedding for %s: %s", label, e)
                     continue
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """
+        Build the matching index from the galleries: every sample is normalized once here,
+        so that matching is a single matrix product.
+        """
+        self.enrolled_labels = list(self.galleries.keys())
+        if not self.enrolled_labels:
+            self.enrolled_embeddings = torch.empty((0, 512), device=self.device)
+            self.enrolled_sample_labels = torch.empty((0,), dtype=torch.long, device=self.device)
+            self.enrolled_centroids = torch.empty((0, 512), device=self.device)
+            return
+
+        samples = [F.normalize(self.galleries[label], dim=1) for label in self.enrolled_labels]
+        self.enrolled_embeddings = torch.cat(samples).to(self.device)
+        self.enrolled_sample_labels = torch.cat([
+            torch.full((len(gallery),), i, dtype=torch.long) for i, gallery in enumerate(samples)
+        ]).to(self.device)
+        self.enrolled_centroids = F.normalize(
+            torch.stack([gallery.mean(dim=0) for gallery in samples]), dim=1
+        ).to(self.device)
+
+    def _store_gallery(self, label: str, embeddings: torch.Tensor, append: bool):
+        """Save the gallery of 'label' to its file and refresh the matching index"""
+        embeddings = embeddings.detach().cpu().to(dtype=torch.float32)
+        if append and label in self.galleries:
+            embeddings = torch.cat([self.galleries[label], embeddings])
+        # keep the most recent samples only
+        embeddings = embeddings[-self.max_samples:]
+
+        file_path = os.path.join(self.faces_dir, f"{label}.npy")
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+        np.save(file_path, embeddings.numpy())
 
-    def enroll_face(self, face_image: Image, label: str) -> bool:
+        self.galleries[label] = embeddings
+        self._rebuild_index()
+
+    def enroll_face(self, face_image: Image, label: str, *, append: bool = False) -> bool:
         """
         Enroll a new face with the given label.
         Args:
             face_image: PIL Image containing the face
             label: Label/name for the face
+            append: add the face as a new sample of the label gallery instead of replacing it
         Returns:
             bool: True if enrollment successful, False otherwise
         """
@@ -81,19 +132,81 @@ class FaceRecognizer(Logger):
         if embedding is None:
             return False
 
-        # Ensure correct shape and type
-        embedding_np = embedding.detach().cpu().numpy().astype(np.float32)
-
-        # Save embedding to individual file
-        file_path = os.path.join(self.faces_dir, f"{label}.npy")
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-        np.save(file_path, embedding_np)
-
-        self.enrolled_embeddings = torch.cat([self.enrolled_embeddings, embedding])
-        self.enrolled_labels.append(label)
+        self._store_gallery(label, embedding, append)
         return True
 
+    def enroll_from_clip(self, video_path: str, label: str, *, k: int = 5, stride: int = 5,
+                         min_probability: float = 0.95, append: bool = False) -> int:
+        """
+        Enroll a label from a short video clip, picking the best k diverse frames.
+        Frames with no face or more than one face are skipped, the remaining ones are ranked by
+        the MTCNN detection probability and greedily selected to be as different as possible
+        from each other (pose, light), so that the gallery covers the face better than k
+        near-identical frames.
+        Args:
+            video_path: path of the clip
+            label: Label/name for the face
+            k: maximum number of samples to enroll
+            stride: analyze one frame every 'stride' frames
+            min_probability: minimum MTCNN probability for a face to be a candidate
+            append: add the samples to the label gallery instead of replacing it
+        Returns:
+            int: number of enrolled samples, 0 if no usable face was found
+        """
+        stream = cv2.VideoCapture(video_path)
+        candidates, qualities = [], []
+        frame_index = -1
+        try:
+            while True:
+                ret, frame = stream.read()
+                if not ret:
+                    break
+                frame_index += 1
+                if frame_index % stride != 0:
+                    continue
+                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                faces, probabilities = self.mtcnn(image, return_prob=True)
+                if faces is None or len(faces) != 1 or probabilities[0] < min_probability:
+                    continue
+                candidates.append(faces[0])
+                qualities.append(float(probabilities[0]))
+        finally:
+            stream.release()
+
+        if not candidates:
+            self.logger.warning("No usable face found in clip %s", video_path)
+            return 0
+
+        with torch.no_grad():
+            embeddings = torch.cat([
+                self.resnet(torch.stack(candidates[i:i + 32]).to(self.device)).cpu()
+                for i in range(0, len(candidates), 32)
+            ])
+        selected = self._select_diverse(embeddings, torch.tensor(qualities), k)
+        self._store_gallery(label, embeddings[selected], append)
+        self.logger.info("Enrolled %s samples of %s out of %s candidate frames", len(selected), label, len(candidates))
+        return len(selected)
+
+    @staticmethod
+    def _select_diverse(embeddings: torch.Tensor, qualities: torch.Tensor, k: int) -> list[int]:
+        """
+        Greedy farthest-point selection: start from the best quality sample, then keep adding the
+        sample with the best trade-off between quality and distance from the already selected ones.
+        """
+        embeddings = F.normalize(embeddings, dim=1)
+        selected = [int(torch.argmax(qualities))]
+        # max similarity of every candidate to the selected set
+        closest = embeddings @ embeddings[selected[0]]
+        while len(selected) < min(k, len(embeddings)):
+            scores = qualities * (1 - closest)
+            scores[selected] = -1
+            best = int(torch.argmax(scores))
+            if scores[best] <= 0:
+                break  # only duplicates left
+            selected.append(best)
+            closest = torch.maximum(closest, embeddings @ embeddings[best])
+        return selected
+
     def get_enrolled_faces(self) -> list:
         """
         Get list of enrolled users
@@ -119,11 +232,8 @@ class FaceRecognizer(Logger):
         except OSError:
             return False
 
-        idx = self.enrolled_labels.index(label)
-        self.enrolled_labels.pop(idx)
-        self.enrolled_embeddings = torch.cat(
-            [self.enrolled_embeddings[:idx], self.enrolled_embeddings[idx + 1:]]
-        )
+        del self.galleries[label]
+        self._rebuild_index()
         return True
 
     def _get_embedding(self, face_image: Image) -> torch.Tensor:
@@ -162,6 +272,55 @@ class FaceRecognizer(Logger):
             return []
         return faces_list
 
+    def get_embeddings(self, image) -> torch.Tensor:
+        """
+        Embeddings of the faces found in a single image, without matching them.
+        Returns:
+            (n_faces, 512) tensor on the cpu
+        """
+        faces_list = self.get_faces(image)
+        if len(faces_list) == 0:
+            return torch.empty((0, 512))
+        faces = faces_list[0].detach().to(dtype=torch.float).to(self.device)
+        if faces.dim() == 3:
+            faces = faces.unsqueeze(0)
+        with torch.no_grad():
+            return self.resnet(faces).cpu()
+
+    def match_embeddings(self, embeddings: torch.Tensor) -> list[dict]:
+        """
+        Match a batch of face embeddings against the enrolled galleries in one vectorized pass.
+        The k most similar samples of all the galleries vote for their label (weighted by
+        similarity), the winner is accepted if the similarity with its gallery centroid is
+        above the threshold. With single-sample galleries this is the plain nearest neighbour.
+        Args:
+            embeddings: (n_faces, 512) tensor
+        Returns:
+            A list of {"label", "confidence"} dicts, one for each embedding
+        """
+        if self.enrolled_embeddings.shape[0] == 0 or len(embeddings) == 0:
+            return [{"label": None, "confidence": None} for _ in range(len(embeddings))]
+
+        embeddings = F.normalize(embeddings.to(self.device), dim=1)
+        sample_similarities = embeddings @ self.enrolled_embeddings.T  # (n_faces, total_samples)
+        k = min(self.top_k, self.enrolled_embeddings.shape[0])
+        top_similarities, top_indices = sample_similarities.topk(k, dim=1)
+
+        votes = torch.zeros((len(embeddings), len(self.enrolled_labels)), device=self.device)
+        votes.scatter_add_(1, self.enrolled_sample_labels[top_indices], top_similarities.clamp(min=0))
+        winners = votes.argmax(dim=1)
+
+        centroid_similarities = embeddings @ self.enrolled_centroids.T  # (n_faces, n_labels)
+        confidences = centroid_similarities.gather(1, winners.unsqueeze(1)).squeeze(1).cpu()
+
+        results = []
+        for winner, confidence in zip(winners.cpu().tolist(), confidences.tolist()):
+            if confidence >= self.threshold:
+                results.append({"label": self.enrolled_labels[winner], "confidence": confidence})
+            else:
+                results.append({"label": None, "confidence": None})
+        return results
+
     def recognize_faces(self, images) -> list[dict]:
         """
         Recognize faces in an image or a batch of images.
@@ -170,7 +329,8 @@ class FaceRecognizer(Logger):
         Returns:
             A list of results for each face in the input image(s)
         """
-        faces_list = self.get_faces(images)
+        with timed(self.metrics, "mtcnn"):
+            faces_list = self.get_faces(images)
         if len(faces_list) == 0:
             return []
 
@@ -184,30 +344,15 @@ class FaceRecognizer(Logger):
 
             faces = faces.detach().to(dtype=torch.float).to(self.device)
 
-            embeddings = self.resnet(faces)
+            with timed(self.metrics, "embedding"):
+                embeddings = self.resnet(faces)
 
             if self.enrolled_embeddings.shape[0] == 0:
                 self.logger.debug("No faces enrolled in the system!")
                 return []
 
-            enrolled_embeddings_device = self.enrolled_embeddings.to(self.device)
-            similarities = F.cosine_similarity(
-                embeddings.unsqueeze(1), enrolled_embeddings_device.unsqueeze(0), dim=-1
-            )
-
-            results = []
-            for i in range(len(embeddings)):
-                max_similarity, idx = torch.max(similarities[i], dim=0)
-
-                label, confidence = None, None
-                if max_similarity >= self.threshold:
-                    label = self.enrolled_labels[idx]
-                    confidence = float(max_similarity.cpu())
-                result = {
-                    "label": label,
-                    "confidence": confidence,
-                }
-                results.append(result)
+            with timed(self.metrics, "similarity"):
+                results = self.match_embeddings(embeddings)
             if (
                     len(faces.shape) == 4
                     and "original_dim"
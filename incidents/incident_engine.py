@@ -0,0 +1,181 @@
+import time
+from threading import Lock
+from typing import Callable
+
+import cv2 as cv
+import numpy as np
+
+from local_utils.logger import Logger
+
+
+def sharpness(frame: np.ndarray | bytes) -> float:
+    """
+    Variance of the Laplacian of a downscaled gray copy of the frame: higher is sharper.
+    For frames already JPEG encoded the size is used instead, blurred frames compress better.
+    """
+    if isinstance(frame, bytes):
+        return float(len(frame))
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = 320 / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    return float(cv.Laplacian(gray, cv.CV_64F).var())
+
+
+class Incident:
+    """Consecutive detections of the same person on the same camera"""
+
+    def __init__(self, incident_id: int, camera_id, person: str, violation: bool, timestamp: float):
+        self.incident_id = incident_id
+        self.camera_id = camera_id
+        self.person = person
+        self.violation = violation
+        self.start_time = timestamp
+        self.end_time = timestamp  # last detection
+        self.detections = 0
+        self.best_confidence = None
+        self.last_box = None  # (x1, y1, x2, y2) of the last detection, if known
+        # (score, timestamp, frame, box of the person or None) of the best frames, best first
+        self.best_frames: list[tuple[float, float, np.ndarray, tuple | None]] = []
+
+    @property
+    def best_frame(self) -> np.ndarray:
+        return self.best_frames[0][2]
+
+    @property
+    def best_box(self) -> tuple[int, int, int, int] | None:
+        """The box of the person in best_frame"""
+        return self.best_frames[0][3]
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+    def add(self, frame: np.ndarray, timestamp: float, score: float, confidence: float, max_frames: int, min_frames_interval: float,
+            box: tuple[int, int, int, int] = None):
+        self.detections += 1
+        self.end_time = max(self.end_time, timestamp)
+        if box is not None:
+            self.last_box = box
+        if confidence is not None and (self.best_confidence is None or confidence > self.best_confidence):
+            self.best_confidence = confidence
+
+        # keep the max_frames best frames, at least min_frames_interval seconds apart from each other
+        for i, (best_score, best_timestamp, _, _) in enumerate(self.best_frames):
+            if abs(best_timestamp - timestamp) < min_frames_interval:
+                if score > best_score:
+                    self.best_frames[i] = (score, timestamp, frame, box)
+                    self.best_frames.sort(key=lambda x: x[0], reverse=True)
+                return
+        self.best_frames.append((score, timestamp, frame, box))
+        self.best_frames.sort(key=lambda x: x[0], reverse=True)
+        del self.best_frames[max_frames:]
+
+    def __repr__(self):
+        return (f"Incident(id={self.incident_id}, camera_id={self.camera_id}, person={self.person}, "
+                f"violation={self.violation}, duration={self.duration:.1f}s, detections={self.detections})")
+
+
+class IncidentEngine(Logger):
+    """
+    Merges the per-frame detections into incidents: a detection of a person on a camera either
+    extends the open incident of that (camera, person) or opens a new one. An incident is closed when
+    the person is not detected for 'gap' seconds, or when it lasts more than 'max_duration' seconds.
+    on_open is called once when an incident is opened, on_close when it is closed, so that the
+    notifications and the database writes happen once per incident instead of once per frame.
+    usage:
+    ```
+        engine = IncidentEngine(on_open=notify, on_close=store, gap=10)
+        while True:
+            for message in detections:
+                for person, confidence, box in message.persons():
+                    engine.add(message.camera_id, person, message.frame, violation=not has_access(person, message.camera_id),
+                               confidence=confidence, timestamp=message.capture_ts, box=box)
+            engine.close_expired()
+    ```
+    """
+
+    def __init__(self, *, on_open: Callable[[Incident], None] = None, on_close: Callable[[Incident], None] = None,
+                 gap: float = 10.0, max_duration: float = 600.0, max_frames: int = 3, min_frames_interval: float = 1.0,
+                 score: Callable[[np.ndarray], float] = sharpness):
+        """
+        on_open: called with the new incident, from the thread calling add()
+        on_close: called with the closed incident, from the thread calling close_expired()/close_all()
+        gap: seconds without detections after which the incident is closed
+        max_duration: an incident longer than this is closed, the next detection opens a new one
+        max_frames: number of best frames kept for each incident
+        min_frames_interval: minimum seconds between two kept frames, so that they show different moments
+        score: frame quality score used to pick the best frames, the higher the better
+        """
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.on_open = on_open
+        self.on_close = on_close
+        self.gap = gap
+        self.max_duration = max_duration
+        self.max_frames = max_frames
+        self.min_frames_interval = min_frames_interval
+        self.score = score
+        self.open_incidents: dict[tuple, Incident] = {}
+        self._next_id = 1
+        self._lock = Lock()
+        # (frame, score) of the last frame scored: the persons of a message share its frame
+        self._last_score: tuple[np.ndarray, float] | None = None
+
+    def add(self, camera_id, person: str, frame: np.ndarray, *, violation: bool,
+            confidence: float = None, timestamp: float = None, box: tuple[int, int, int, int] = None) -> Incident:
+        timestamp = time.time() if timestamp is None else timestamp
+        key = (camera_id, person)
+        score = self.frame_score(frame)
+        opened = None
+        with self._lock:
+            incident = self.open_incidents.get(key)
+            if incident is None:
+                incident = opened = Incident(self._next_id, camera_id, person, violation, timestamp)
+                self._next_id += 1
+                self.open_incidents[key] = incident
+            incident.add(frame, timestamp, score, confidence, self.max_frames, self.min_frames_interval, box)
+
+        if opened is not None:
+            self.logger.info("incident opened: %s", opened)
+            if self.on_open is not None:
+                try:
+                    self.on_open(opened)
+                except Exception as e:
+                    self.logger.error("cannot handle the opened incident %s: %s", opened.incident_id, e)
+        return incident
+
+    def frame_score(self, frame: np.ndarray) -> float:
+        """The score of the frame, computed once for all the persons detected in it"""
+        last = self._last_score
+        if last is not None and last[0] is frame:
+            return last[1]
+        score = self.score(frame)
+        self._last_score = (frame, score)
+        return score
+
+    def close_expired(self, now: float = None) -> list[Incident]:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [
+                key for key, incident in self.open_incidents.items()
+                if now - incident.end_time >= self.gap or incident.duration >= self.max_duration
+            ]
+            closed = [self.open_incidents.pop(key) for key in expired]
+        self._closed(closed)
+        return closed
+
+    def close_all(self) -> list[Incident]:
+        with self._lock:
+            closed = list(self.open_incidents.values())
+            self.open_incidents = {}
+        self._closed(closed)
+        return closed
+
+    def _closed(self, incidents: list[Incident]):
+        for incident in incidents:
+            self.logger.info("incident closed: %s", incident)
+            if self.on_close is not None:
+                try:
+                    self.on_close(incident)
+                except Exception as e:
+                    self.logger.error("cannot handle the closed incident %s: %s", incident.incident_id, e)
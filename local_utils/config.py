@@ -1,4 +1,5 @@
 import os.path
+import socket
 from abc import abstractmethod, ABC
 
 import yaml
@@ -7,6 +8,11 @@ from typing import Any, Dict
 from logging import INFO, DEBUG, WARNING, ERROR, CRITICAL
 
 
+# what a step of the governor degradation ladder can change, see VideoProcessor.apply_degradation
+LADDER_KEYS = ("scale_size", "stride", "skip_face_recognition", "yolo")
+# the source fields set by the tuned profile of the host, see benchmarks.autotune
+TUNED_KEYS = ("batch_size", "scale_size", "yolo", "torch_threads")
+
 
 class ConfigException(Exception):
     pass
@@ -67,7 +73,14 @@ class VideoFrameSourceConfig(QueuedFrameSourceConfig):
         motion_detector_threshold=0.5,
         motion_detector_min_area=500,
         motion_detector="mog2",
+        motion_scale=100,
         view=True,
+        encode_jpeg=False,
+        allow_skip_face_recognition=False,
+        batch_size=1,
+        torch_threads=None,
+        tracker=None,
+        track_label_frames=15,
     ):
         super().__init__(id, source, timeout, fps)
         self.device = device
@@ -78,7 +91,16 @@ class VideoFrameSourceConfig(QueuedFrameSourceConfig):
         self.motion_detector_threshold = motion_detector_threshold
         self.motion_detector_min_area = motion_detector_min_area
         self.motion_detector = motion_detector
+        self.motion_scale = motion_scale
         self.view = view
+        self.encode_jpeg = encode_jpeg
+        self.allow_skip_face_recognition = allow_skip_face_recognition
+        self.batch_size = batch_size
+        self.torch_threads = torch_threads
+        self.tracker = tracker
+        self.track_label_frames = track_label_frames
+        # the fields set in config.yaml, a tuned profile doesn't override them
+        self.configured_keys: set[str] = set()
 
     def to_dict(self) -> dict:
         """
@@ -94,7 +116,14 @@ class VideoFrameSourceConfig(QueuedFrameSourceConfig):
             "motion_detector_threshold": self.motion_detector_threshold,
             "motion_detector_min_area": self.motion_detector_min_area,
             "motion_detector": self.motion_detector,
+            "motion_scale": self.motion_scale,
             "view": self.view,
+            "encode_jpeg": self.encode_jpeg,
+            "allow_skip_face_recognition": self.allow_skip_face_recognition,
+            "batch_size": self.batch_size,
+            "torch_threads": self.torch_threads,
+            "tracker": self.tracker,
+            "track_label_frames": self.track_label_frames,
         })
         return d
 
@@ -127,6 +156,8 @@ class Config:
         db_cfg = config_dict.get("database", {})
         self.db_path: str = db_cfg.get("path", os.getenv("DB_PATH"))
         self.drop_db: bool = db_cfg.get("drop_db", False)
+        self.events_flush_interval: float = db_cfg.get("events_flush_interval", 0.5)
+        self.events_retention_days: float = db_cfg.get("events_retention_days", 30)
 
         if self.db_path is None:
             raise ConfigException("DB_PATH is not set")
@@ -146,11 +177,115 @@ class Config:
             if not isinstance(frame_crt, dict):
                 raise ConfigException("Invalid frame_controller source configuration")
             source_cfg = VideoFrameSourceConfig(**frame_crt)
+            source_cfg.configured_keys = set(frame_crt)
             frame_controllers_config.append(source_cfg)
         max_queue_size = fc_cfg.get("max_queue_size", None)
 
         self.video_frame_controller = VideoFrameControllerConfig(max_queue_size, frame_controllers_config)
 
+        # Sezione notifications
+        notifications_cfg = config_dict.get("notifications", {})
+        self.notifications_config = {
+            "workers": notifications_cfg.get("workers", 2),
+            "max_queue_size": notifications_cfg.get("max_queue_size", 32),
+            "max_retries": notifications_cfg.get("max_retries", 3),
+            "backoff": notifications_cfg.get("backoff", 1.0),
+            "global_rate": notifications_cfg.get("global_rate", 30),
+            "per_chat_interval": notifications_cfg.get("per_chat_interval", 1.0),
+        }
+        jpeg_cfg = notifications_cfg.get("jpeg", {})
+        self.jpeg_config = {
+            "quality": jpeg_cfg.get("quality", 85),
+            "max_dimension": jpeg_cfg.get("max_dimension", 1280),
+            "draw_boxes": jpeg_cfg.get("draw_boxes", True),
+            "crop_person": jpeg_cfg.get("crop_person", False),
+            "crop_margin": jpeg_cfg.get("crop_margin", 0.25),
+        }
+        if not 0 <= self.jpeg_config["quality"] <= 100:
+            raise ConfigException(f"Invalid jpeg quality: {self.jpeg_config['quality']}")
+
+        # Sezione incidents
+        incidents_cfg = config_dict.get("incidents", {})
+        self.incidents_config = {
+            "gap": incidents_cfg.get("gap", 10.0),
+            "max_duration": incidents_cfg.get("max_duration", 600.0),
+            "max_frames": incidents_cfg.get("max_frames", 3),
+            "album": incidents_cfg.get("album", True),
+        }
+
+        # Sezione clips
+        clips_cfg = config_dict.get("clips", {})
+        self.clips_config = {
+            "enabled": clips_cfg.get("enabled", False),
+            "clips_dir": clips_cfg.get("clips_dir", "clips"),
+            "pre_roll": clips_cfg.get("pre_roll", 5.0),
+            "post_roll": clips_cfg.get("post_roll", 5.0),
+            "width": clips_cfg.get("width", 640),
+            "quality": clips_cfg.get("quality", 70),
+            "max_memory_mb": clips_cfg.get("max_memory_mb", 32),
+            "min_interval": clips_cfg.get("min_interval", 30.0),
+            "retention_hours": clips_cfg.get("retention_hours", 24.0),
+        }
+
+        # Sezione metrics
+        metrics_cfg = config_dict.get("metrics", {})
+        self.metrics_config = {
+            "enabled": metrics_cfg.get("enabled", True),
+            "host": metrics_cfg.get("host", "127.0.0.1"),
+            "port": metrics_cfg.get("port", 9108),
+            "interval": metrics_cfg.get("interval", 5.0),
+            "summary_interval": metrics_cfg.get("summary_interval", 60.0),
+        }
+
+        # Sezione profiling
+        profiling_cfg = config_dict.get("profiling", {})
+        self.profiling_config = {
+            "enabled": profiling_cfg.get("enabled", True),
+            "directory": profiling_cfg.get("directory", "profiles"),
+            "sampling_interval": profiling_cfg.get("sampling_interval", 0.005),
+        }
+
+        # Sezione governor
+        governor_cfg = config_dict.get("governor", {})
+        self.governor_config = {
+            "enabled": governor_cfg.get("enabled", False),
+            "slo": governor_cfg.get("slo", 2.0),
+            "queue_high": governor_cfg.get("queue_high", 0.8),
+            "recover": governor_cfg.get("recover", 0.5),
+            "cooldown": governor_cfg.get("cooldown", 10.0),
+            "ladder": governor_cfg.get("ladder", [
+                {"scale_size": 75},
+                {"scale_size": 50, "stride": 2},
+                {"scale_size": 50, "stride": 3, "skip_face_recognition": True},
+            ]),
+        }
+        for step in self.governor_config["ladder"]:
+            unknown = set(step) - set(LADDER_KEYS)
+            if unknown:
+                raise ConfigException(f"Invalid governor ladder step {step}: unknown {', '.join(sorted(unknown))}")
+        if self.governor_config["enabled"] and not self.metrics_config["enabled"]:
+            raise ConfigException("The governor needs the metrics enabled")
+
+        # Sezione tuning
+        tuning_cfg = config_dict.get("tuning", {})
+        self.tuning_config = {
+            "enabled": tuning_cfg.get("enabled", True),
+            "on_first_start": tuning_cfg.get("on_first_start", False),
+            "video": tuning_cfg.get("video", "synthetic"),
+            "max_frames": tuning_cfg.get("max_frames", 60),
+        }
+        self.tuned_profile: Dict[str, Any] = None
+
+        # Sezione view
+        view_cfg = config_dict.get("view", {})
+        self.view_config = {
+            "fps": view_cfg.get("fps", 10.0),
+            "cell_width": view_cfg.get("cell_width", 320),
+            "cell_height": view_cfg.get("cell_height", 240),
+            "columns": view_cfg.get("columns", None),
+            "thumbnail_fps": view_cfg.get("thumbnail_fps", 5.0),
+        }
+
         # Sezione logger
         logger_cfg = config_dict.get("logger", {})
         self.logger_config = {
@@ -175,6 +310,22 @@ class Config:
         elif level == "CRITICAL":
             self.logger_config["level"] = CRITICAL
 
+    def apply_tuned_profile(self, profile: Dict[str, Any]):
+        """
+        Set the fields of each source from its entry in the tuned profile of the host (sources: {id: fields}),
+        the fields set in config.yaml are kept. The sources without an entry are left as they are.
+        """
+        sources = profile.get("sources", {})
+        for source_id, overrides in sources.items():
+            unknown = set(overrides) - set(TUNED_KEYS)
+            if unknown:
+                raise ConfigException(f"Invalid tuned profile of source {source_id}: unknown {', '.join(sorted(unknown))}")
+        for source in self.video_frame_controller.sources:
+            for key, value in sources.get(source.id, {}).items():
+                if key not in source.configured_keys:
+                    setattr(source, key, value)
+        self.tuned_profile = profile
+
     def __str__(self):
         """
         Pretty-print the Config object, showing partially masked tokens,
@@ -208,9 +359,11 @@ class Config:
             f"Auth Token: {masked_auth_token}\n" +
             f"DB Path: {self.db_path}\n" +
             f"Drop DB: {self.drop_db}\n" +
+            f"Events Retention Days: {self.events_retention_days}\n" +
             f"Enroll Path: {self.basedir_enroll_path}\n" +
             f"Logger Level: {logger_level}\n" +
             f"Logger Format: {logger_format}\n" +
+            f"Tuned Profile: {self.tuned_profile.get('sources') if self.tuned_profile else None}\n" +
             f"\nFrame Controllers:\n{frame_controller_config_str}" +
             f"{'-' * 10} End Config {'-' * 10}\n"
         )
@@ -231,7 +384,16 @@ def load_config(config_path: str = os.path.join('config', 'config.yaml')) -> Con
         data = yaml.safe_load(f) or {}
 
     config = Config(data)
+    profile_path = tuned_profile_path(os.path.dirname(config_path))
+    if config.tuning_config["enabled"] and os.path.exists(profile_path):
+        with open(profile_path, "r", encoding="utf-8") as f:
+            config.apply_tuned_profile(yaml.safe_load(f) or {})
     return config
 
 
+def tuned_profile_path(config_dir: str = 'config') -> str:
+    """The tuned profile of this host, written by benchmarks.autotune"""
+    return os.path.join(config_dir, f"tuned_profile.{socket.gethostname()}.yaml")
+
+
 
@@ -4,8 +4,8 @@ def rescale_frame(frame, percent=50, interpolation=cv2.INTER_AREA):
     """
     Rescale the frame by a given percentage. 100 means no rescaling. 0 means width and height = 0.
     """
-    percent = percent / 100
     if percent == 100: return frame
+    percent = percent / 100
 
     width = int(frame.shape[1] * percent)
     height = int(frame.shape[0] * percent)
@@ -0,0 +1,69 @@
+import cv2 as cv
+import numpy as np
+
+
+class JpegProfile:
+    """
+    How the alert images are encoded: JPEG quality, maximum size and annotations.
+    Frames are encoded straight from BGR with cv.imencode, no color conversion or PIL copy.
+    """
+
+    def __init__(self, quality: int = 85, max_dimension: int = 1280, draw_boxes: bool = True,
+                 crop_person: bool = False, crop_margin: float = 0.25):
+        """
+        quality: JPEG quality, 0-100
+        max_dimension: the longest side of the image is downscaled to this size, None to keep the original size
+        draw_boxes: draw the person boxes on the image
+        crop_person: crop the image around the person boxes
+        crop_margin: margin around the boxes when cropping, relative to the size of the boxes
+        """
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.draw_boxes = draw_boxes
+        self.crop_person = crop_person
+        self.crop_margin = crop_margin
+
+    def encode(self, frame: np.ndarray, boxes=None) -> bytes:
+        """
+        frame: BGR image
+        boxes: (x1, y1, x2, y2) person boxes in frame coordinates, if known
+        """
+        if frame.dtype != np.uint8:
+            frame = frame.astype(np.uint8)
+        boxes = [] if boxes is None else [tuple(int(c) for c in box) for box in boxes]
+
+        thickness = max(2, max(frame.shape[:2]) // 400)
+        offset_x, offset_y = 0, 0
+        if boxes and self.crop_person:
+            frame, (offset_x, offset_y) = self._crop(frame, boxes)
+
+        scale = 1
+        if self.max_dimension is not None and self.max_dimension < max(frame.shape[:2]):
+            scale = self.max_dimension / max(frame.shape[:2])
+            frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+
+        # the boxes are drawn last, on the downscaled image: the full frame is never copied
+        if boxes and self.draw_boxes:
+            if scale == 1:
+                frame = frame.copy()  # the frame may be still used by someone else
+            thickness = max(1, round(thickness * scale))
+            for x1, y1, x2, y2 in boxes:
+                cv.rectangle(frame, (int((x1 - offset_x) * scale), int((y1 - offset_y) * scale)),
+                             (int((x2 - offset_x) * scale), int((y2 - offset_y) * scale)), (0, 0, 255), thickness)
+
+        ok, jpeg = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError(f"cannot encode image of shape {frame.shape}")
+        return jpeg.tobytes()
+
+    def _crop(self, frame: np.ndarray, boxes: list[tuple[int, int, int, int]]) -> tuple[np.ndarray, tuple[int, int]]:
+        """Crop around the union of the boxes, plus the margin. returns the crop and the position of its corner"""
+        x1, y1 = min(b[0] for b in boxes), min(b[1] for b in boxes)
+        x2, y2 = max(b[2] for b in boxes), max(b[3] for b in boxes)
+        margin_x, margin_y = int((x2 - x1) * self.crop_margin), int((y2 - y1) * self.crop_margin)
+        height, width = frame.shape[:2]
+        x1, y1 = max(0, x1 - margin_x), max(0, y1 - margin_y)
+        x2, y2 = min(width, x2 + margin_x), min(height, y2 + margin_y)
+        if x2 <= x1 or y2 <= y1:
+            return frame, (0, 0)
+        return frame[y1:y2, x1:x2], (x1, y1)
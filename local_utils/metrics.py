@@ -0,0 +1,354 @@
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+
+from local_utils.logger import Logger
+
+# upper bounds, in seconds, of the latency buckets: from 0.5 ms to 10 s
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Fixed buckets latency histogram, the last bucket counts the values above BUCKETS[-1]"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, counts: list[int] = None, sum: float = 0.0, count: int = 0):
+        self.counts = counts if counts is not None else [0] * (len(BUCKETS) + 1)
+        self.sum = sum
+        self.count = count
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimated by linear interpolation inside the bucket, None if empty"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1] * 2
+                return low + (high - low) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+    def state(self) -> tuple:
+        return list(self.counts), self.sum, self.count
+
+    def since(self, previous: "Histogram | None") -> "Histogram":
+        """The observations after previous, an earlier state of the same histogram"""
+        if previous is None:
+            return self
+        return Histogram([count - before for count, before in zip(self.counts, previous.counts)],
+                         self.sum - previous.sum, self.count - previous.count)
+
+
+class MetricsSnapshot:
+    """Cumulative values of a MetricsRegistry, sent by the camera processes through the detections queue"""
+
+    __slots__ = ('source', 'timestamp', 'histograms', 'counters', 'gauges')
+
+    def __init__(self, source, timestamp: float, histograms: dict[str, tuple], counters: dict[str, float],
+                 gauges: dict[str, float]):
+        self.source = source
+        self.timestamp = timestamp
+        self.histograms = histograms
+        self.counters = counters
+        self.gauges = gauges
+
+    def __getstate__(self):
+        return self.source, self.timestamp, self.histograms, self.counters, self.gauges
+
+    def __setstate__(self, state):
+        self.source, self.timestamp, self.histograms, self.counters, self.gauges = state
+
+    def histogram(self, name: str) -> Histogram | None:
+        state = self.histograms.get(name)
+        return Histogram(*state) if state is not None else None
+
+
+class MetricsRegistry:
+    """
+    The metrics of a process, or of a component: stage latencies, counters and gauges.
+    Timings use the monotonic clock, an observation costs about a microsecond.
+    usage:
+    ```
+        metrics = MetricsRegistry(source=camera_id)
+        with metrics.timer("yolo"):
+            results = model(frames)
+        metrics.inc("frames")
+        metrics.set("queue_depth", queue.qsize())
+    ```
+    """
+
+    def __init__(self, source):
+        """source: the camera id, or the name of the component, used as the camera label"""
+        self.source = source
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, float] = {}
+        self.gauges: dict[str, float] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def snapshot(self) -> MetricsSnapshot:
+        with self._lock:
+            return MetricsSnapshot(
+                self.source, time.time(),
+                {name: histogram.state() for name, histogram in self.histograms.items()},
+                dict(self.counters), dict(self.gauges),
+            )
+
+    def __getstate__(self):
+        # sent to the camera processes before they start, the lock can't be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+
+def timed(metrics: MetricsRegistry | None, name: str):
+    """metrics.timer(name), or a no-op context if there is no registry"""
+    return metrics.timer(name) if metrics is not None else nullcontext()
+
+
+def process_usage(metrics: MetricsRegistry):
+    """Set the rss_bytes and cpu_seconds gauges of the calling process, from /proc/self/statm and os.times()"""
+    times = os.times()
+    metrics.set("cpu_seconds", times.user + times.system)
+    try:
+        with open("/proc/self/statm") as f:
+            metrics.set("rss_bytes", int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError):
+        pass  # no procfs, e.g. macOS
+
+
+def _rate(current: MetricsSnapshot, previous: MetricsSnapshot | None, counter: str) -> float | None:
+    """Per second increase of the counter between the two snapshots"""
+    if previous is None or current.timestamp <= previous.timestamp:
+        return None
+    delta = current.counters.get(counter, 0) - previous.counters.get(counter, 0)
+    return delta / (current.timestamp - previous.timestamp)
+
+
+def _window(current: MetricsSnapshot, previous: MetricsSnapshot | None, name: str) -> Histogram | None:
+    """The observations of the histogram between the two snapshots, all of them without previous"""
+    histogram = current.histogram(name)
+    if histogram is None:
+        return None
+    return histogram.since(previous.histogram(name) if previous is not None else None)
+
+
+def _cpu_percent(current: MetricsSnapshot, previous: MetricsSnapshot | None) -> float | None:
+    if previous is None or current.timestamp <= previous.timestamp or "cpu_seconds" not in previous.gauges:
+        return None
+    cpu = current.gauges.get("cpu_seconds", 0) - previous.gauges["cpu_seconds"]
+    return 100 * cpu / (current.timestamp - previous.timestamp)
+
+
+class MetricsAggregator:
+    """
+    Collects the snapshots of the camera processes and the registries of the main process,
+    renders them in the Prometheus text format.
+    """
+
+    PREFIX = "littlebrother"
+
+    def __init__(self):
+        self.snapshots: dict[str, MetricsSnapshot] = {}
+        self.previous_snapshots: dict[str, MetricsSnapshot] = {}
+        self.registries: list[MetricsRegistry] = []
+        self._lock = Lock()
+        # summary of the pipeline, recomputed by refresh_stats() and only read by the bot
+        self.stats: dict | None = None
+        self._previous_local: dict[str, MetricsSnapshot] = {}
+
+    def add_registry(self, registry: MetricsRegistry):
+        """A registry of this process, snapshotted at every collect()"""
+        self.registries.append(registry)
+
+    def registry(self, source) -> MetricsRegistry:
+        """The registry of this process for source, created and added the first time"""
+        for registry in self.registries:
+            if registry.source == source:
+                return registry
+        registry = MetricsRegistry(source)
+        self.add_registry(registry)
+        return registry
+
+    def update(self, snapshot: MetricsSnapshot):
+        with self._lock:
+            previous = self.snapshots.get(str(snapshot.source))
+            if previous is not None:
+                self.previous_snapshots[str(snapshot.source)] = previous
+            self.snapshots[str(snapshot.source)] = snapshot
+
+    def refresh_stats(self):
+        """
+        Recompute self.stats from the last two snapshots of each camera and from the registries of this process:
+        {"timestamp", "cameras": {camera: {...}}, "processes": {name: {"rss_bytes", "cpu_percent"}}, "queue": {...}}
+        The rates and the YOLO latencies are over the interval between the last two snapshots of the camera,
+        the decision latency, measured in this process, over the interval since the previous refresh_stats:
+        a cumulative p95 would hide a camera that became slow after a long healthy run.
+        """
+        with self._lock:
+            remote = dict(self.snapshots)
+            previous = dict(self.previous_snapshots)
+        local = {str(registry.source): registry.snapshot() for registry in self.registries}
+
+        cameras, processes = {}, {}
+        for source, snapshot in sorted(remote.items()):
+            before = previous.get(source)
+            produced = _rate(snapshot, before, "produced")
+            gated = _rate(snapshot, before, "gated")
+            yolo = _window(snapshot, before, "yolo")
+            decision = _window(local[source], self._previous_local.get(source), "capture_to_decision") \
+                if source in local else None
+            cameras[source] = {
+                "fps": produced,
+                "motion_rate": 1 - gated / produced if produced and gated is not None else None,
+                "yolo": {q: yolo.quantile(q) for q in QUANTILES} if yolo is not None else {},
+                "decision_p95": decision.quantile(0.95) if decision is not None else None,
+                "dropped": snapshot.counters.get("dropped_full", 0),
+                "level": local[source].gauges.get("degradation_level", 0) if source in local else 0,
+            }
+            processes[f"camera {source}"] = {"rss_bytes": snapshot.gauges.get("rss_bytes"),
+                                             "cpu_percent": _cpu_percent(snapshot, before)}
+        for source, snapshot in local.items():
+            if "cpu_seconds" in snapshot.gauges:
+                processes[source] = {"rss_bytes": snapshot.gauges.get("rss_bytes"),
+                                     "cpu_percent": _cpu_percent(snapshot, self._previous_local.get(source))}
+        self._previous_local = local
+        controller = local.get("controller")
+        queue = {name: controller.gauges.get(name) for name in ("queue_depth", "queue_depth_peak", "queue_max_size")} \
+            if controller is not None else {}
+        self.stats = {"timestamp": time.time(), "cameras": cameras, "processes": processes, "queue": queue}
+
+    def total(self, counter: str) -> float:
+        """Sum of the counter over all the sources"""
+        return sum(snapshot.counters.get(counter, 0) for snapshot in self.collect())
+
+    def collect(self) -> list[MetricsSnapshot]:
+        with self._lock:
+            remote = list(self.snapshots.values())
+        return remote + [registry.snapshot() for registry in self.registries]
+
+    def render(self) -> str:
+        lines = []
+        histograms, counters, gauges = {}, {}, {}
+        for snapshot in self.collect():
+            source = str(snapshot.source)
+            for name, state in snapshot.histograms.items():
+                histograms.setdefault(name, []).append((source, Histogram(*state)))
+            for name, value in snapshot.counters.items():
+                counters.setdefault(name, []).append((source, value))
+            for name, value in snapshot.gauges.items():
+                gauges.setdefault(name, []).append((source, value))
+
+        if histograms:
+            name = f"{self.PREFIX}_stage_seconds"
+            lines += [f"# HELP {name} Latency of the pipeline stages", f"# TYPE {name} histogram"]
+            for stage, sources in sorted(histograms.items()):
+                for source, histogram in sources:
+                    labels = f'camera="{source}",stage="{stage}"'
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+            name = f"{self.PREFIX}_stage_latency_seconds"
+            lines += [f"# HELP {name} Estimated percentiles of the latency of the pipeline stages", f"# TYPE {name} gauge"]
+            for stage, sources in sorted(histograms.items()):
+                for source, histogram in sources:
+                    for q in QUANTILES:
+                        value = histogram.quantile(q)
+                        if value is not None:
+                            lines.append(f'{name}{{camera="{source}",stage="{stage}",quantile="{q}"}} {value:.6f}')
+
+        for counter, sources in sorted(counters.items()):
+            name = f"{self.PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines += [f'{name}{{camera="{source}"}} {value}' for source, value in sources]
+        for gauge, sources in sorted(gauges.items()):
+            name = f"{self.PREFIX}_{gauge}"
+            lines.append(f"# TYPE {name} gauge")
+            lines += [f'{name}{{camera="{source}"}} {value}' for source, value in sources]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(Thread, Logger):
+    """
+    Serves the metrics of the aggregator in the Prometheus text format at http://<host>:<port>/metrics
+    usage:
+    ```
+        server = MetricsServer(aggregator, host="127.0.0.1", port=9108)
+        server.start()
+        server.stop()
+    ```
+    """
+
+    def __init__(self, aggregator: MetricsAggregator, host: str = "127.0.0.1", port: int = 9108):
+        Thread.__init__(self, name=self.__class__.__name__, daemon=True)
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.aggregator = aggregator
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = server.aggregator.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                server.logger.debug(format, *args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+
+    def run(self):
+        self.logger.info("serving the metrics on http://%s:%s/metrics", *self.httpd.server_address[:2])
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
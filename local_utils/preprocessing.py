@@ -0,0 +1,135 @@
+"""
+Preprocessing of the camera frames with as few copies as possible.
+Each frame is reduced once to the levels of a FramePyramid: the proxy seen by the motion detector and the inference
+frame given to YOLO. A level is computed the first time it is used, into a buffer allocated once per camera and
+reused by the next frames; a level at 100% is the frame itself. The view thumbnails are written by ThumbnailSlot
+directly into shared memory, from one of the levels (see camera.compositor).
+"""
+import cv2 as cv
+import numpy as np
+
+
+def scaled_size(shape: tuple, percent: float) -> tuple[int, int]:
+    """(width, height) of an image of shape rescaled by percent"""
+    return int(shape[1] * percent / 100), int(shape[0] * percent / 100)
+
+
+def resize(frame: np.ndarray, percent: float, dst: np.ndarray = None, interpolation=cv.INTER_AREA) -> np.ndarray:
+    """
+    Rescale the frame by percent, written into dst when it has the shape of the result.
+    returns the frame itself at 100%
+    """
+    if percent == 100:
+        return frame
+    size = scaled_size(frame.shape, percent)
+    if dst is not None and dst.shape[:2] == (size[1], size[0]):
+        return cv.resize(frame, size, dst=dst, interpolation=interpolation)
+    return cv.resize(frame, size, interpolation=interpolation)
+
+
+def draw_boxes(image: np.ndarray, boxes, scale: float = 1.0, color=(0, 0, 255), thickness: int = 2) -> np.ndarray:
+    """Draw the (x1, y1, x2, y2) boxes, given in the coordinates of an image scale times smaller, in place"""
+    for x1, y1, x2, y2 in boxes:
+        cv.rectangle(image, (int(x1 * scale), int(y1 * scale)), (int(x2 * scale), int(y2 * scale)), color, thickness)
+    return image
+
+
+class BufferPool:
+    """
+    Rings of preallocated images, one ring for each name: a buffer is handed out again after size requests
+    of its ring, until then the image written in it stays valid. A buffer is reallocated only when the shape changes.
+    """
+
+    def __init__(self):
+        self._rings: dict[str, list[np.ndarray]] = {}
+        self._next: dict[str, int] = {}
+        self.allocations = 0
+
+    def get(self, name: str, shape: tuple, size: int = 1, dtype=np.uint8) -> np.ndarray:
+        ring = self._rings.setdefault(name, [])
+        del ring[size:]
+        index = self._next.get(name, 0) % size
+        self._next[name] = index + 1
+        ring.extend([None] * (index + 1 - len(ring)))
+        if ring[index] is None or ring[index].shape != shape or ring[index].dtype != dtype:
+            ring[index] = np.empty(shape, dtype)
+            self.allocations += 1
+        return ring[index]
+
+
+class FramePyramid:
+    """The levels of one frame, computed on first use by the FramePreprocessor which built it"""
+
+    __slots__ = ("frame", "_preprocessor", "_proxy", "_inference")
+
+    def __init__(self, frame: np.ndarray, preprocessor: "FramePreprocessor"):
+        self.frame = frame
+        self._preprocessor = preprocessor
+        self._proxy = self._inference = None
+
+    @property
+    def proxy(self) -> np.ndarray:
+        if self._proxy is None:
+            self._proxy = self._preprocessor.proxy(self.frame)
+        return self._proxy
+
+    @property
+    def inference(self) -> np.ndarray:
+        if self._inference is None:
+            self._inference = self._preprocessor.inference(self.frame)
+        return self._inference
+
+    @property
+    def pooled(self) -> bool:
+        """True if the inference frame is a buffer of the preprocessor: copy it to keep it past the next batch"""
+        return self._inference is not None and self._inference is not self.frame
+
+
+class FramePreprocessor:
+    """
+    Builds the FramePyramid of each frame of a camera, the levels are written into the buffers of its BufferPool.
+    The proxy and the inference frames stay valid for the next frame and the next batch_size frames respectively,
+    so that optical flow can compare two proxies and YOLO can run on a whole batch.
+    usage:
+    ```
+        preprocessor = FramePreprocessor(scale_size=50, proxy_scale=25, proxy_gray=True)
+        pyramid = preprocessor(frame)
+        if motion_detector(previous_proxy, pyramid.proxy):
+            results = yolo(pyramid.inference)
+    ```
+    """
+
+    def __init__(self, scale_size: int = 100, *, proxy_scale: int = 100, proxy_gray: bool = False,
+                 batch_size: int = 1, interpolation=cv.INTER_AREA):
+        """
+        scale_size: percentage of the inference frame, the scale_size of the camera
+        proxy_scale: percentage of the proxy
+        proxy_gray: convert the proxy to gray, after downscaling it (optical flow works on gray images)
+        batch_size: inference frames used together
+        """
+        self.scale_size = scale_size
+        self.proxy_scale = proxy_scale
+        self.proxy_gray = proxy_gray
+        self.batch_size = batch_size
+        self.interpolation = interpolation
+        self.pool = BufferPool()
+
+    def __call__(self, frame: np.ndarray) -> FramePyramid:
+        return FramePyramid(frame, self)
+
+    def _buffer(self, name: str, frame: np.ndarray, percent: float, size: int = 1) -> np.ndarray | None:
+        if percent == 100:
+            return None
+        width, height = scaled_size(frame.shape, percent)
+        return self.pool.get(name, (height, width) + frame.shape[2:], size, frame.dtype)
+
+    def proxy(self, frame: np.ndarray) -> np.ndarray:
+        small = resize(frame, self.proxy_scale, self._buffer("proxy", frame, self.proxy_scale, 2), self.interpolation)
+        if not self.proxy_gray or small.ndim == 2:
+            return small
+        # the conversion runs on the pixels of the downscaled image only
+        return cv.cvtColor(small, cv.COLOR_BGR2GRAY, dst=self.pool.get("proxy_gray", small.shape[:2], 2))
+
+    def inference(self, frame: np.ndarray) -> np.ndarray:
+        dst = self._buffer("inference", frame, self.scale_size, max(1, self.batch_size))
+        return resize(frame, self.scale_size, dst, self.interpolation)
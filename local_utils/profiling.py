@@ -0,0 +1,267 @@
+"""
+On-demand profiling of the live processes, without restarting them.
+Every process registers itself under a name ("main", "camera-<id>") by writing its pid and start time in the run
+subdirectory of the profiling directory, emptied when the application starts; a request writes <name>.request there
+and sends SIGUSR1 to the pid, if it is still the registered process. The process then profiles itself for the given
+seconds and dumps the result in the profiling directory. Until a request arrives the cost is an attribute check per
+loop iteration.
+
+usage: python -m local_utils.profiling camera-0 --mode sampling --seconds 30 [--dir profiles]
+"""
+import argparse
+import cProfile
+import json
+import os
+import shutil
+import signal
+import sys
+import time
+from collections import Counter
+from threading import Thread, Event, get_ident
+
+from local_utils.logger import Logger
+
+MODES = ("sampling", "cprofile", "torch")
+
+
+def run_directory(directory: str) -> str:
+    """Where the pid files and the requests of the running processes are written"""
+    return os.path.join(directory, "run")
+
+
+def reset_run_directory(directory: str = "profiles"):
+    """Remove the pid files left by a previous run, called once at startup before any process registers"""
+    shutil.rmtree(run_directory(directory), ignore_errors=True)
+    os.makedirs(run_directory(directory), exist_ok=True)
+
+
+def process_start_time(pid: int) -> str | None:
+    """
+    Start time of the process in clock ticks since boot, from /proc/<pid>/stat: a reused pid has a different one.
+    returns None if the process doesn't exist or /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the command name, in parentheses, can contain spaces: the fields are counted after it, starttime is the 22nd
+    return stat[stat.rfind(")") + 2:].split()[19]
+
+
+class StackSampler(Thread):
+    """Samples the stack of a thread at a fixed interval, the stacks are counted in the collapsed format"""
+
+    def __init__(self, thread_ident: int, interval: float = 0.005):
+        Thread.__init__(self, name=self.__class__.__name__, daemon=True)
+        self.thread_ident = thread_ident
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path: str):
+        """One line per stack, root first: the input of flamegraph.pl or speedscope"""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class TorchSession:
+    """torch.profiler on the CPU and, if available, on the GPU: chrome trace and the table of the slowest operators"""
+
+    def __init__(self):
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.cuda.is_available() else [])
+        self.profile = profile(activities=activities, record_shapes=True)
+        self.profile.__enter__()
+
+    def stop(self):
+        self.profile.__exit__(None, None, None)
+
+    def dump(self, path: str):
+        self.profile.export_chrome_trace(f"{path}.json")
+        with open(f"{path}.txt", "w") as f:
+            f.write(self.profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=40))
+
+
+class Profiler(Logger):
+    """
+    Profiles the thread calling poll(), on request of another process (see request_profile).
+    install() must be called from the main thread of the process, poll() from the loop to profile:
+    cProfile and torch.profiler only see the thread which starts them.
+    usage:
+    ```
+        profiler = Profiler("camera-0", "profiles")
+        profiler.install()
+        while True:
+            profiler.poll()
+            process_next_frame()
+    ```
+    """
+
+    def __init__(self, name: str, directory: str = "profiles", sampling_interval: float = 0.005):
+        """
+        name: the name used by the requests, and prefix of the dumps
+        directory: where the dumps are written, the pid and the requests go in its run subdirectory
+        sampling_interval: seconds between two samples of the sampling profiler
+        """
+        Logger.__init__(self, name=f"{self.__class__.__name__}-{name}")
+        self.name = name
+        self.directory = directory
+        self.sampling_interval = sampling_interval
+        self._pending = None
+        self._session = None
+        self._mode = None
+        self._deadline = None
+
+    @property
+    def pid_path(self) -> str:
+        return os.path.join(run_directory(self.directory), f"{self.name}.pid")
+
+    @property
+    def request_path(self) -> str:
+        return os.path.join(run_directory(self.directory), f"{self.name}.request")
+
+    def install(self):
+        if not hasattr(signal, "SIGUSR1"):
+            self.logger.warning("profiling requests need SIGUSR1, not available on this platform")
+            return
+        os.makedirs(run_directory(self.directory), exist_ok=True)
+        pid = os.getpid()
+        with open(self.pid_path, "w") as f:
+            f.write(f"{pid} {process_start_time(pid) or ''}".strip())
+        signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def uninstall(self):
+        self.stop()
+        try:
+            os.remove(self.pid_path)
+        except OSError:
+            pass
+
+    def _on_signal(self, signum, frame):
+        # only read the request here, the session is started by poll() in the profiled thread
+        try:
+            with open(self.request_path) as f:
+                request = json.load(f)
+            os.remove(self.request_path)
+        except (OSError, ValueError) as e:
+            self.logger.error("cannot read the profiling request: %s", e)
+            return
+        if request.get("mode") not in MODES:
+            self.logger.error("unknown profiling mode %s", request.get("mode"))
+            return
+        self._pending = request
+
+    def poll(self):
+        if self._pending is None and self._session is None:
+            return
+        if self._session is not None:
+            if time.monotonic() >= self._deadline:
+                self.stop()
+            return
+        request, self._pending = self._pending, None
+        self.start(request["mode"], float(request.get("seconds", 30)))
+
+    def start(self, mode: str, seconds: float):
+        """Profile the calling thread for seconds, the result is dumped by the first poll() after them"""
+        if mode == "sampling":
+            session = StackSampler(get_ident(), self.sampling_interval)
+            session.start()
+        elif mode == "cprofile":
+            session = cProfile.Profile()
+            session.enable()
+        else:
+            session = TorchSession()
+        self._session, self._mode = session, mode
+        self._deadline = time.monotonic() + seconds
+        self.logger.info("%s profiling started for %s seconds", mode, seconds)
+
+    def stop(self):
+        if self._session is None:
+            return
+        session, mode, self._session = self._session, self._mode, None
+        path = os.path.join(self.directory, f"{self.name}-{mode}-{time.strftime('%Y%m%d-%H%M%S')}")
+        try:
+            if mode == "cprofile":
+                session.disable()
+                path += ".pstats"
+                session.dump_stats(path)
+            else:
+                session.stop()
+                if mode == "sampling":
+                    path += ".collapsed"
+                session.dump(path)
+        except Exception as e:
+            self.logger.error("cannot dump the %s profile: %s", mode, e)
+            return
+        self.logger.info("%s profile written to %s", mode, path)
+
+
+def targets(directory: str = "profiles") -> list[str]:
+    """Names of the processes registered for profiling"""
+    if not os.path.isdir(run_directory(directory)):
+        return []
+    return sorted(name[:-len(".pid")] for name in os.listdir(run_directory(directory)) if name.endswith(".pid"))
+
+
+def request_profile(name: str, mode: str = "sampling", seconds: float = 30, directory: str = "profiles") -> int:
+    """
+    Ask the process registered as name to profile itself.
+    returns its pid, raises ValueError if the mode is unknown or the process is not registered or not running
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown profiling mode {mode}, expected one of {', '.join(MODES)}")
+    try:
+        with open(os.path.join(run_directory(directory), f"{name}.pid")) as f:
+            pid, *start_time = f.read().split()
+            pid = int(pid)
+    except (OSError, ValueError):
+        raise ValueError(f"no process registered as {name} in {directory}")
+    # the pid of an exited process can be reused by any other one, which SIGUSR1 would kill
+    if start_time and process_start_time(pid) != start_time[0]:
+        raise ValueError(f"the process {pid} registered as {name} is not running")
+    request_path = os.path.join(run_directory(directory), f"{name}.request")
+    with open(f"{request_path}.tmp", "w") as f:
+        json.dump({"mode": mode, "seconds": seconds}, f)
+    os.replace(f"{request_path}.tmp", request_path)
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except ProcessLookupError:
+        os.remove(request_path)
+        raise ValueError(f"the process {pid} registered as {name} is not running")
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("name", help="main or camera-<id>")
+    parser.add_argument("--mode", choices=MODES, default="sampling")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--dir", default="profiles")
+    args = parser.parse_args()
+    try:
+        pid = request_profile(args.name, args.mode, args.seconds, args.dir)
+    except ValueError as e:
+        parser.error(f"{e}, registered: {', '.join(targets(args.dir)) or 'none'}")
+    print(f"{args.mode} profiling requested to {args.name} (pid {pid}), results in {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,8 @@ def view(frame, *, scale=0.5, winname='Frame'):
     :winname: name of the opencv window, use different names to create multiple windows
     """
     # Resize frame to    a normal view
-    frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_LINEAR)
+    if scale != 1:
+        frame = cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_LINEAR)
     cv.imshow(winname, frame)
     key = cv.waitKey(1)
     if key in [27, ord('q'), ord('Q')]:
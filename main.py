@@ -1,9 +1,21 @@
+import os
+from collections import defaultdict, deque
 from threading import Thread
+import time
 from time import sleep
 
-from db.db_lite import TBDatabase, TDBAtomicConnection, UNKNOWN_SPECIAL_USER
+from db.db_lite import TBDatabase, AccessDecisionMatrix, UNKNOWN_SPECIAL_USER
+from db.detection_events import DetectionEventWriter
+from incidents.incident_engine import IncidentEngine, Incident
 from local_utils.config import Config, load_config
+from local_utils.image_encoding import JpegProfile
 from local_utils.logger import get_logger, init_logger
+from local_utils.metrics import MetricsAggregator, MetricsRegistry, MetricsServer, MetricsSnapshot, process_usage
+from local_utils.profiling import Profiler, reset_run_directory
+from camera.clip_recorder import ClipMessage
+from camera.compositor import Compositor
+from camera.detection_message import SequenceTracker
+from camera.load_governor import LoadGovernor
 from camera.video_processor import initialize_frame_controller
 import signal
 
@@ -24,61 +36,264 @@ def init_database(config: Config):
     return db
 
 
-def init_frame_controller(config: Config):
+def ensure_tuned_profile(config: Config):
+    """Calibrate the cameras on the first start on this host, if enabled"""
+    if config.tuned_profile is not None or not config.tuning_config['enabled'] \
+            or not config.tuning_config['on_first_start']:
+        return
+    # the calibration code is only needed on the first start
+    from benchmarks.autotune import tune
+    logger.info("No tuned profile for this host, calibrating the cameras: it takes some minutes")
+    tune(config)
+
+
+def init_compositor(config: Config) -> Compositor | None:
+    if not any(source.view for source in config.video_frame_controller.sources):
+        return None
+    return Compositor(**config.view_config)
+
+
+def init_frame_controller(config: Config, compositor: Compositor = None):
     # conf = config.video_frame_controller.sources.copy()
     # # remove all second elements of the tuple
-    frame_controller = initialize_frame_controller(config.video_frame_controller)
+    clips = {k: v for k, v in config.clips_config.items() if k not in ('enabled', 'retention_hours')} \
+        if config.clips_config['enabled'] else None
+    metrics_interval = config.metrics_config['interval'] if config.metrics_config['enabled'] else None
+    ladder = config.governor_config['ladder'] if config.governor_config['enabled'] else None
+    frame_controller = initialize_frame_controller(config.video_frame_controller, db_path=config.db_path,
+                                                   jpeg_profile=JpegProfile(**config.jpeg_config), clips=clips,
+                                                   metrics_interval=metrics_interval, profiling=profiling_kwargs(config),
+                                                   degradation_ladder=ladder, compositor=compositor)
     return frame_controller
 
 
-def check_access(person, camera_id, database: TDBAtomicConnection):
-    has_access = database.has_access_to_room(person, camera_id)
+def profiling_kwargs(config: Config) -> dict | None:
+    if not config.profiling_config['enabled']:
+        return None
+    return {k: v for k, v in config.profiling_config.items() if k != 'enabled'}
+
+
+def check_access(person, camera_id, access_matrix: AccessDecisionMatrix):
+    has_access = access_matrix.has_access(person, camera_id)
     return has_access
 
 
-def handle_signal(sig, frame, frame_controller):
+def handle_signal(sig, frame, frame_controller, compositor: Compositor = None):
     logger.info("SIGINT received, shutting down services.")
     t_bot.stop_bot()
     frame_controller.stop_sources()
+    if compositor is not None:
+        compositor.stop()
     exit(0)
 
-def register_signal_handler(frame_controller):
-    signal.signal(signal.SIGINT, lambda s, f: handle_signal(s, f, frame_controller))
+def register_signal_handler(frame_controller, compositor: Compositor = None):
+    signal.signal(signal.SIGINT, lambda s, f: handle_signal(s, f, frame_controller, compositor))
+
+def incident_opened(incident: Incident, access_matrix: AccessDecisionMatrix, events_writer: DetectionEventWriter,
+                    violations: dict[int, deque]):
+    """First detection of a person on a camera: record it and, if it is a violation, notify it right away"""
+    events_writer.record(incident.camera_id, incident.person, incident.best_confidence, incident.last_box,
+                         timestamp=incident.start_time)
+    if not incident.violation:
+        return
+    violations[incident.camera_id].append(incident)  # waiting for the clip of the camera
+    logger.critical(f"Person %s has no access to room %s", incident.person, incident.camera_id)
+    camera_name = access_matrix.camera_name(incident.camera_id)
+    # the incident opens on its first detection, start_time is the capture time of its frame
+    t_bot.send_detection_img(incident.best_frame, person_detected_name=incident.person, access_camera_name=camera_name,
+                             boxes=[incident.best_box] if incident.best_box is not None else None,
+                             capture_ts=incident.start_time)
+
+
+def incident_closed(incident: Incident, access_matrix: AccessDecisionMatrix, events_writer: DetectionEventWriter):
+    """The person left the camera: record the whole incident and, if enabled, send the album of its best frames"""
+    events_writer.record_incident(incident.camera_id, incident.person, incident.start_time, incident.end_time,
+                                  incident.violation, incident.detections, incident.best_confidence)
+    if incident.violation and config.incidents_config['album'] and len(incident.best_frames) > 1:
+        t_bot.send_incident_album([frame for _, _, frame, _ in incident.best_frames],
+                                  boxes=[[box] if box is not None else None for _, _, _, box in incident.best_frames],
+                                  person_detected_name=incident.person,
+                                  access_camera_name=access_matrix.camera_name(incident.camera_id),
+                                  duration=incident.duration, detections=incident.detections)
+
+
+def clip_received(clip: ClipMessage, access_matrix: AccessDecisionMatrix, violations: dict[int, deque]):
+    """Send the clip if it shows the start of a violation, otherwise it is deleted"""
+    logger.debug("Clip received: %s, camera buffer %s KB", clip, clip.buffer_bytes // 1024)
+    for incident in violations[clip.camera_id]:
+        if clip.start_ts <= incident.start_time <= clip.end_ts:
+            violations[clip.camera_id].remove(incident)
+            t_bot.send_incident_clip(clip.path, person_detected_name=incident.person,
+                                     access_camera_name=access_matrix.camera_name(clip.camera_id))
+            return
+    try:
+        os.remove(clip.path)
+    except OSError as e:
+        logger.error("Cannot remove the clip %s: %s", clip.path, e)
+
+
+def sweep_clips(clips_dir: str, retention_hours: float):
+    """Remove the clips older than retention_hours: the sent ones are removed by the dispatcher, not the others"""
+    if not os.path.isdir(clips_dir):
+        return
+    deadline = time.time() - retention_hours * 3600
+    for name in os.listdir(clips_dir):
+        path = os.path.join(clips_dir, name)
+        try:
+            if name.endswith(".mp4") and os.path.getmtime(path) < deadline:
+                os.remove(path)
+                logger.debug("Clip %s removed, older than %s hours", path, retention_hours)
+        except OSError as e:
+            logger.error("Cannot remove the clip %s: %s", path, e)
+
+
+def init_metrics(config: Config, frame_controller) -> tuple[MetricsAggregator, MetricsRegistry, MetricsServer | None]:
+    """The aggregator of the metrics of every process, the registry of the detection loop and the /metrics server"""
+    aggregator = MetricsAggregator()
+    metrics = aggregator.registry("main")
+    aggregator.add_registry(frame_controller.metrics)
+    aggregator.add_registry(t_bot.metrics)
+    t_bot.set_stats_source(aggregator)
+    server = None
+    if config.metrics_config['enabled']:
+        try:
+            server = MetricsServer(aggregator, host=config.metrics_config['host'], port=config.metrics_config['port'])
+            server.start()
+        except OSError as e:
+            logger.error("Cannot serve the metrics on port %s: %s", config.metrics_config['port'], e)
+    return aggregator, metrics, server
+
+
+def init_governor(config: Config, frame_controller, aggregator: MetricsAggregator) -> LoadGovernor | None:
+    if not config.governor_config['enabled']:
+        return None
+    return LoadGovernor({source.id: source.degradation_level for source in frame_controller.sources},
+                        len(config.governor_config['ladder']),
+                        slo=config.governor_config['slo'],
+                        queue_high=config.governor_config['queue_high'],
+                        recover=config.governor_config['recover'],
+                        cooldown=config.governor_config['cooldown'],
+                        metrics_for=aggregator.registry)
+
+
+def log_pipeline_summary(aggregator: MetricsAggregator, frame_controller):
+    """
+    One line with the frames of all the cameras, as of their last metrics snapshot, and the queue depth.
+    Every frame produced is strided, gated, empty (no persons), dropped or delivered, except the ones of the batch
+    being processed.
+    """
+    gauges = frame_controller.metrics.gauges
+    logger.info("Frames produced %d, strided %d, gated by motion %d, without persons %d, dropped on full queue %d, "
+                "delivered %d; queue depth %s (peak %s) of %s",
+                aggregator.total("produced"), aggregator.total("strided"), aggregator.total("gated"),
+                aggregator.total("empty"), aggregator.total("dropped_full"), aggregator.total("delivered"),
+                gauges.get("queue_depth", "?"), gauges.get("queue_depth_peak", "?"), gauges.get("queue_max_size", "?"))
+
 
-def process_detections(database, frame_controller):
+def process_detections(database, frame_controller, profiler: Profiler = None):
     """Process detections continuously."""
+    aggregator, metrics, metrics_server = init_metrics(config, frame_controller)
+    governor = init_governor(config, frame_controller, aggregator)
+    last_summary = last_stats = time.monotonic()
+    last_sweep = float('-inf')
     frame_controller.start_frame_sources()
     while not frame_controller.sources_setup_complete():
         logger.info("Waiting for frame sources to be setup")
         sleep(0.5)
-    with database() as db:
-        while frame_controller.has_alive_sources():
-            detections = frame_controller.fetch_and_get_frames()
-            if not detections:
-                continue
-            for detection in detections:
-                for camera_id, person, img in detection:
+    access_matrix = AccessDecisionMatrix(database.db_path)
+    events_writer = DetectionEventWriter(database, flush_interval=config.events_flush_interval,
+                                         retention_days=config.events_retention_days)
+    events_writer.start()
+    violations = defaultdict(lambda: deque(maxlen=16))  # recent violations of each camera, to match the clips
+    sequences = SequenceTracker()
+    incident_engine = IncidentEngine(
+        on_open=lambda incident: incident_opened(incident, access_matrix, events_writer, violations),
+        on_close=lambda incident: incident_closed(incident, access_matrix, events_writer),
+        gap=config.incidents_config['gap'],
+        max_duration=config.incidents_config['max_duration'],
+        max_frames=config.incidents_config['max_frames'],
+    )
+    while frame_controller.has_alive_sources():
+        if profiler is not None:
+            profiler.poll()
+        detections = frame_controller.fetch_and_get_frames()
+        incident_engine.close_expired()
+        if config.clips_config['enabled'] and time.monotonic() - last_sweep >= 600:
+            last_sweep = time.monotonic()
+            sweep_clips(config.clips_config['clips_dir'], config.clips_config['retention_hours'])
+        if config.metrics_config['enabled'] and time.monotonic() - last_summary >= config.metrics_config['summary_interval']:
+            last_summary = time.monotonic()
+            log_pipeline_summary(aggregator, frame_controller)
+        if config.metrics_config['enabled'] and time.monotonic() - last_stats >= config.metrics_config['interval']:
+            # computed here once per interval, /stats only reads it
+            last_stats = time.monotonic()
+            process_usage(metrics)
+            aggregator.refresh_stats()
+            if governor is not None:
+                governor.update(aggregator.stats)
+        if not detections:
+            continue
+        try:
+            # reload the access list only if the bot changed it
+            access_matrix.refresh()
+        except Exception as e:
+            logger.error("Cannot refresh the access matrix, using the last one: %s", e)
+        for detection in detections:
+            for message in detection:
+                if isinstance(message, MetricsSnapshot):
+                    aggregator.update(message)
+                    continue
+                if isinstance(message, ClipMessage):
+                    clip_received(message, access_matrix, violations)
+                    continue
+                camera_metrics = aggregator.registry(message.camera_id)
+                lost = sequences.update(message)
+                if lost:
+                    logger.debug("Camera %s: %s frames lost before frame %s", message.camera_id, lost, message.seq)
+                    camera_metrics.inc("lost_frames", lost)
+                for person, confidence, box in message.persons():
                     person = person or UNKNOWN_SPECIAL_USER
-                    if check_access(person, camera_id, db):
-                        continue
-                    logger.critical(f"Person %s has no access to room %s", person or 'Unknown', camera_id)
-                    camera_name = db.get_camera_name(camera_id)
-                    t_bot.send_detection_img(img, person_detected_name=person or "Unknown", access_camera_name=camera_name)
+                    with metrics.timer("access"):
+                        violation = not check_access(person, message.camera_id, access_matrix)
+                    incident_engine.add(message.camera_id, person, message.frame, violation=violation,
+                                        confidence=confidence, timestamp=message.capture_ts, box=box)
+                camera_metrics.observe("capture_to_decision", time.time() - message.capture_ts)
+    incident_engine.close_all()
+    access_matrix.close()
+    events_writer.stop()
     frame_controller.stop_sources()
+    if metrics_server is not None:
+        metrics_server.stop()
 
 def run_app():
     init_logger(config)
     database = init_database(config)
-    frame_controller = init_frame_controller(config)
-    register_signal_handler(frame_controller)
+    ensure_tuned_profile(config)
+    if config.profiling_config['enabled']:
+        # before the processes register, the pids of the previous run may belong to other processes by now
+        reset_run_directory(config.profiling_config['directory'])
+    compositor = init_compositor(config)
+    frame_controller = init_frame_controller(config, compositor)
+    register_signal_handler(frame_controller, compositor)
+    if compositor is not None:
+        compositor.start()
+    profiler = None
+    if config.profiling_config['enabled']:
+        # the signal handler needs the main thread, the profiled loop is the detections thread
+        profiler = Profiler("main", **profiling_kwargs(config))
+        profiler.install()
     
     bot_thread = Thread(target=t_bot.start_bot, args=(config.logger_config['level'], True), daemon=False)
-    detections_thread = Thread(target=process_detections, args=(database, frame_controller), daemon=False)
+    detections_thread = Thread(target=process_detections, args=(database, frame_controller, profiler), daemon=False)
     
     bot_thread.start()
     detections_thread.start()
     bot_thread.join()
     detections_thread.join()
+    if compositor is not None:
+        compositor.stop()
+    if profiler is not None:
+        profiler.uninstall()
 
 if __name__ == "__main__":
     run_app()
@@ -50,26 +50,40 @@ class MotionDetector(Logger):
             self.logger.debug("Optical Flow detection result: %s", result)
             return result
 
-    def _mog2_motion_detector(self, frame: np.ndarray) -> bool:
-        """Internal method for motion detection using MOG2."""
+    def score(self, *frames: np.ndarray) -> float:
+        """
+        The amount of motion, compared with the threshold by detect():
+        for 'mog2' the area of the largest moving contour, for 'optical_flow' the mean flow magnitude.
+        Used to cache the motion of recorded videos and re-apply different thresholds (see camera.detection_cache).
+        """
+        if self.detector == "mog2":
+            return self._mog2_score(frames[0])
+        return self._optical_flow_score(frames[0], frames[1])
+
+    def _mog2_score(self, frame: np.ndarray) -> float:
         mask = self.bg_subtractor.apply(frame)
         contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-        for cnt in contours:
-            if cv.contourArea(cnt) > self.min_area:
-                return True
-        return False
+        return max((cv.contourArea(cnt) for cnt in contours), default=0.0)
 
-    def _optical_flow_motion_detector(
-            self, prev_frame: np.ndarray, curr_frame: np.ndarray
-    ) -> bool:
-        """Internal method for motion detection using optical flow."""
-        prev_gray = cv.cvtColor(prev_frame, cv.COLOR_BGR2GRAY)
-        curr_gray = cv.cvtColor(curr_frame, cv.COLOR_BGR2GRAY)
+    def _optical_flow_score(self, prev_frame: np.ndarray, curr_frame: np.ndarray) -> float:
+        # the frames may be already gray, see FramePreprocessor
+        prev_gray = prev_frame if prev_frame.ndim == 2 else cv.cvtColor(prev_frame, cv.COLOR_BGR2GRAY)
+        curr_gray = curr_frame if curr_frame.ndim == 2 else cv.cvtColor(curr_frame, cv.COLOR_BGR2GRAY)
         flow = cv.calcOpticalFlowFarneback(
             prev_gray, curr_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0
         )
         mag, _ = cv.cartToPolar(flow[..., 0], flow[..., 1])
-        return mag.mean() > self.threshold
+        return float(mag.mean())
+
+    def _mog2_motion_detector(self, frame: np.ndarray) -> bool:
+        """Internal method for motion detection using MOG2."""
+        return self._mog2_score(frame) > self.min_area
+
+    def _optical_flow_motion_detector(
+            self, prev_frame: np.ndarray, curr_frame: np.ndarray
+    ) -> bool:
+        """Internal method for motion detection using optical flow."""
+        return self._optical_flow_score(prev_frame, curr_frame) > self.threshold
 
     def __call__(self, *frames: np.ndarray) -> bool:
         """Allow the instance to be called as a function to detect motion."""
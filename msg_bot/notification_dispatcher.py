@@ -0,0 +1,267 @@
+import os
+import queue
+import time
+from collections import deque
+from io import BytesIO
+from threading import Thread, Lock, Event
+from typing import Callable
+
+import numpy as np
+import telebot
+from telebot.apihelper import ApiTelegramException
+
+from local_utils.image_encoding import JpegProfile
+from local_utils.logger import Logger
+from local_utils.metrics import MetricsRegistry, timed
+
+
+class TelegramRateLimiter:
+    """
+    Schedules the bot requests to respect the Telegram limits: about 30 messages per second
+    overall and 1 message per second in the same chat.
+    Every call to wait() reserves the first free slot for the chat and sleeps until then,
+    so concurrent workers never exceed the limits.
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_interval: float = 1.0):
+        self.global_interval = 1.0 / global_rate
+        self.per_chat_interval = per_chat_interval
+        self._next_global = 0.0
+        self._next_chat: dict[int, float] = {}
+        self._lock = Lock()
+
+    def wait(self, chat_id: int):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = slot + self.global_interval
+            self._next_chat[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Notification:
+    def __init__(self, photos: list[bytes | np.ndarray], caption: str, boxes: list = None, video: str = None,
+                 capture_ts: float = None, delete_video: bool = False):
+        """
+        photos: a single photo is sent as it is, more photos are sent as an album.
+            BGR frames are encoded by the dispatcher workers, bytes are already encoded JPEGs.
+        boxes: for each photo, the person boxes to annotate it with (None if unknown)
+        video: path of a video to send instead of the photos
+        delete_video: remove the video file once sent, or given up
+        capture_ts: time.time() when the camera captured the frame, to measure the capture to notification latency
+        """
+        self.photos = photos
+        self.caption = caption
+        self.boxes = boxes if boxes is not None else [None] * len(photos)
+        self.video = video
+        self.delete_video = delete_video
+        self.capture_ts = capture_ts
+        self.enqueued_at = time.monotonic()
+
+
+class NotificationDispatcher(Logger):
+    """
+    Sends the violation notifications to every user from a pool of worker threads, off the detection loop.
+    submit() never blocks: when the queue is full the notification is dropped and counted.
+    The photos are uploaded only to the first recipient, the others get the file_ids returned by Telegram.
+    Failed requests are retried with exponential backoff (or after the time asked by Telegram on 429).
+    Raw frames are JPEG encoded by the workers too, with the given JpegProfile.
+    """
+
+    def __init__(self, bot: telebot.TeleBot, get_recipients: Callable[[], list[int]], *,
+                 workers: int = 2, max_queue_size: int = 32, max_retries: int = 3, backoff: float = 1.0,
+                 rate_limiter: TelegramRateLimiter = None, jpeg_profile: JpegProfile = None,
+                 metrics: MetricsRegistry = None):
+        """
+        bot: the bot used to send the photos
+        get_recipients: returns the chat ids to notify, called once for each notification
+        workers: number of sending threads
+        max_queue_size: notifications waiting to be sent, after that new ones are dropped
+        max_retries: retries of a failed request before giving up on that recipient
+        backoff: seconds before the first retry, doubled at every retry
+        metrics: registry of the "encode" and "send" latencies, None to not measure them
+        """
+        Logger.__init__(self, name=self.__class__.__name__)
+        self.bot = bot
+        self.get_recipients = get_recipients
+        self.n_workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TelegramRateLimiter()
+        self.jpeg_profile = jpeg_profile if jpeg_profile is not None else JpegProfile()
+        self.metrics = metrics
+        self.notifications = queue.Queue(maxsize=max_queue_size)
+        self.workers: list[Thread] = []
+        self._stop_event = Event()
+
+        self._stats_lock = Lock()
+        self.submitted = self.sent = self.dropped = self.failed = 0
+        self._queue_latencies = deque(maxlen=1000)
+
+    def start(self):
+        if self.workers:
+            return
+        self._stop_event.clear()
+        for i in range(self.n_workers):
+            worker = Thread(target=self._work, name=f"{self.__class__.__name__}-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+        self.logger.info("stopped: %s", self.stats())
+
+    def submit(self, photo: bytes | np.ndarray, caption: str, boxes=None, capture_ts: float = None) -> bool:
+        """
+        Queue a notification, returns False if it has been dropped.
+        photo: encoded JPEG or BGR frame, the frame must not be modified afterwards
+        boxes: person boxes of the frame
+        capture_ts: capture time of the frame, if known
+        """
+        return self._submit(Notification([photo], caption, [boxes], capture_ts=capture_ts))
+
+    def submit_album(self, photos: list[bytes | np.ndarray], caption: str, boxes: list = None) -> bool:
+        """Queue a notification with many photos, sent as a single album"""
+        return self._submit(Notification(photos, caption, boxes))
+
+    def submit_video(self, path: str, caption: str, delete: bool = False) -> bool:
+        """
+        Queue a notification with the video file at path.
+        delete: the dispatcher owns the file and removes it once sent, given up or dropped
+        """
+        notification = Notification([], caption, video=path, delete_video=delete)
+        if self._submit(notification):
+            return True
+        self._remove_video(notification)
+        return False
+
+    def _submit(self, notification: Notification) -> bool:
+        caption = notification.caption
+        try:
+            self.notifications.put_nowait(notification)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            self.logger.warning("notifications queue full, notification dropped: %s", caption)
+            return False
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            latencies = sorted(self._queue_latencies)
+            return {
+                "queued": self.notifications.qsize(),
+                "submitted": self.submitted,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "queue_latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "queue_latency_max": latencies[-1] if latencies else None,
+            }
+
+    def _work(self):
+        while not self._stop_event.is_set():
+            try:
+                notification = self.notifications.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._stats_lock:
+                self._queue_latencies.append(time.monotonic() - notification.enqueued_at)
+            try:
+                self._deliver(notification)
+            except Exception as e:
+                self.logger.error("cannot deliver notification: %s", e)
+            finally:
+                self._remove_video(notification)
+
+    def _remove_video(self, notification: Notification):
+        if notification.video is None or not notification.delete_video:
+            return
+        try:
+            os.remove(notification.video)
+        except OSError as e:
+            self.logger.error("cannot remove the video %s: %s", notification.video, e)
+
+    def _deliver(self, notification: Notification):
+        recipients = self.get_recipients()
+        if not recipients:
+            return
+        if notification.video is not None:
+            self._deliver_video(notification, recipients)
+            return
+        with timed(self.metrics, "encode"):
+            jpegs = [
+                photo if isinstance(photo, bytes) else self.jpeg_profile.encode(photo, boxes)
+                for photo, boxes in zip(notification.photos, notification.boxes)
+            ]
+        file_ids = None
+        for chat_id in recipients:
+            # uploaded once, sent by reference to the others
+            photos = file_ids if file_ids is not None else [BytesIO(jpeg) for jpeg in jpegs]
+            messages = self._send(chat_id, photos, notification.caption)
+            if messages is None:
+                continue
+            with self._stats_lock:
+                self.sent += 1
+            if file_ids is None and notification.capture_ts is not None and self.metrics is not None:
+                # the first recipient got it
+                self.metrics.observe("capture_to_notification", time.time() - notification.capture_ts)
+            if file_ids is None and all(message.photo for message in messages):
+                file_ids = [message.photo[-1].file_id for message in messages]
+
+    def _deliver_video(self, notification: Notification, recipients: list[int]):
+        with open(notification.video, 'rb') as f:
+            video = f.read()
+        file_id = None
+        for chat_id in recipients:
+            media = [file_id if file_id is not None else BytesIO(video)]
+            messages = self._send(chat_id, media, notification.caption, video=True)
+            if messages is None:
+                continue
+            with self._stats_lock:
+                self.sent += 1
+            if file_id is None and messages[0].video:
+                file_id = messages[0].video.file_id
+
+    def _send_request(self, chat_id: int, photos: list, caption: str, video: bool = False) -> list:
+        for photo in photos:
+            if isinstance(photo, BytesIO):
+                photo.seek(0)
+        if video:
+            return [self.bot.send_video(chat_id=chat_id, video=photos[0], caption=caption)]
+        if len(photos) == 1:
+            return [self.bot.send_photo(chat_id=chat_id, photo=photos[0], caption=caption)]
+        media = [telebot.types.InputMediaPhoto(photo, caption=caption if i == 0 else None) for i, photo in enumerate(photos)]
+        return self.bot.send_media_group(chat_id=chat_id, media=media)
+
+    def _send(self, chat_id: int, photos: list, caption: str, video: bool = False) -> list | None:
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(chat_id)
+            try:
+                with timed(self.metrics, "send"):
+                    return self._send_request(chat_id, photos, caption, video)
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    delay = e.result_json.get('parameters', {}).get('retry_after', delay)
+                elif e.error_code < 500:
+                    # bad request, bot blocked by the user, ...: retrying won't help
+                    self.logger.error("cannot notify chat %s: %s", chat_id, e)
+                    break
+                error = e
+            except Exception as e:
+                error = e
+            if attempt < self.max_retries:
+                self.logger.warning("cannot notify chat %s, retrying in %s seconds: %s", chat_id, delay, error)
+                if self._stop_event.wait(delay):
+                    break
+                delay *= 2
+        with self._stats_lock:
+            self.failed += 1
+        return None
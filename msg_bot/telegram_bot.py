@@ -1,5 +1,7 @@
 import os
 import re
+import tempfile
+import time
 from threading import Thread
 from typing import Union
 
@@ -9,13 +11,16 @@ import telebot.types as types
 from telebot.formatting import format_text, mbold, hcode
 from pathlib import Path
 from random import randint
-from time import time  # NEW: Import time for cooldown check
 
 import local_utils.config
+from local_utils.image_encoding import JpegProfile
 from local_utils.logger import get_logger
+from local_utils.metrics import MetricsRegistry, MetricsAggregator
+from local_utils.profiling import MODES as PROFILING_MODES, request_profile, targets as profiling_targets
 from msg_bot.utils import require_auth, empty_answer_callback_query, override_call_message_id_with_from_user_id, \
     authenticate_user
 from db.db_lite import TBDatabase, get_database
+from msg_bot.notification_dispatcher import NotificationDispatcher, TelegramRateLimiter
 from face_recognizer.face_recognizer import FaceRecognizer
 from io import BytesIO
 from PIL import Image
@@ -32,11 +37,32 @@ DB: TBDatabase = get_database(config.db_path, dropdb=config.drop_db)
 
 logger = get_logger(__name__)
 
-notification_tracker = {}
-
 auth_token = config.auth_token
 basedir_enroll_path = config.basedir_enroll_path
 
+
+def get_notification_recipients() -> list[int]:
+    with DB() as db:
+        return [user_id for user_id, in db.get_users()]
+
+
+metrics = MetricsRegistry("bot")  # latencies of the notifications, collected by main.py
+stats_source: MetricsAggregator | None = None  # set by main.py, its stats are shown by /stats
+
+dispatcher = NotificationDispatcher(
+    bot, get_notification_recipients,
+    workers=config.notifications_config['workers'],
+    max_queue_size=config.notifications_config['max_queue_size'],
+    max_retries=config.notifications_config['max_retries'],
+    backoff=config.notifications_config['backoff'],
+    rate_limiter=TelegramRateLimiter(
+        global_rate=config.notifications_config['global_rate'],
+        per_chat_interval=config.notifications_config['per_chat_interval'],
+    ),
+    jpeg_profile=JpegProfile(**config.jpeg_config),
+    metrics=metrics,
+)
+
 BLACK_LISTED, WHITE_LISTED, PERSON_UNICODE = u"\U0001F6AB", u"\U00002705", u'\U0001F464'
 
 
@@ -105,51 +131,76 @@ def abort_callback_query(call: types.CallbackQuery):
     return
 
 
-def send_detection_img(img: Union[Image.Image, np.ndarray], *, person_detected_name: str = 'Unknown',
-                       access_camera_name: str = 'Unknown camera'):
+def to_bgr(img: Union[Image.Image, np.ndarray, bytes]) -> Union[np.ndarray, bytes]:
+    """The dispatcher takes BGR frames or already encoded JPEG bytes"""
+    if isinstance(img, Image.Image):
+        return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+    return img
+
+
+def set_stats_source(aggregator: MetricsAggregator):
+    global stats_source
+    stats_source = aggregator
+
+
+def format_stats(stats: dict) -> str:
+    """The text of /stats, from MetricsAggregator.stats"""
+    def ms(seconds):
+        return f"{seconds * 1000:.0f}" if seconds is not None else "-"
+
+    def number(value, fmt=".1f", scale=1.0):
+        return format(value * scale, fmt) if value is not None else "-"
+
+    names = {str(source.id): source.name for source in config.video_frame_controller.sources}
+    lines = []
+    for camera, camera_stats in stats["cameras"].items():
+        yolo = camera_stats["yolo"]
+        lines.append(f"{names.get(camera, 'camera ' + camera)}: {number(camera_stats['fps'])} fps, "
+                     f"motion {number(camera_stats['motion_rate'], '.0f', 100)}%, "
+                     f"yolo p50/p95/p99 {'/'.join(ms(yolo.get(q)) for q in (0.5, 0.95, 0.99))} ms, "
+                     f"decision p95 {ms(camera_stats['decision_p95'])} ms, dropped {camera_stats['dropped']:.0f}"
+                     + (f", degraded to level {camera_stats['level']:.0f}" if camera_stats['level'] else ""))
+    queue = stats["queue"]
+    if queue:
+        lines.append(f"Queue: {queue.get('queue_depth', '-')} of {queue.get('queue_max_size', '-')} "
+                     f"(peak {queue.get('queue_depth_peak', '-')})")
+    for name, usage in stats["processes"].items():
+        lines.append(f"{name}: RSS {number(usage['rss_bytes'], '.0f', 1 / 2 ** 20)} MB, "
+                     f"CPU {number(usage['cpu_percent'], '.0f')}%")
+    lines.append(f"updated {time.time() - stats['timestamp']:.0f} seconds ago")
+    return "\n".join(lines)
+
+
+def send_detection_img(img: Union[Image.Image, np.ndarray, bytes], *, person_detected_name: str = 'Unknown',
+                       access_camera_name: str = 'Unknown camera', boxes=None, capture_ts: float = None):
     """
     When a violation is detected we must notify all registered users.
+    The image is queued to the dispatcher, which encodes and sends it from its own threads.
+    capture_ts: time.time() when the camera captured the image
     """
-    global notification_tracker
-    now = time()
-    tracker = notification_tracker.get(access_camera_name)
-    if tracker:
-        window_start, count = tracker
-        if now - window_start < 60:
-            if count >= 2:
-                logger.info("Cooldown active for camera: %s", access_camera_name)
-                return  # Skip notification due to cooldown
-            else:
-                notification_tracker[access_camera_name] = (window_start, count + 1)
-        else:
-            notification_tracker[access_camera_name] = (now, 1)
-    else:
-        notification_tracker[access_camera_name] = (now, 1)
-
-    with DB() as db:
-        users = db.get_users()
+    caption = f'Violation detected, "{person_detected_name}" has accessed to {access_camera_name}'
+    if dispatcher.submit(to_bgr(img), caption, boxes, capture_ts=capture_ts):
+        logger.info("Notification queued for the violation by %s in camera %s", person_detected_name, access_camera_name)
 
-    buf = BytesIO()
-    if isinstance(img, Image.Image):
-        img = img
-    else:
-        # 'img' is likely a NumPy array in BGR
-        if img.dtype != np.uint8:
-            img = img.astype(np.uint8)
-        # Convert from BGR to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        # Now create a PIL image
-        img = Image.fromarray(img_rgb)
 
-    img.save(buf, format='JPEG')
+def send_incident_album(imgs: list[Union[Image.Image, np.ndarray, bytes]], *, person_detected_name: str = 'Unknown',
+                        access_camera_name: str = 'Unknown camera', duration: float = 0, detections: int = 0,
+                        boxes: list = None):
+    """
+    When a violation incident ends, send the best frames of it to all registered users as a single album.
+    boxes: for each image, the person boxes to annotate it with (None if unknown)
+    """
+    caption = (f'Violation ended, "{person_detected_name}" stayed in {access_camera_name} '
+               f'for {duration:.0f} seconds ({detections} detections)')
+    if dispatcher.submit_album([to_bgr(img) for img in imgs], caption, boxes):
+        logger.info("Album queued for the incident of %s in camera %s", person_detected_name, access_camera_name)
 
-    caption = f'Violation detected, "{person_detected_name}" has accessed to {access_camera_name}'
-    for user_id in users:
-        buf.seek(0)
-        bot.send_photo(chat_id=user_id, photo=buf, caption=caption)
 
-    # global logger
-    logger.info("All users notified of the violation by %s in camera %s", person_detected_name, access_camera_name)
+def send_incident_clip(path: str, *, person_detected_name: str = 'Unknown', access_camera_name: str = 'Unknown camera'):
+    """Send the clip recorded around the start of a violation to all registered users, the file is removed afterwards"""
+    caption = f'Clip of "{person_detected_name}" accessing {access_camera_name}'
+    if dispatcher.submit_video(path, caption, delete=True):
+        logger.info("Clip queued for the violation by %s in camera %s", person_detected_name, access_camera_name)
 
 
 @bot.message_handler(commands=['start'])
@@ -167,6 +218,8 @@ def send_help(message):
                      "\t/enroll - Enroll new person in the system\n" + \
                      "\t/list - List all the people enrolled in the system and manage their accesses\n" + \
                      "\t/remove - Remove a person from the system\n" + \
+                     "\t/stats - Show whether the cameras are keeping up\n" + \
+                     "\t/profile - Profile a camera process or the main process for some seconds\n" + \
                      "")
 
 
@@ -221,6 +274,42 @@ def list_people(message):
     bot.send_message(message.chat.id, 'People enrolled into the system', reply_markup=markup)
 
 
+@bot.message_handler(commands=['stats'])
+@require_auth(bot=bot, db=DB)
+def show_stats(message):
+    stats = stats_source.stats if stats_source is not None else None
+    if stats is None:
+        bot.send_message(message.chat.id, 'No statistics yet, are the metrics enabled?')
+        return
+    bot.send_message(message.chat.id, format_stats(stats))
+
+
+@bot.message_handler(commands=['profile'])
+@require_auth(bot=bot, db=DB)
+def profile_process(message):
+    """/profile <target> [mode] [seconds]: the process profiles itself and writes the result in the profiling directory"""
+    directory = config.profiling_config['directory']
+    available = profiling_targets(directory)
+    args = message.text.split()[1:]
+    if not config.profiling_config['enabled'] or not available:
+        bot.send_message(message.chat.id, 'Profiling is not enabled')
+        return
+    if not args or args[0] not in available:
+        bot.send_message(message.chat.id, f"usage: /profile <target> [{'|'.join(PROFILING_MODES)}] [seconds]\n"
+                                          f"targets: {', '.join(available)}")
+        return
+    target = args[0]
+    mode = args[1] if len(args) > 1 else PROFILING_MODES[0]
+    try:
+        seconds = float(args[2]) if len(args) > 2 else 30
+        request_profile(target, mode, seconds, directory)
+    except ValueError as e:
+        bot.send_message(message.chat.id, f"Cannot profile {target}: {e}")
+        return
+    bot.send_message(message.chat.id, f"Profiling {target} ({mode}) for {seconds:g} seconds, "
+                                      f"the result will be in {directory}")
+
+
 # ------------------- CALLBACKS QUERIES -------------------
 
 
@@ -360,6 +449,8 @@ def get_override_answer(call: types.CallbackQuery):
     enroll_name = call.data[1]
     if answer in ['y', 'yes']:
         enroll_user(call.message, True, enroll_name)
+    elif answer in ['a', 'add']:
+        enroll_user(call.message, True, enroll_name, append_sample=True)
     elif answer in ['n', 'no']:
         bot.send_message(call.message.chat.id, 'No override applied, operation aborted')
     else:
@@ -367,7 +458,7 @@ def get_override_answer(call: types.CallbackQuery):
         bot.register_next_step_handler(call.message, get_override_answer, enroll_name)
     bot.delete_message(call.message.chat.id, call.message.id)
 
-def enroll_user(message, override_enrollment=False, enroll_person_name=''):
+def enroll_user(message, override_enrollment=False, enroll_person_name='', append_sample=False):
     if not authenticate_user(message, DB, bot):
         return
 
@@ -385,20 +476,32 @@ def enroll_user(message, override_enrollment=False, enroll_person_name=''):
     with DB() as db:
         if not override_enrollment and db.person_already_enrolled(enroll_person_name):
             markup = telebot.util.quick_markup({
-                answ: {'callback_data': CommandName.join_data(CommandName.ANSWER_ENROLL_YES_NO, answ, enroll_person_name)} for answ in ['Yes', 'No']
-            }, row_width=2)
+                answ: {'callback_data': CommandName.join_data(CommandName.ANSWER_ENROLL_YES_NO, answ, enroll_person_name)} for answ in ['Yes', 'No', 'Add']
+            }, row_width=3)
 
             bot.send_message(message.chat.id,
-                             f'{enroll_person_name} already enrolled into the system, do you want to override it with the new image?',
+                             f'{enroll_person_name} already enrolled into the system, do you want to override it with the new image?\n'
+                             f'Select "Add" to keep the current images and add the new one',
                              reply_markup=markup
                              )
             return
-    bot.send_message(message.chat.id, f"Send a photo with {enroll_person_name} face to enroll in the system")
+    bot.send_message(message.chat.id, f"Send a photo with {enroll_person_name} face to enroll in the system, "
+                                      f"or a short video of the face to enroll the best frames of it")
     bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_person_name,
-                                   override=override_enrollment)
+                                   override=override_enrollment, append=append_sample)
+
 
+def enroll_clip_from_user(message, fr: FaceRecognizer, enroll_name: str, append=False) -> int:
+    """Download the video sent by the user and enroll the best frames of it"""
+    file_info = bot.get_file(message.video.file_id)
+    downloaded_file = bot.download_file(file_info.file_path)
+    with tempfile.NamedTemporaryFile(suffix=Path(file_info.file_path).suffix or '.mp4') as clip:
+        clip.write(downloaded_file)
+        clip.flush()
+        return fr.enroll_from_clip(clip.name, enroll_name, append=append)
 
-def enroll_photo_from_user(message, enroll_name: str, override=False, retries=2):
+
+def enroll_photo_from_user(message, enroll_name: str, override=False, retries=2, append=False):
     if not authenticate_user(message, DB, bot):
         return
 
@@ -409,10 +512,25 @@ def enroll_photo_from_user(message, enroll_name: str, override=False, retries=2)
     if retries == 0:
         bot.send_message(message.chat.id, 'Too many retries, aborting')
         return
+    if message.video is not None:
+        try:
+            bot.send_message(message.chat.id, 'Enrolling face from the video, could take a while...')
+            if enroll_clip_from_user(message, fr, enroll_name, append=append) == 0:
+                raise Exception('no single face clearly visible in the video')
+            if not override:
+                with DB() as db:
+                    db.add_enrolled_person(enroll_name)
+            bot.send_message(message.chat.id, f'{enroll_name} enrolled into the system')
+        except Exception as e:
+            bot.send_message(message.chat.id, f'Error during enrollment: {str(e)}\nRetry!')
+            bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name,
+                                           override=override, retries=retries - 1, append=append)
+        return
     if message.photo is None:
         bot.send_message(message.chat.id, 'No photo sent, try again')
         # bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name, scope=scope, camera_id=camera_id, retries=retries-1)
-        bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name, retries=retries - 1)
+        bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name,
+                                       override=override, retries=retries - 1, append=append)
         return
 
     file_id = message.photo[-1].file_id
@@ -431,7 +549,7 @@ def enroll_photo_from_user(message, enroll_name: str, override=False, retries=2)
         elif n_faces[0].shape[0] > 1:
             raise Exception('more than one face detected')
 
-        fr.enroll_face(image, enroll_name)
+        fr.enroll_face(image, enroll_name, append=append)
         # update the db with the new person
         if not override:
             with DB() as db:
@@ -440,7 +558,8 @@ def enroll_photo_from_user(message, enroll_name: str, override=False, retries=2)
     except Exception as e:
         bot.send_message(message.chat.id, f'Error during enrollment: {str(e)}\nRetry!')
         # bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name, scope=scope, camera_id=camera_id, retries=retries-1)
-        bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name, retries=retries - 1)
+        bot.register_next_step_handler(message, enroll_photo_from_user, enroll_name=enroll_name,
+                                       override=override, retries=retries - 1, append=append)
     return
 
 
@@ -525,17 +644,20 @@ def echo_all(message):
 def start_bot(logger_level, skip_pending: bool):
     global bot
     logger.info('Starting bot')
+    dispatcher.start()
     bot.polling(skip_pending=skip_pending, logger_level=logger_level)
 
 
 def stop_bot():
     bot.stop_bot()
+    dispatcher.stop()
 
 
 class TelegramBotThread(Thread):
     def stop(self):
         global bot
         bot.stop_bot()
+        dispatcher.stop()
 
 
 '''
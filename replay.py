@@ -0,0 +1,88 @@
+"""
+Process recorded videos with the detection pipeline at maximum speed, to audit incidents and tune thresholds.
+usage:
+```
+    python replay.py datasets/WiseNET/set_1/video1_1.avi datasets/WiseNET/set_1/video1_2.avi --output detections.csv
+```
+"""
+import argparse
+import csv
+
+from camera.replay import replay, replay_cached
+from incidents.incident_engine import IncidentEngine
+from local_utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", nargs="+", help="video files, their ids are their positions")
+    parser.add_argument("--yolo", default="yolo11n.pt")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--scale-size", type=int, default=100)
+    parser.add_argument("--face-recogniser-threshold", type=float, default=0.5)
+    parser.add_argument("--motion-detector", default="mog2", choices=["mog2", "optical_flow"])
+    parser.add_argument("--motion-detector-threshold", type=float, default=0.5)
+    parser.add_argument("--motion-detector-min-area", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--segment-seconds", type=float, default=60, help="length of the segments processed in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="default: number of cpus")
+    parser.add_argument("--warmup-frames", type=int, default=30, help="frames fed to the motion detector before each segment")
+    parser.add_argument("--gap", type=float, default=10, help="incidents gap, in seconds of video")
+    parser.add_argument("--output", default=None, help="csv file of the detections")
+    parser.add_argument("--cache", default=None,
+                        help="directory of the models outputs cache: the runs with different thresholds reuse them")
+    return parser.parse_args()
+
+
+def write_detections(path: str, video_paths: list[str], messages):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["video", "frame", "time", "label", "confidence", "x1", "y1", "x2", "y2"])
+        for message in messages:
+            for label, confidence, (x1, y1, x2, y2) in message.persons():
+                writer.writerow([video_paths[message.camera_id], message.seq, f"{message.capture_ts:.3f}",
+                                 label or "", "" if confidence is None else f"{confidence:.4f}", x1, y1, x2, y2])
+
+
+def main():
+    args = parse_args()
+    processor_kwargs = {
+        "yolo": args.yolo,
+        "device": args.device,
+        "scale_size": args.scale_size,
+        "face_recogniser_threshold": args.face_recogniser_threshold,
+        "motion_detector": args.motion_detector,
+        "motion_detector_threshold": args.motion_detector_threshold,
+        "motion_detector_min_area": args.motion_detector_min_area,
+    }
+    if args.cache is not None:
+        result = replay_cached(args.videos, processor_kwargs, args.cache, segment_seconds=args.segment_seconds,
+                               workers=args.workers, batch_size=args.batch_size, warmup_frames=args.warmup_frames)
+    else:
+        result = replay(args.videos, processor_kwargs, segment_seconds=args.segment_seconds, workers=args.workers,
+                        batch_size=args.batch_size, warmup_frames=args.warmup_frames)
+
+    # the video time is used as the clock of the incidents
+    incidents = []
+    engine = IncidentEngine(on_close=incidents.append, gap=args.gap, max_frames=0, score=lambda frame: 0.0)
+    for message in result.messages:
+        engine.close_expired(now=message.capture_ts)
+        for person, confidence, box in message.persons():
+            engine.add(message.camera_id, person, None, violation=False,
+                       confidence=confidence, timestamp=message.capture_ts, box=box)
+    engine.close_all()
+
+    if args.output is not None:
+        write_detections(args.output, args.videos, result.messages)
+        logger.info("detections written to %s", args.output)
+    print(f"frames: {result.frames}, time: {result.elapsed:.1f}s, fps: {result.fps:.1f}")
+    print(f"frames with persons: {len(result.messages)}, incidents: {len(incidents)}")
+    for incident in sorted(incidents, key=lambda incident: (incident.camera_id, incident.start_time)):
+        print(f"  {args.videos[incident.camera_id]} {incident.start_time:8.1f}s-{incident.end_time:8.1f}s "
+              f"{incident.person or 'unknown'} ({incident.detections} detections)")
+
+
+if __name__ == "__main__":
+    main()